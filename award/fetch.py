@@ -10,14 +10,24 @@ fetch_popularity_entities.py
 每类实体抓取其 enwiki 页面，查询过去 12 个月页面访问量并存储。
 """
 
-import asyncio, aiohttp, datetime, json, logging, re, sys
+import asyncio, aiohttp, datetime, json, logging, os, re, sys, time
+from pathlib import Path
 from typing import Dict, List
 from pythonjsonlogger import jsonlogger
-from SPARQLWrapper import SPARQLWrapper, JSON, POST
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.sparql_cache import get_cache
+from common.sparql_client import get_client
+from common import pageview_dump, pageview_store
+from common.metrics import get_metrics
 
 LOG_FILE = "popularity_entities.log"
 UA = "PopPop/c4freq 1.2 (email@example.com)"
 PV_CONC = 50
+# 设置后从本地月度 pageview dump 计算 views_12m，不再逐条请求 REST API
+PV_DUMP_DIR = os.environ.get("PV_DUMP_DIR")
+# 设置后用增量月度访问量存储（common/pageview_store.py）：只请求缺失的月份
+PV_STORE = os.environ.get("PV_STORE")
 
 
 
@@ -41,13 +51,10 @@ sh = logging.StreamHandler(sys.stdout); sh.setFormatter(logging.Formatter("%(mes
 log.addHandler(fh); log.addHandler(sh)
 
 # ---------- WDQS ----------
-WDQS = "https://query.wikidata.org/sparql"
 def run(query: str) -> List[Dict]:
-    s = SPARQLWrapper(WDQS, agent=UA)
-    s.setMethod(POST)
-    s.setQuery(query)
-    s.setReturnFormat(JSON)
-    return s.query().convert()["results"]["bindings"]
+    def live():
+        return get_client().bindings(query, agent=UA)
+    return get_cache().fetch(query, live, namespace="award")
 
 def fetch_basic(qid: str) -> List[Dict]:
     query = f"""
@@ -75,12 +82,21 @@ async def _pv_12m(sess, title, end_dt):
     s, e = start_dt.strftime("%Y%m%d"), end_dt.strftime("%Y%m%d")
     url = ( "https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/"
             f"en.wikipedia.org/all-access/all-agents/{title}/monthly/{s}/{e}" )
+    m = get_metrics()
+    m.incr("pageviews.requests")
+    t = time.perf_counter()
     try:
         async with sess.get(url, timeout=20) as r:
-            if r.status != 200: return 0
+            body = await r.read()
+            m.observe("pageviews.latency_s", time.perf_counter() - t)
+            m.incr("pageviews.bytes", len(body))
+            if r.status != 200:
+                m.incr("pageviews.http_429" if r.status == 429 else f"pageviews.http_{r.status // 100}xx")
+                return 0
             items = (await r.json()).get("items", [])
             return sum(it["views"] for it in items)
     except Exception:
+        m.incr("pageviews.errors")
         return 0
 
 async def fill_views_12m(items):
@@ -92,12 +108,28 @@ async def fill_views_12m(items):
             c["views_12m"] = v
 
 async def process_entity(name, cfg):
+    m = get_metrics()
     log.info({"phase": f"{name}_list"})
-    items = fetch_basic(cfg["qid"])
-    await fill_views_12m(items)
-    items = [x for x in items if x["views_12m"] > 0]
+    with m.phase(f"{name}_list"):
+        items = fetch_basic(cfg["qid"])
+    m.incr("entities", len(items))
+    with m.phase(f"{name}_pageviews", titles=len(items)):
+        if PV_DUMP_DIR:
+            as_of = pageview_dump.fill_views_12m(items, PV_DUMP_DIR)
+        elif PV_STORE:
+            store = pageview_store.PageviewStore(agent="all-agents")
+            as_of = pageview_store.last_complete_month()
+            stats = await store.refresh_async([x["title"] for x in items], as_of, max_conc=PV_CONC)
+            store.save()
+            stats["incomplete"] = store.fill(items, as_of)
+            log.info({"phase": f"{name}_pageviews", **stats})
+            if stats["incomplete"]:
+                print(f"⚠️  {name}: {stats['incomplete']} titles have an incomplete {pageview_store.WINDOW}-month window, left out")
+        else:
+            await fill_views_12m(items)
+            as_of = (datetime.date.today().replace(day=1) - datetime.timedelta(days=1)).strftime("%Y-%m")
+    items = [x for x in items if x.get("views_12m", 0) > 0]
     items.sort(key=lambda x: -x["views_12m"])
-    as_of = (datetime.date.today().replace(day=1) - datetime.timedelta(days=1)).strftime("%Y-%m")
     with open(cfg["outfile"], "w", encoding="utf-8") as f:
         json.dump({"as_of": as_of, name: items}, f, ensure_ascii=False, indent=2)
     log.info({"phase": "save", "file": cfg["outfile"], "as_of": as_of})
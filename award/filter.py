@@ -1,22 +1,252 @@
-import json
+# filter.py
+# 流式筛选奖项事实：逐条读入 structured_award_facts.json（或 qiongju 的 JSONL 日志），
+# 经过一串可配置的命名谓词后边读边写；一次读取可同时产出多个筛选结果，内存与奖项总数无关。
+#
+# 用法：
+#   python filter.py                                   # 同原脚本：每年固定人数 → fixed_count_awards.json
+#   python filter.py --in award_crawl.journal.jsonl \
+#       --out fixed_count_awards.json=fixed_count \
+#       --out human_popular.jsonl=human_only,min_years:5,min_popularity:100000
+#
+# 谓词链写法：逗号分隔的阶段，每个阶段 name 或 name:参数[:参数]；阶段返回 None 表示丢弃，
+# 也可以改写记录（如 fixed_count 只保留有人的数字年份并加上 count_per_year）。
+# 输出按扩展名：.json 写成与 json.dump(indent=2) 逐字节相同的对象，.jsonl 每行 {"label": ..., ...}
 
-with open('structured_award_facts.json', encoding='utf-8') as f:
-    award_facts = json.load(f)
+import argparse, json, os, sys
+from pathlib import Path
 
-fixed_count_awards = {}
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.metrics import get_metrics
+from award.gen import is_nonhuman   # 与生成器共用同一个"非人类"判定
 
-for award, info in award_facts.items():
+FACTS_FILE = "structured_award_facts.json"
+POP_FILE = "award_popularity.json"
+DEFAULT_OUTPUTS = ["fixed_count_awards.json=fixed_count"]
+CHUNK = 1 << 16
+
+# ---------- 增量读取 ----------
+def iter_json_object(path, chunk=CHUNK):
+    """逐个产出顶层 JSON 对象的 (key, value)；缓冲区里最多只有一个奖项。"""
+    dec = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+
+        def fill(size=chunk):
+            nonlocal buf, pos, eof
+            data = f.read(size)
+            eof = not data
+            buf, pos = buf[pos:] + data, 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def expect(ch):
+            nonlocal pos
+            skip_ws()
+            if buf[pos:pos + 1] != ch:
+                raise ValueError(f"{path}: expected {ch!r} near {buf[pos:pos + 40]!r}")
+            pos += 1
+
+        def value():
+            nonlocal pos
+            skip_ws()
+            while True:
+                try:
+                    obj, end = dec.raw_decode(buf, pos)
+                    # 顶层值都是对象 / 字符串，以定界符结尾，不会被截断成合法的前缀
+                    pos = end
+                    return obj
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    # 每次失败都要从值的开头重新解析：读入量随已缓冲的部分翻倍，总代价保持线性
+                    fill(max(chunk, len(buf) - pos))
+
+        expect("{")
+        skip_ws()
+        if buf[pos:pos + 1] == "}":
+            return
+        while True:
+            key = value()
+            expect(":")
+            yield key, value()
+            skip_ws()
+            if buf[pos:pos + 1] == ",":
+                pos += 1
+                continue
+            expect("}")
+            return
+
+def _jsonl_records(f):
+    for line in f:
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            return     # 崩溃留下的半行
+        if rec.get("t") == "fact":
+            yield rec["label"], {"qid": rec["qid"], "parent_qid": rec["parent"], "years": rec["years"]}
+        elif "label" in rec and "t" not in rec:
+            label = rec.pop("label")
+            yield label, rec
+
+def iter_jsonl(path):
+    """
+    qiongju 日志（只取 "fact" 记录）或每行一个 {"label": ..., ...} 的 JSONL。
+    同一 label 出现多次时保留最后一条，与 qiongju.compact 的覆盖规则相同（子奖项挂在多个 top 奖项下时，
+    worker 按 top 奖项顺序写日志，最后一条就是 compact 保留的那条）。
+    两遍读：第一遍只记每个 label 最后出现的位置，内存只跟 label 数有关。
+    """
+    with open(path, encoding="utf-8") as f:
+        last = {label: i for i, (label, _) in enumerate(_jsonl_records(f))}
+        f.seek(0)
+        for i, (label, info) in enumerate(_jsonl_records(f)):
+            if last[label] == i:
+                yield label, info
+
+def iter_facts(path):
+    return iter_jsonl(path) if str(path).endswith(".jsonl") else iter_json_object(path)
+
+# ---------- 谓词 ----------
+def _numeric_years(info):
     # 只用有数字的年份，不含 "unknown"
-    year_counts = [len(v) for y, v in info['years'].items() if y.isdigit() and len(v) > 0]
-    # 至少两年，且所有年份人数都一样且非0
-    if len(year_counts) >= 2 and len(set(year_counts)) == 1:
-        fixed_count_awards[award] = {
-            'qid': info['qid'],
-            'parent_qid': info.get('parent_qid'),
-            'count_per_year': year_counts[0],
-            'years': {y: v for y, v in info['years'].items() if y.isdigit() and len(v) > 0}
+    return {y: v for y, v in info["years"].items() if y.isdigit() and len(v) > 0}
+
+def fixed_count():
+    """至少两年，且所有年份人数都一样且非 0；输出只保留这些年份并记下每年人数。"""
+    def stage(label, info):
+        years = _numeric_years(info)
+        counts = {len(v) for v in years.values()}
+        if len(years) < 2 or len(counts) != 1:
+            return None
+        return {
+            "qid": info["qid"],
+            "parent_qid": info.get("parent_qid"),
+            "count_per_year": counts.pop(),
+            "years": years
         }
+    return stage
+
+def min_years(n="2"):
+    """有获奖者的数字年份不少于 n 个。"""
+    n = int(n)
+    return lambda label, info: info if len(_numeric_years(info)) >= n else None
+
+def human_only(min_ratio="1.0"):
+    """人类获奖者占比不低于 min_ratio（默认全部是人）。"""
+    min_ratio = float(min_ratio)
+
+    def stage(label, info):
+        entries = [e for v in info["years"].values() for e in v]
+        if not entries:
+            return None
+        human = sum(not is_nonhuman(e) for e in entries)
+        return info if human / len(entries) >= min_ratio else None
+    return stage
+
+def min_popularity(views="0", pop_file=POP_FILE):
+    """奖项（没有则看上级奖项）过去 12 个月的浏览量不少于 views；只加载一次热度表。"""
+    views = int(float(views))
+    with open(pop_file, encoding="utf-8") as f:
+        pop = {a["qid"]: a["views_12m"] or 0 for a in json.load(f)["award"]}
+
+    def stage(label, info):
+        v = pop.get(info["qid"], pop.get(info.get("parent_qid"), 0))
+        return info if v >= views else None
+    return stage
+
+PREDICATES = {
+    "fixed_count": fixed_count,
+    "min_years": min_years,
+    "human_only": human_only,
+    "min_popularity": min_popularity,
+}
+
+def build_chain(spec):
+    """'human_only,min_years:5' → [stage, stage]"""
+    chain = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, *args = part.split(":")
+        if name not in PREDICATES:
+            raise ValueError(f"unknown predicate {name!r}; choose from {', '.join(PREDICATES)}")
+        chain.append(PREDICATES[name](*args))
+    return chain
+
+def apply_chain(chain, label, info):
+    for stage in chain:
+        info = stage(label, info)
+        if info is None:
+            return None
+    return info
+
+# ---------- 流式写出 ----------
+class JsonObjectWriter:
+    """逐项写出顶层对象，结果与 json.dump(obj, indent=2, ensure_ascii=False) 相同。"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.tmp = self.path.with_name(self.path.name + ".tmp")
+        self.f = open(self.tmp, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, label, info):
+        body = json.dumps(info, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        self.f.write(("{\n  " if not self.count else ",\n  ") + json.dumps(label, ensure_ascii=False) + ": " + body)
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n}" if self.count else "{}")
+        self.f.close()
+        os.replace(self.tmp, self.path)
+
+class JsonlWriter(JsonObjectWriter):
+    def write(self, label, info):
+        self.f.write(json.dumps({"label": label, **info}, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+        os.replace(self.tmp, self.path)
+
+def open_writer(path):
+    return JsonlWriter(path) if str(path).endswith(".jsonl") else JsonObjectWriter(path)
+
+def run(in_path, outputs):
+    """
+    outputs: ["path=spec", ...]。一次读完输入，每条记录分别过每个输出的谓词链。
+    返回 {path: 写出条数}。
+    """
+    targets = []
+    for out in outputs:
+        path, _, spec = out.partition("=")
+        targets.append((open_writer(path), build_chain(spec)))
+    total = 0
+    m = get_metrics()
+    try:
+        with m.phase("filter", outputs=len(targets)):
+            for label, info in iter_facts(in_path):
+                total += 1
+                for writer, chain in targets:
+                    kept = apply_chain(chain, label, info)
+                    if kept is not None:
+                        writer.write(label, kept)
+            m.incr("filter.read", total)
+    finally:
+        for writer, _ in targets:
+            writer.close()
+    print(f"读入 {total} 个奖项")
+    return {str(w.path): w.count for w, _ in targets}
 
-print(f"筛选出{len(fixed_count_awards)}个每年固定人数奖项")
-with open('fixed_count_awards.json', 'w', encoding='utf-8') as f:
-    json.dump(fixed_count_awards, f, ensure_ascii=False, indent=2)
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Stream award facts through named predicate chains")
+    ap.add_argument("--in", dest="in_path", default=FACTS_FILE, help="structured_award_facts.json 或 JSONL（含 qiongju 日志）")
+    ap.add_argument("--out", action="append", metavar="PATH=CHAIN",
+                    help=f"可重复；谓词：{', '.join(PREDICATES)}（默认 {DEFAULT_OUTPUTS[0]}）")
+    args = ap.parse_args()
+    for path, n in run(args.in_path, args.out or DEFAULT_OUTPUTS).items():
+        print(f"筛选出{n}个奖项 → {path}")
@@ -1,10 +1,16 @@
-import json, math, random
+import json, math, os, random, sys
+from pathlib import Path
+import numpy as np
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.metrics import get_metrics
+
 FACTS_FILE = "structured_award_facts.json"
 POP_FILE = "award_popularity.json"
 SUBMAP_FILE = "award_sub_mapping.json"
 OUTPUT_FILE = "qa_awards_sampled.jsonl"
+ENTITY_DB = os.environ.get("ENTITY_DB")   # 设置时从 common/entity_store.py 的 SQLite 库读取上面三个文件的内容
 
 QA_CNT = 1000
 SPAN_RANGE = (3, 10)
@@ -12,6 +18,12 @@ MIN_ANSWERS = 2
 MAX_TRIES_PER_AWARD = 20
 PARENT_PROB = 0.2
 MAX_FAILS = 3000
+SAMPLER = "rejection"   # "rejection": 原随机拒绝采样；"exhaustive": 枚举全部窗口后不放回抽样；"stratified": 按难度分桶定额抽样
+SEED = 42               # exhaustive / stratified 模式的随机种子
+
+# stratified 模式：难度分桶 [lo, hi) 及每桶目标题数
+DIFFICULTY_BUCKETS = [("easy", 0.0, 1.1), ("medium", 1.1, 1.4), ("hard", 1.4, float("inf"))]
+DIFFICULTY_TARGET = {"easy": 300, "medium": 400, "hard": 300}
 
 def compute_difficulty(span, _, avg_per_year, nonhuman_ratio):
     return round(
@@ -20,41 +32,128 @@ def compute_difficulty(span, _, avg_per_year, nonhuman_ratio):
         1.0 * nonhuman_ratio, 3
     )
 
-def merge_facts_for_parent(qid, submap, facts):
+def merge_facts_for_parent(qid, submap, facts, qid_to_label=None):
+    if qid_to_label is None:
+        qid_to_label = {data["qid"]: label for label, data in facts.items()}
     years = {}
     sub_qids = submap.get(qid, [])
     for sub_qid in sub_qids:
-        sub_label = None
-        for label, data in facts.items():
-            if data["qid"] == sub_qid:
-                sub_label = label
-                break
+        sub_label = qid_to_label.get(sub_qid)
         if not sub_label or sub_label not in facts:
             continue
         for year, people in facts[sub_label]["years"].items():
             years.setdefault(year, []).extend(people)
     return years
 
-def main():
-    facts = json.load(open(FACTS_FILE, encoding="utf-8"))
-    submap = json.load(open(SUBMAP_FILE, encoding="utf-8"))
-    pop_data = json.load(open(POP_FILE, encoding="utf-8"))["award"]
-    qid_to_label = {a["qid"]: a["label"] for a in pop_data}
+def is_nonhuman(e):
+    # single.py 产出的条目只有 [label, qid]，且只查了人类
+    return len(e) > 2 and e[2] != "Q5"
 
-    print(f"🎯 Loaded {len(facts)} facts, {len(submap)} sub mappings, {len(qid_to_label)} popular labels")
+class AwardWindows:
+    """
+    单个奖项按年份的前缀和索引。
+    年份在 [y0, y1] 上稠密展开，任意 (start, end) 窗口的答案数 / 非人类数 / 有数据的年数都是 O(1)，
+    答案本身是扁平列表上的一段切片。
+    """
 
-    award_pool = []
+    def __init__(self, years):
+        self.unknown = years.get("unknown")
+        self.year_keys = sorted([y for y in years if y != "unknown"], key=int)
+        self.flat = []
+        if not self.year_keys:
+            self.y0, self.cum_n, self.cum_nh, self.cum_y = 0, [0], [0], [0]
+            return
+        self.y0 = int(self.year_keys[0])
+        span = int(self.year_keys[-1]) - self.y0 + 1
+        # cum_*[i] = 年份 < y0 + i 的累计值
+        self.cum_n = [0] * (span + 1)
+        self.cum_nh = [0] * (span + 1)
+        self.cum_y = [0] * (span + 1)
+        for y in self.year_keys:
+            i = int(y) - self.y0 + 1
+            people = years[y]
+            self.flat.extend(people)
+            self.cum_n[i] = len(people)
+            self.cum_nh[i] = sum(1 for e in people if is_nonhuman(e))
+            self.cum_y[i] = 1
+        for i in range(1, span + 1):
+            self.cum_n[i] += self.cum_n[i - 1]
+            self.cum_nh[i] += self.cum_nh[i - 1]
+            self.cum_y[i] += self.cum_y[i - 1]
+
+    def _bounds(self, start, end):
+        hi_idx = len(self.cum_n) - 1
+        lo = min(max(start - self.y0, 0), hi_idx)
+        hi = min(max(end - self.y0 + 1, 0), hi_idx)
+        return lo, max(lo, hi)
+
+    def stats(self, start, end):
+        """闭区间 [start, end] 内的 (答案数, 非人类数, 有数据的年数)。"""
+        lo, hi = self._bounds(start, end)
+        return (self.cum_n[hi] - self.cum_n[lo],
+                self.cum_nh[hi] - self.cum_nh[lo],
+                self.cum_y[hi] - self.cum_y[lo])
+
+    def answers(self, start, end):
+        lo, hi = self._bounds(start, end)
+        return self.flat[self.cum_n[lo]:self.cum_n[hi]]
+
+def build_award_index(facts, submap):
+    """一次性建好 qid → label 以及每个奖项（父奖项为合并后的）年份窗口索引。"""
+    qid_to_label = {data["qid"]: label for label, data in facts.items()}
+    index = {}
     for label, data in facts.items():
         qid = data["qid"]
-        parent_qid = data["parent_qid"]
-        is_parent = (qid == parent_qid)
-        if qid in qid_to_label:
-            award_pool.append((label, qid, is_parent))
+        if qid == data["parent_qid"]:
+            years = merge_facts_for_parent(qid, submap, facts, qid_to_label)
+        else:
+            years = data["years"]
+        index[label] = AwardWindows(years)
+    return qid_to_label, index
 
-    parents = [x for x in award_pool if x[2]]
-    children = [x for x in award_pool if not x[2]]
-    print(f"✅ parent: {len(parents)} | child: {len(children)}")
+def window_item(label, qid, is_parent, aw, start, end):
+    count, nonhuman, n_years = aw.stats(start, end)
+    ratio = nonhuman / count
+    avg_per_year = count / n_years
+    return {
+        "question": f"Who won the {label} between {start} and {end}?",
+        "answers": [[e[0], e[1]] for e in aw.answers(start, end)],
+        "answer_count": count,
+        "meta": {
+            "award": label,
+            "award_qid": qid,
+            "is_parent": is_parent,
+            "year_range": [start, end],
+            "nonhuman_ratio": round(ratio, 3),
+            "avg_per_year": round(avg_per_year, 2),
+            "span": end - start + 1
+        },
+        "difficulty": compute_difficulty(
+            end - start + 1, 0, avg_per_year, ratio
+        )
+    }
 
+def unknown_item(label, qid, is_parent, all_entities):
+    nonhuman = sum(1 for e in all_entities if is_nonhuman(e))
+    ratio = nonhuman / len(all_entities)
+    avg = len(all_entities)
+    return {
+        "question": f"Who has won the {label}?",
+        "answers": [[e[0], e[1]] for e in all_entities],
+        "answer_count": len(all_entities),
+        "meta": {
+            "award": label,
+            "award_qid": qid,
+            "is_parent": is_parent,
+            "year_range": "unknown",
+            "nonhuman_ratio": round(ratio, 3),
+            "avg_per_year": round(avg, 2),
+            "span": 0
+        },
+        "difficulty": compute_difficulty(0, 0, avg, ratio)
+    }
+
+def sample_rejection(parents, children, index):
     candidates = []
     fail_counter = 0
     pbar = tqdm(total=QA_CNT, desc="Generating QA")
@@ -69,12 +168,8 @@ def main():
             pool = children or parents
         label, qid, is_parent = random.choice(pool)
 
-        if is_parent:
-            years = merge_facts_for_parent(qid, submap, facts)
-        else:
-            years = facts[label]["years"]
-
-        year_keys = sorted([y for y in years if y != "unknown"], key=int)
+        aw = index[label]
+        year_keys = aw.year_keys
         if not year_keys:
             fail_counter += 1
             continue
@@ -89,59 +184,21 @@ def main():
                 continue
             start = random.choice(valid_starts)
             end = str(int(start) + span)
-            window = [y for y in year_keys if start <= y <= end]
-            all_entities = sum([years[y] for y in window], [])
-            if len(all_entities) < MIN_ANSWERS:
+            count, _, _ = aw.stats(int(start), int(end))
+            if count < MIN_ANSWERS:
                 continue
 
-            nonhuman = sum(1 for e in all_entities if e[2] != "Q5")
-            ratio = nonhuman / len(all_entities)
-            avg_per_year = len(all_entities) / len(window)
-
-            candidates.append({
-                "question": f"Who won the {label} between {start} and {end}?",
-                "answers": [[e[0], e[1]] for e in all_entities],
-                "answer_count": len(all_entities),
-                "meta": {
-                    "award": label,
-                    "award_qid": qid,
-                    "is_parent": is_parent,
-                    "year_range": [int(start), int(end)],
-                    "nonhuman_ratio": round(ratio, 3),
-                    "avg_per_year": round(avg_per_year, 2),
-                    "span": int(end) - int(start) + 1
-                },
-                "difficulty": compute_difficulty(
-                    int(end) - int(start) + 1, 0, avg_per_year, ratio
-                )
-            })
-            print(f"✅ {label} ({qid}) → {start}–{end}, {len(all_entities)} entities")
+            candidates.append(window_item(label, qid, is_parent, aw, int(start), int(end)))
+            print(f"✅ {label} ({qid}) → {start}–{end}, {count} entities")
             pbar.update(1)
             fail_counter = 0
             generated = True
             break
 
-        if not generated and "unknown" in years and random.random() < 0.05:
-            all_entities = years["unknown"]
+        if not generated and aw.unknown is not None and random.random() < 0.05:
+            all_entities = aw.unknown
             if len(all_entities) >= MIN_ANSWERS:
-                nonhuman = sum(1 for e in all_entities if e[2] != "Q5")
-                ratio = nonhuman / len(all_entities)
-                avg = len(all_entities)
-                candidates.append({
-                    "question": f"Who has won the {label}?",
-                    "answers": [[e[0], e[1]] for e in all_entities],
-                    "answer_count": len(all_entities),
-                    "meta": {
-                        "award": label,
-                        "award_qid": qid,
-                        "is_parent": is_parent,
-                        "year_range": "unknown",
-                        "nonhuman_ratio": round(ratio, 3),
-                        "avg_per_year": round(avg, 2),
-                        "span": 0
-                    },
-                    "difficulty": compute_difficulty(0, 0, avg, ratio)
-                })
+                candidates.append(unknown_item(label, qid, is_parent, all_entities))
                 print(f"🟡 {label} ({qid}) → unknown year, {len(all_entities)} entities")
                 pbar.update(1)
                 fail_counter = 0
@@ -150,7 +207,239 @@ def main():
         elif not generated:
             fail_counter += 1
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as fout:
+    return candidates
+
+def compute_difficulty_np(span, avg_per_year, nonhuman_ratio):
+    return np.round(
+        0.4 * np.log1p(span) +
+        0.6 * (2 - np.minimum(avg_per_year, 2)) +
+        1.0 * nonhuman_ratio, 3
+    )
+
+def enumerate_windows(award_pool, index):
+    """
+    枚举 award_pool 里每个奖项在 SPAN_RANGE 内的全部合法 (start, span) 窗口（与拒绝采样的合法性规则一致：
+    start 取自 year_keys[:-(span - 1)]，end = start + span），在拼接后的前缀和数组上向量化计算统计量，
+    并按 MIN_ANSWERS 过滤。返回等长 numpy 数组组成的 dict。
+    """
+    bases, cum_n, cum_nh, cum_y = [], [], [], []
+    aw_idx, starts, spans = [], [], []
+    offset = 0
+    for i, (label, _, _) in enumerate(award_pool):
+        aw = index[label]
+        bases.append((offset, aw.y0, len(aw.cum_n) - 1))
+        cum_n.append(aw.cum_n); cum_nh.append(aw.cum_nh); cum_y.append(aw.cum_y)
+        offset += len(aw.cum_n)
+        years = np.fromiter((int(y) for y in aw.year_keys), dtype=np.int64, count=len(aw.year_keys))
+        for span in range(SPAN_RANGE[0], SPAN_RANGE[1] + 1):
+            if len(years) <= span:
+                break
+            n = len(years) - span + 1
+            aw_idx.append(np.full(n, i, dtype=np.int64))
+            starts.append(years[:n])
+            spans.append(np.full(n, span, dtype=np.int64))
+    if not aw_idx:
+        aw_idx, starts, spans = [np.empty(0, dtype=np.int64)] * 3
+        cum_n, cum_nh, cum_y, bases = [[0]], [[0]], [[0]], [(0, 0, 0)]
+
+    cum_n = np.concatenate([np.asarray(c, dtype=np.int64) for c in cum_n])
+    cum_nh = np.concatenate([np.asarray(c, dtype=np.int64) for c in cum_nh])
+    cum_y = np.concatenate([np.asarray(c, dtype=np.int64) for c in cum_y])
+    base, y0, top = (np.array(col, dtype=np.int64) for col in zip(*bases))
+
+    award = np.concatenate(aw_idx)
+    start = np.concatenate(starts)
+    end = start + np.concatenate(spans)
+    lo = base[award] + np.clip(start - y0[award], 0, top[award])
+    hi = base[award] + np.clip(end - y0[award] + 1, 0, top[award])
+    count = cum_n[hi] - cum_n[lo]
+    nonhuman = cum_nh[hi] - cum_nh[lo]
+    n_years = cum_y[hi] - cum_y[lo]
+
+    keep = count >= MIN_ANSWERS
+    award, start, end = award[keep], start[keep], end[keep]
+    count, nonhuman, n_years = count[keep], nonhuman[keep], n_years[keep]
+    difficulty = compute_difficulty_np(end - start + 1, count / n_years, nonhuman / count)
+    return {"award": award, "start": start, "end": end, "count": count,
+            "nonhuman": nonhuman, "n_years": n_years, "difficulty": difficulty}
+
+def sample_exhaustive(award_pool, index, rng):
+    """
+    从全部合法窗口中不放回地抽 QA_CNT 个。父 / 子奖项按 PARENT_PROB 分配名额（一方不够时由另一方补），
+    每个窗口的权重为 1 / 该奖项窗口数，使各奖项被选中的机会与拒绝采样一样均等。
+    不生成 "unknown" 年份题。
+    """
+    win = enumerate_windows(award_pool, index)
+    is_parent = np.array([x[2] for x in award_pool], dtype=bool)[win["award"]]
+    per_award = np.bincount(win["award"], minlength=len(award_pool))
+    print(f"🧮 {len(win['award'])} valid windows over {np.count_nonzero(per_award)} awards")
+
+    pools = [np.flatnonzero(is_parent), np.flatnonzero(~is_parent)]
+    want_parent = min(len(pools[0]), int(round(QA_CNT * PARENT_PROB)))
+    want_child = min(len(pools[1]), QA_CNT - want_parent)
+    want_parent = min(len(pools[0]), QA_CNT - want_child)
+
+    picked = []
+    for pool, k in zip(pools, (want_parent, want_child)):
+        if k == 0:
+            continue
+        w = 1.0 / per_award[win["award"][pool]]
+        picked.append(rng.choice(pool, size=k, replace=False, p=w / w.sum()))
+    order = rng.permutation(np.concatenate(picked)) if picked else np.empty(0, dtype=np.int64)
+    if len(order) < QA_CNT:
+        print(f"⚠️  only {len(order)} valid windows available for QA_CNT={QA_CNT}")
+
+    candidates = []
+    for j in tqdm(order, desc="Generating QA"):
+        label, qid, parent = award_pool[win["award"][j]]
+        candidates.append(window_item(label, qid, parent, index[label], int(win["start"][j]), int(win["end"][j])))
+    return candidates
+
+class FenwickSampler:
+    """按权重不放回抽样：树状数组存前缀和，每次抽取和删除都是 O(log n)。"""
+
+    def __init__(self, weights):
+        self.n = len(weights)
+        self.tree = [0.0] * (self.n + 1)
+        self.w = [float(x) for x in weights]
+        for i, x in enumerate(self.w, 1):
+            self.tree[i] += x
+            j = i + (i & -i)
+            if j <= self.n:
+                self.tree[j] += self.tree[i]
+        self.left = sum(1 for x in self.w if x > 0)
+        self.step = 1 << max(self.n.bit_length() - 1, 0)
+
+    def _add(self, i, delta):
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        """池中剩余权重，直接从树上求和，与下降时用的节点值一致（不单独维护一个会漂移的总和）。"""
+        i, s = self.n, 0.0
+        while i:
+            s += self.tree[i]
+            i -= i & -i
+        return s
+
+    def draw(self, u):
+        """u ∈ [0, 1)；返回被抽中的下标并把它移出。"""
+        if self.left <= 0:
+            raise IndexError("draw from an empty FenwickSampler")
+        target, pos, step = u * self.total(), 0, self.step
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        # u 接近 1 或浮点误差时可能越过末尾、或落到权重为 0 的位置上：先夹回范围，再向后、向前找最近一个仍在池中的
+        pos = min(pos, self.n - 1)
+        while pos < self.n - 1 and self.w[pos] == 0:
+            pos += 1
+        while self.w[pos] == 0:
+            pos -= 1
+        self._add(pos, -self.w[pos])
+        self.w[pos] = 0.0
+        self.left -= 1
+        return pos
+
+def bucket_of(difficulty):
+    for name, lo, hi in DIFFICULTY_BUCKETS:
+        if lo <= difficulty < hi:
+            return name
+    return None
+
+def sample_stratified(award_pool, index, rng):
+    """
+    在全部合法窗口上按 (难度桶, 父/子) 建索引，直接按 DIFFICULTY_TARGET 抽样。
+    每桶内父奖项名额为 round(目标 × PARENT_PROB)，不足时由子奖项补，反之亦然；
+    桶内权重与 exhaustive 相同（1 / 该奖项窗口数）。某桶供给不足时抽完为止并打印各桶供给。
+    """
+    win = enumerate_windows(award_pool, index)
+    is_parent = np.array([x[2] for x in award_pool], dtype=bool)[win["award"]]
+    weights = 1.0 / np.bincount(win["award"], minlength=len(award_pool))[win["award"]]
+
+    cells = {}
+    for name, lo, hi in DIFFICULTY_BUCKETS:
+        in_bucket = (win["difficulty"] >= lo) & (win["difficulty"] < hi)
+        for parent in (True, False):
+            idx = np.flatnonzero(in_bucket & (is_parent == parent))
+            cells[name, parent] = (idx, FenwickSampler(weights[idx]))
+
+    supply = {name: {"parent": len(cells[name, True][0]), "child": len(cells[name, False][0])}
+              for name, _, _ in DIFFICULTY_BUCKETS}
+    picked, short = [], {}
+    for name, _, _ in DIFFICULTY_BUCKETS:
+        want = DIFFICULTY_TARGET.get(name, 0)
+        want_parent = min(supply[name]["parent"], int(round(want * PARENT_PROB)))
+        want_child = min(supply[name]["child"], want - want_parent)
+        want_parent = min(supply[name]["parent"], want - want_child)
+        for parent, k in ((True, want_parent), (False, want_child)):
+            idx, sampler = cells[name, parent]
+            picked.extend(idx[sampler.draw(u)] for u in rng.random(k))
+        if want_parent + want_child < want:
+            short[name] = want - want_parent - want_child
+
+    print("📊 difficulty supply: " + ", ".join(
+        f"{name} {v['parent']}p/{v['child']}c (target {DIFFICULTY_TARGET.get(name, 0)})" for name, v in supply.items()))
+    if short:
+        print("⚠️  targets not met: " + ", ".join(
+            f"{name} short by {k} (supply {sum(supply[name].values())})" for name, k in short.items()))
+
+    candidates = []
+    for j in tqdm(rng.permutation(np.array(picked, dtype=np.int64)), desc="Generating QA"):
+        label, qid, parent = award_pool[win["award"][j]]
+        candidates.append(window_item(label, qid, parent, index[label], int(win["start"][j]), int(win["end"][j])))
+    return candidates
+
+def load_inputs():
+    if ENTITY_DB:
+        from common.entity_store import award_facts, open_store, popularity, sub_mapping
+        conn = open_store(ENTITY_DB)
+        # 每个奖项都要建索引，整体一次读出，不走按奖项懒加载
+        return (award_facts(conn, Path(FACTS_FILE).stem), sub_mapping(conn, Path(SUBMAP_FILE).stem),
+                popularity(conn, Path(POP_FILE).stem))
+    facts = json.load(open(FACTS_FILE, encoding="utf-8"))
+    submap = json.load(open(SUBMAP_FILE, encoding="utf-8"))
+    pop_data = json.load(open(POP_FILE, encoding="utf-8"))["award"]
+    return facts, submap, pop_data
+
+def main():
+    m = get_metrics()
+    with m.phase("load"):
+        facts, submap, pop_data = load_inputs()
+    qid_to_label = {a["qid"]: a["label"] for a in pop_data}
+
+    print(f"🎯 Loaded {len(facts)} facts, {len(submap)} sub mappings, {len(qid_to_label)} popular labels")
+
+    award_pool = []
+    for label, data in facts.items():
+        qid = data["qid"]
+        parent_qid = data["parent_qid"]
+        is_parent = (qid == parent_qid)
+        if qid in qid_to_label:
+            award_pool.append((label, qid, is_parent))
+
+    parents = [x for x in award_pool if x[2]]
+    children = [x for x in award_pool if not x[2]]
+    print(f"✅ parent: {len(parents)} | child: {len(children)}")
+
+    with m.phase("index"):
+        _, index = build_award_index(facts, submap)
+
+    with m.phase("sample", sampler=SAMPLER):
+        if SAMPLER == "exhaustive":
+            candidates = sample_exhaustive(award_pool, index, np.random.default_rng(SEED))
+        elif SAMPLER == "stratified":
+            candidates = sample_stratified(award_pool, index, np.random.default_rng(SEED))
+        else:
+            candidates = sample_rejection(parents, children, index)
+        m.incr("qa", len(candidates))
+
+    with open(OUTPUT_FILE, "w", encoding="utf-8") as fout, m.phase("write"):
         for item in candidates:
             fout.write(json.dumps(item, ensure_ascii=False) + "\n")
 
@@ -1,30 +1,37 @@
 # fetch_award_bulk_by_subaward.py
 # 一次查全每个子奖项所有获奖对象及时间，并按年份聚合，避免限流
 
-import json, time
+import argparse, json, sys, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from SPARQLWrapper import SPARQLWrapper, JSON
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.journal import Journal, replay
+from common.metrics import get_metrics
+from common.sparql_client import SparqlError, get_client
+from common.sparql_cache import get_cache
+
 AWARD_FILE = "award_popularity.json"
 FACTS_FILE = Path("structured_award_facts.json")
 MAP_FILE = Path("award_sub_mapping.json")
-WDQS = "https://query.wikidata.org/sparql"
+JOURNAL_FILE = Path("award_crawl.journal.jsonl")   # 每个子奖项一行，崩溃后可续跑
+FSYNC_EVERY = 50
+UA = "PopPop/bulk-award-fetch 4.0"
 TOP_K = 100
-SLEEP = 1.5
-
-sparql = SPARQLWrapper(WDQS, agent="PopPop/bulk-award-fetch 4.0")
-sparql.setReturnFormat(JSON)
+WORKERS = 8        # 同时在途的查询数上限；发起速率由 common.sparql_client 的全局限速器控制
+BATCH_SIZE = 20    # 每次 VALUES 查询的初始奖项数
+MAX_BATCH = 100
+ROW_BUDGET = 20000 # 单批期望的最大返回行数
 
-def run_query(q):
-    for _ in range(3):
+def run_query(q, refresh=False, retry_timeouts=True):
+    def live():
         try:
-            sparql.setQuery(q)
-            return sparql.query().convert()
-        except Exception:
-            time.sleep(2)
-    return None
+            return get_client().query(q, agent=UA, retry_timeouts=retry_timeouts)
+        except SparqlError:
+            return None
+    return get_cache().fetch(q, live, namespace="award", refresh=refresh)
 
 def get_sub_awards(qid):
     q = f"""
@@ -33,25 +40,15 @@ def get_sub_awards(qid):
       SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
     }}"""
     result = run_query(q)
-    if not result: return []
+    if result is None: return None   # 查询失败：不当成"没有子奖项"，留给续跑重查
     return [
         {"qid": b["sub"]["value"].split("/")[-1], "label": b["subLabel"]["value"]}
         for b in result["results"]["bindings"]
     ]
 
-def fetch_bulk_recipients(qid):
-    q = f"""
-    SELECT ?entity ?entityLabel ?date ?type WHERE {{
-      ?entity p:P166 ?stmt.
-      ?stmt ps:P166 wd:{qid}.
-      OPTIONAL {{ ?stmt pq:P585 ?date. }}
-      OPTIONAL {{ ?entity wdt:P31 ?type. }}
-      SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
-    }}"""
-    result = run_query(q)
-    if not result: return {}
+def _year_map(bindings):
     year_map = {}
-    for b in result["results"]["bindings"]:
+    for b in bindings:
         try:
             ent = b["entity"]["value"].split("/")[-1]
             label = b.get("entityLabel", {}).get("value", ent)
@@ -68,42 +65,205 @@ def fetch_bulk_recipients(qid):
             continue
     return dict(sorted(year_map.items(), key=lambda kv: (kv[0] != "unknown", int(kv[0]) if kv[0].isdigit() else 9999)))
 
-def main():
+def fetch_bulk_recipients(qid):
+    q = f"""
+    SELECT ?entity ?entityLabel ?date ?type WHERE {{
+      ?entity p:P166 ?stmt.
+      ?stmt ps:P166 wd:{qid}.
+      OPTIONAL {{ ?stmt pq:P585 ?date. }}
+      OPTIONAL {{ ?entity wdt:P31 ?type. }}
+      SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
+    }}"""
+    result = run_query(q)
+    if result is None: return None
+    return _year_map(result["results"]["bindings"])
+
+class AdaptiveBatch:
+    """批大小自适应：按每个奖项的平均行数把单批控制在 row_budget 内；查询失败（多为超时）减半。"""
+
+    def __init__(self, size=BATCH_SIZE, hi=MAX_BATCH, row_budget=ROW_BUDGET):
+        self.size, self.hi, self.row_budget = min(size, hi), hi, row_budget
+        self.lock = threading.Lock()
+
+    def ok(self, n_awards, n_rows):
+        with self.lock:
+            per_award = max(1.0, n_rows / n_awards)
+            self.size = max(1, min(self.hi, self.size * 2, int(self.row_budget / per_award)))
+
+    def failed(self, n_awards):
+        with self.lock:
+            self.size = max(1, min(self.size, n_awards // 2))
+
+# 批量查询模板：{values} 处填 VALUES 的奖项列表；single.py 换成只查人类的版本，共用下面的批处理
+RECIPIENTS_QUERY = """
+    SELECT ?award ?entity ?entityLabel ?date ?type WHERE {{
+      VALUES ?award {{ {values} }}
+      ?entity p:P166 ?stmt.
+      ?stmt ps:P166 ?award.
+      OPTIONAL {{ ?stmt pq:P585 ?date. }}
+      OPTIONAL {{ ?entity wdt:P31 ?type. }}
+      SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
+    }}"""
+
+def _fetch_batch(qids, batcher, query=RECIPIENTS_QUERY, parse=_year_map):
+    # 多个奖项时超时不重试，直接二分；只剩一个时才走客户端的完整重试
+    result = run_query(query.format(values=" ".join(f"wd:{q}" for q in qids)), retry_timeouts=len(qids) == 1)
+    if result is None:
+        if len(qids) == 1:
+            return {qids[0]: None}     # 单个也失败：记为 None，调用方不写日志
+        # 多半是超时：缩小批次，二分重查
+        batcher.failed(len(qids))
+        mid = len(qids) // 2
+        return {**_fetch_batch(qids[:mid], batcher, query, parse), **_fetch_batch(qids[mid:], batcher, query, parse)}
+    rows = result["results"]["bindings"]
+    batcher.ok(len(qids), len(rows))
+    by_award = {q: [] for q in qids}
+    for b in rows:
+        award = b.get("award", {}).get("value", "").split("/")[-1]
+        if award in by_award:
+            by_award[award].append(b)
+    return {q: parse(bs) for q, bs in by_award.items()}
+
+def fetch_bulk_recipients_batch(qids, batcher=None, query=RECIPIENTS_QUERY, parse=_year_map):
+    """
+    一次 VALUES 查询多个奖项，返回 {qid: year_map}，每个 year_map 与 fetch_bulk_recipients(qid) 相同；查询失败的为 None。
+    query / parse 换成别的模板和聚合函数即可复用（见 single.py）。
+    """
+    batcher = batcher or AdaptiveBatch()
+    pending = list(dict.fromkeys(qids))
+    out = {}
+    while pending:
+        chunk, pending = pending[:batcher.size], pending[batcher.size:]
+        out.update(_fetch_batch(chunk, batcher, query, parse))
+    return out
+
+def load_top_awards():
     with open(AWARD_FILE, "r", encoding="utf-8") as f:
         awards = json.load(f)["award"]
-    top_awards = sorted(awards, key=lambda x: -x["views_12m"])[:TOP_K]
+    return sorted(awards, key=lambda x: -x["views_12m"])[:TOP_K]
+
+def load_journal(path=JOURNAL_FILE):
+    """重放日志，返回 (parent → subs, (parent, sub) → year_map)。"""
+    subs_of, facts = {}, {}
+    for rec in replay(path):
+        if rec["t"] == "subs":
+            subs_of[rec["parent"]] = rec["subs"]
+        elif rec["t"] == "fact":
+            facts[(rec["parent"], rec["qid"])] = rec["years"]
+    return subs_of, facts
+
+def compact(top_awards, path=JOURNAL_FILE):
+    """
+    把日志压实成原来的两个 JSON 文件。
+    日志行是按完成先后写的；这里按 top 奖项、子奖项的原始顺序重排，输出与串行抓取一致。
+    同一 label 以最后一条为准（award/filter.py 直接读日志时用同一规则）。
+    """
+    subs_of, facts = load_journal(path)
+    order = [a["qid"] for a in top_awards]
+    order += [q for q in subs_of if q not in set(order)]
+    all_facts, all_mapping = {}, {}
+    for qid in order:
+        if qid not in subs_of:
+            continue
+        all_mapping[qid] = list({s["qid"] for s in subs_of[qid]})  # 去重
+        for s in subs_of[qid]:
+            if (qid, s["qid"]) in facts:
+                all_facts[s["label"]] = {
+                    "qid": s["qid"],
+                    "parent_qid": qid,
+                    "years": facts[(qid, s["qid"])]
+                }
+    FACTS_FILE.write_text(json.dumps(all_facts, ensure_ascii=False, indent=2))
+    MAP_FILE.write_text(json.dumps(all_mapping, ensure_ascii=False, indent=2))
+    return all_facts, all_mapping
 
-    all_facts = {}
-    all_mapping = {}
+def main(resume=True, workers=WORKERS, batch_size=BATCH_SIZE):
+    m = get_metrics()
+    top_awards = load_top_awards()
 
-    for a in tqdm(top_awards, desc="tops"):
-        label, qid = a["label"], a["qid"]
-        print(f"\n🏁 {label} ({qid})")
+    if not resume and JOURNAL_FILE.exists():
+        JOURNAL_FILE.unlink()
+    subs_of, facts = load_journal()
+    if facts:
+        print(f"↻ resuming: {len(facts)} sub-awards already in {JOURNAL_FILE.name}")
 
-        sub_awards = get_sub_awards(qid)
+    def expand(a):
+        sub_awards = get_sub_awards(a["qid"])
+        if sub_awards is None:
+            return a["qid"], None
         # Always include parent award itself
-        sub_awards.insert(0, {"qid": qid, "label": label})
-        all_mapping[qid] = list({s["qid"] for s in sub_awards})  # 去重
-
-        for s in sub_awards:
-            sub_qid, sub_label = s["qid"], s["label"]
-            print(f"  ↪️  {sub_label} ({sub_qid})")
-            year_map = fetch_bulk_recipients(sub_qid)
-            total = sum(len(v) for v in year_map.values())
-            if total < 3:
-                print(f"  ⚠️  Warning: sparse data — only {total} recipients found")
-            all_facts[sub_label] = {
-                "qid": sub_qid,
-                "parent_qid": qid,
-                "years": year_map
-            }
-            time.sleep(SLEEP)
-
-        # 每轮写入
-        FACTS_FILE.write_text(json.dumps(all_facts, ensure_ascii=False, indent=2))
-        MAP_FILE.write_text(json.dumps(all_mapping, ensure_ascii=False, indent=2))
-
-    print(f"\n✅ All done. Saved to {FACTS_FILE.name} and {MAP_FILE.name}")
+        sub_awards.insert(0, {"qid": a["qid"], "label": a["label"]})
+        return a["qid"], sub_awards
+
+    with Journal(JOURNAL_FILE, fsync_every=FSYNC_EVERY) as journal, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        # 1) 展开所有 top 奖项的子奖项
+        todo = [a for a in top_awards if a["qid"] not in subs_of]
+        with m.phase("tops"):
+            for fut in tqdm(as_completed([pool.submit(expand, a) for a in todo]), total=len(todo), desc="tops"):
+                qid, sub_awards = fut.result()
+                if sub_awards is None:
+                    # 不写日志：下次续跑会重新展开这个 top 奖项
+                    tqdm.write(f"  ✗ {qid}: sub-award query failed, will retry on resume")
+                    m.incr("award.failed")
+                    continue
+                subs_of[qid] = sub_awards
+                journal.append({"t": "subs", "parent": qid, "subs": sub_awards})
+                m.incr("award.tops")
+
+        # 2) 待抓的子奖项去重后按批分给 worker，受 WORKERS 与令牌桶共同约束
+        owners = {}
+        for a in top_awards:
+            for s in subs_of.get(a["qid"], []):
+                if (a["qid"], s["qid"]) not in facts:
+                    owners.setdefault(s["qid"], []).append((a["qid"], s))
+        queue = list(owners)
+        batcher = AdaptiveBatch(batch_size, hi=max(batch_size, MAX_BATCH) if batch_size > 1 else 1)
+        lock = threading.Lock()
+        bar = tqdm(total=len(queue), desc="subs")
+
+        def worker():
+            while True:
+                with lock:
+                    chunk = queue[:batcher.size]
+                    del queue[:len(chunk)]
+                if not chunk:
+                    return
+                m.observe("award.batch_size", len(chunk))
+                for sub_qid, year_map in fetch_bulk_recipients_batch(chunk, batcher).items():
+                    bar.update(1)
+                    if year_map is None:
+                        tqdm.write(f"  ✗ {sub_qid}: recipient query failed, will retry on resume")
+                        m.incr("award.failed")
+                        continue
+                    total = sum(len(v) for v in year_map.values())
+                    for qid, s in owners[sub_qid]:
+                        if total < 3:
+                            tqdm.write(f"  ⚠️  {s['label']} ({sub_qid}): sparse data — only {total} recipients found")
+                        journal.append({"t": "fact", "parent": qid, "label": s["label"], "qid": sub_qid, "years": year_map})
+                    m.incr("award.subs")
+
+        with m.phase("subs", workers=workers):
+            for fut in [pool.submit(worker) for _ in range(workers)]:
+                fut.result()
+        bar.close()
+
+    with m.phase("compact"):
+        all_facts, all_mapping = compact(top_awards)
+    print(f"\n✅ All done. {len(all_facts)} sub-awards / {len(all_mapping)} tops saved to {FACTS_FILE.name} and {MAP_FILE.name}")
+    print(f"   cache: {get_cache().hits} hits / {get_cache().misses} misses")
+    if m.counters["award.failed"]:
+        print(f"   ⚠️  {m.counters['award.failed']:.0f} queries failed and were not journaled; rerun to retry them")
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser(description="Crawl award recipients per sub-award")
+    ap.add_argument("--fresh", action="store_true", help="丢弃已有日志，从头抓取")
+    ap.add_argument("--compact", action="store_true", help="只把现有日志压实成 JSON，不抓取")
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="初始批大小；1 表示每个奖项单独查询")
+    args = ap.parse_args()
+    if args.compact:
+        facts, mapping = compact(load_top_awards())
+        print(f"✓ compacted {len(facts)} sub-awards / {len(mapping)} tops")
+    else:
+        main(resume=not args.fresh, workers=args.workers, batch_size=args.batch_size)
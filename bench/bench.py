@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench.py
+--------
+离线基准：以当前产物为 1x，合成 1x / 10x / 100x 规模的输入，逐个计时、测内存地运行各生成器与抓取后处理步骤，
+结果写成 JSON，便于跨版本对比。全程不联网（SPARQL 与 pageview 请求都换成本地桩）。
+▸ 夹具：仓库里现有的 popularity / sub_mapping / subdivisions_tree / occupation JSON 按倍数复制（QID 加偏移）；
+  award 事实按 sub_mapping 用固定种子合成
+▸ 每个 (步骤, 规模) 在独立子进程里跑，互不影响：墙钟、CPU 时间、峰值 RSS；--tracemalloc 另记 Python 堆峰值
+▸ 结果默认写到 <repo>/.cache/bench/results/<时间戳>.json（与夹具同在已忽略的 .cache 下）；compare 子命令对比两次结果
+
+步骤：
+  award_gen      award/gen.py main()
+  award_filter   award/filter.py run()（fixed_count 和一条组合谓词链，一遍读完）
+  country_gen    country/gen.py batch_generate()
+  country_rich   country/rich.py postprocess()（pageview 请求换成本地桩）
+  people_gen     people/gen.py main()（SPARQL 换成本地桩）
+  math_gen       math/gen.py generate_dataset()（MAX_BOUND = 1e4 × 倍数）
+
+命令行：
+  python bench/bench.py run [--scales 1,10,100] [--steps award_gen,...] [--tracemalloc] [--out FILE]
+  python bench/bench.py fixtures [--scales 1,10,100]     只生成夹具（<repo>/.cache/bench/x<倍数>/）
+  python bench/bench.py compare <old.json> <new.json> [--threshold 1.2]
+"""
+
+import argparse, contextlib, importlib.util, io, json, os, platform, random, resource, subprocess, sys, time, zlib
+from datetime import datetime
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+FIXTURE_DIR = REPO / ".cache" / "bench"
+RESULTS_DIR = FIXTURE_DIR / "results"
+FIXTURE_VERSION = 1
+SCALES = [1, 10, 100]
+SEED = 42
+QID_SHIFT = 10 ** 9      # 第 r 份副本的 QID 加 r × QID_SHIFT，保证不重复
+PEOPLE_QA = 500
+MATH_QA = 1000
+# 子进程里清掉会改变代码路径的环境变量，并关掉 SPARQL 缓存
+CLEAR_ENV = ["ENTITY_DB", "WD_DUMP_DB", "PV_DUMP_DIR", "PV_STORE", "PEOPLE_FACET_INDEX"]
+
+# ---------- 夹具 ----------
+def _shift(qid, r):
+    if not r or not qid:
+        return qid
+    return f"Q{int(qid[1:]) + r * QID_SHIFT}" if qid[1:].isdigit() else f"{qid}_{r}"
+
+def _dump(obj, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+
+def _load_json(rel):
+    with open(REPO / rel, encoding="utf-8") as f:
+        return json.load(f)
+
+def scale_popularity(data, k):
+    inner = next(key for key in data if key != "as_of")
+    items = [dict(it, qid=_shift(it["qid"], r), label=it["label"] if not r else f"{it['label']} ({r})")
+             for r in range(k) for it in data[inner]]
+    return {"as_of": data.get("as_of"), inner: items}
+
+def _synth_years(rng):
+    """一个奖项的 years：多数每年 1–3 人，约三成每年人数固定，少量 unknown 与非人类获奖者。"""
+    n_years = rng.randint(1, 60)
+    first = rng.randint(1900, 2024 - n_years)
+    fixed = rng.random() < 0.3
+    per_year = rng.choice([1, 1, 2, 3])
+    years = {}
+    if rng.random() < 0.2:
+        years["unknown"] = [[f"Person {rng.randrange(10 ** 6)}", f"Q{rng.randrange(10 ** 8)}", "Q5"]]
+    for y in range(first, first + n_years):
+        n = per_year if fixed else rng.choice([1, 1, 1, 2, 2, 3, 5])
+        years[str(y)] = [[f"Person {rng.randrange(10 ** 6)}", f"Q{rng.randrange(10 ** 8)}",
+                          "Q5" if rng.random() < 0.9 else "Q43229"] for _ in range(n)]
+    return years
+
+def scale_award(k, rng):
+    pop = scale_popularity(_load_json("award/award_popularity.json"), k)
+    submap_1x = _load_json("award/award_sub_mapping.json")
+    submap = {_shift(p, r): [_shift(s, r) for s in subs] for r in range(k) for p, subs in submap_1x.items()}
+    labels = {a["qid"]: a["label"] for a in pop["award"]}
+    facts = {}
+    for parent, subs in submap.items():
+        for sub in [parent] + [s for s in subs if s != parent]:
+            label = labels.get(sub) or f"Sub-award {sub}"
+            facts[label] = {"qid": sub, "parent_qid": parent, "years": _synth_years(rng)}
+    return {"award_popularity.json": pop, "award_sub_mapping.json": submap, "structured_award_facts.json": facts}
+
+def _copy_tree(node, r, views):
+    if isinstance(node, list):
+        return [_copy_tree(x, r, views) for x in node]
+    if not isinstance(node, dict):
+        return node
+    out = {key: _copy_tree(v, r, views) for key, v in node.items()}
+    if "qid" in out:
+        out["qid"] = _shift(out["qid"], r)
+        out.setdefault("title", (out.get("label") or out["qid"]).replace(" ", "_"))
+        if views:
+            out["views_12m"] = zlib.crc32(out["qid"].encode()) % 1_000_000
+    return out
+
+def scale_country(k):
+    tree = _load_json("country/subdivisions_tree.json")
+    out = {}
+    for views, name in ((False, "subdivisions_tree.json"), (True, "subdivisions_tree_postprocessed.json")):
+        out[name] = {(c if not r else f"{c} #{r}"): _copy_tree(node, r, views)
+                     for r in range(k) for c, node in tree.items()}
+    return out
+
+def scale_people(k):
+    out = {f"{kind}_popularity.json": scale_popularity(_load_json(f"people/{kind}_popularity.json"), k)
+           for kind in ("country", "language", "religion", "party")}
+    occ = _load_json("people/occupation_qid.json")
+    out["occupation_qid.json"] = {(label if not r else f"{label} ({r})"): _shift(qid, r)
+                                  for r in range(k) for label, qid in occ.items()}
+    return out
+
+def build_fixtures(scale, root=FIXTURE_DIR):
+    fx = Path(root) / f"x{scale}"
+    stamp = fx / ".done"
+    if stamp.exists() and stamp.read_text().strip() == str(FIXTURE_VERSION):
+        return fx
+    rng = random.Random(SEED + scale)
+    for sub, files in (("award", scale_award(scale, rng)), ("country", scale_country(scale)),
+                       ("people", scale_people(scale))):
+        for name, obj in files.items():
+            _dump(obj, fx / sub / name)
+    (fx / "math").mkdir(parents=True, exist_ok=True)
+    stamp.write_text(str(FIXTURE_VERSION))
+    return fx
+
+# ---------- 步骤 ----------
+def _load(rel, name):
+    path = REPO / rel
+    for p in (str(REPO), str(path.parent)):
+        if p not in sys.path:
+            sys.path.insert(0, p)
+    spec = importlib.util.spec_from_file_location(name, path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+def _lines(path):
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+def step_award_gen(fx, scale):
+    os.chdir(fx / "award")
+    mod = _load("award/gen.py", "bench_award_gen")
+    random.seed(SEED)
+    mod.main()
+    return {"qa": _lines(mod.OUTPUT_FILE)}
+
+def step_award_filter(fx, scale):
+    os.chdir(fx / "award")
+    mod = _load("award/filter.py", "bench_award_filter")
+    return mod.run("structured_award_facts.json", [
+        "fixed_count_awards.json=fixed_count",
+        "human_popular.jsonl=human_only,min_years:3,min_popularity:1000",
+    ])
+
+def step_country_gen(fx, scale):
+    os.chdir(fx / "country")
+    mod = _load("country/gen.py", "bench_country_gen")
+    random.seed(SEED)
+    data = mod.load_data("subdivisions_tree_postprocessed.json")
+    mod.batch_generate(data, "geo_questions.json")
+    return {"countries": len(data)}
+
+async def _fake_fetch_items(sess, limiter, url, stats, retries=None):
+    # 代替 Wikimedia REST API：照常走 AIMD 限流器，不发请求
+    await limiter.acquire()
+    try:
+        limiter.success()
+        return [{"views": zlib.crc32(url.encode()) % 100_000}]
+    finally:
+        await limiter.release()
+
+def step_country_rich(fx, scale):
+    os.chdir(fx / "country")
+    mod = _load("country/rich.py", "bench_country_rich")
+    mod.pageview_async.fetch_items = _fake_fetch_items
+    mod.postprocess("subdivisions_tree.json", "subdivisions_tree_rich.json", max_workers=20, pv_dump_dir=None)
+    return {"bytes_out": (fx / "country" / "subdivisions_tree_rich.json").stat().st_size}
+
+def step_people_gen(fx, scale):
+    os.chdir(fx / "people")
+    mod = _load("people/gen.py", "bench_people_gen")
+    mod.run_sparql = lambda query: []     # 代替 WDQS：批量查询照常拼装，返回空结果
+    mod.QA_CNT = PEOPLE_QA
+    random.seed(SEED)
+    mod.main()
+    return {"qa": _lines("generated_qa.jsonl")}
+
+def step_math_gen(fx, scale):
+    os.chdir(fx / "math")
+    os.environ["SEQ_CACHE_DIR"] = str(fx / "math" / "seq")   # 不读用户预先筛好的位图
+    mod = _load("math/gen.py", "bench_math_gen")
+    mod.MAX_BOUND, mod.QA_CNT = 10_000 * scale, MATH_QA
+    random.seed(SEED)
+    return {"qa": len(mod.generate_dataset()), "max_bound": mod.MAX_BOUND}
+
+STEPS = {
+    "award_gen": step_award_gen,
+    "award_filter": step_award_filter,
+    "country_gen": step_country_gen,
+    "country_rich": step_country_rich,
+    "people_gen": step_people_gen,
+    "math_gen": step_math_gen,
+}
+# 每个步骤读哪些夹具（用来记录输入大小）
+INPUTS = {
+    "award_gen": ["award/structured_award_facts.json", "award/award_sub_mapping.json", "award/award_popularity.json"],
+    "award_filter": ["award/structured_award_facts.json"],
+    "country_gen": ["country/subdivisions_tree_postprocessed.json"],
+    "country_rich": ["country/subdivisions_tree.json"],
+    "people_gen": [f"people/{k}_popularity.json" for k in ("country", "language", "religion")] + ["people/occupation_qid.json"],
+    "math_gen": [],
+}
+
+def _peak_rss_mib():
+    # Linux 上 ru_maxrss 会跨 exec 继承父进程的峰值，优先读本地址空间自己的 VmHWM
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == "darwin" else rss / 1024   # macOS 单位是字节，Linux 是 KiB
+
+def measure(step, scale, fx, trace=False):
+    """在当前进程里跑一个步骤；由 run 在子进程里调用。"""
+    import tracemalloc
+    if trace:
+        tracemalloc.start()
+    t0, c0 = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        extra = STEPS[step](Path(fx), scale)
+    result = {
+        "step": step,
+        "scale": scale,
+        "wall_s": round(time.perf_counter() - t0, 4),
+        "cpu_s": round(time.process_time() - c0, 4),
+        "peak_rss_mib": round(_peak_rss_mib(), 1),
+        "input_bytes": sum((Path(fx) / p).stat().st_size for p in INPUTS[step]),
+        "extra": extra,
+    }
+    if trace:
+        result["py_peak_mib"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+    return result
+
+def _child_env():
+    env = {k: v for k, v in os.environ.items() if k not in CLEAR_ENV}
+    env["SPARQL_CACHE"] = "0"
+    return env
+
+def run(scales, steps, trace=False, out=None, verbose=False, fixture_root=FIXTURE_DIR):
+    results = []
+    for scale in scales:
+        t = time.perf_counter()
+        fx = build_fixtures(scale, fixture_root)
+        print(f"fixtures x{scale}: {fx} ({time.perf_counter() - t:.1f}s)")
+        for step in steps:
+            cmd = [sys.executable, str(Path(__file__).resolve()), "_step", step, str(scale), str(fx)]
+            proc = subprocess.run(cmd + (["--tracemalloc"] if trace else []), env=_child_env(),
+                                  stdout=subprocess.PIPE, stderr=None if verbose else subprocess.DEVNULL, text=True)
+            if proc.returncode:
+                res = {"step": step, "scale": scale, "error": f"exit {proc.returncode}"}
+            else:
+                res = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(res)
+            print(f"  {step:<13} x{scale:<4} " + (res.get("error") or
+                  f"{res['wall_s']:>8.2f}s wall {res['cpu_s']:>8.2f}s cpu {res['peak_rss_mib']:>8.1f} MiB"))
+    doc = {"meta": _meta(trace), "results": results}
+    out = Path(out) if out else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✓ results → {out}")
+    return doc
+
+def _meta(trace):
+    try:
+        rev = subprocess.run(["git", "-C", str(REPO), "rev-parse", "--short", "HEAD"],
+                             capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        rev = None
+    try:
+        import numpy
+        np_version = numpy.__version__
+    except ImportError:
+        np_version = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git": rev,
+        "python": platform.python_version(),
+        "numpy": np_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "fixture_version": FIXTURE_VERSION,
+        "tracemalloc": trace,
+    }
+
+def compare(old_path, new_path, threshold=1.2):
+    old, new = (json.loads(Path(p).read_text(encoding="utf-8")) for p in (old_path, new_path))
+    before = {(r["step"], r["scale"]): r for r in old["results"] if "error" not in r}
+    print(f"{old['meta'].get('git')} → {new['meta'].get('git')}")
+    print(f"{'step':<13} {'scale':>5} {'wall old':>9} {'wall new':>9} {'ratio':>6} {'rss old':>8} {'rss new':>8} {'ratio':>6}")
+    worse = 0
+    for r in new["results"]:
+        b = before.get((r["step"], r["scale"]))
+        if b is None or "error" in r:
+            print(f"{r['step']:<13} {r['scale']:>5} {r.get('error', 'new')}")
+            continue
+        wr = r["wall_s"] / max(b["wall_s"], 1e-9)
+        mr = r["peak_rss_mib"] / max(b["peak_rss_mib"], 1e-9)
+        flag = "  ⚠️" if wr > threshold or mr > threshold else ""
+        worse += bool(flag)
+        print(f"{r['step']:<13} {r['scale']:>5} {b['wall_s']:>9.2f} {r['wall_s']:>9.2f} {wr:>6.2f} "
+              f"{b['peak_rss_mib']:>8.1f} {r['peak_rss_mib']:>8.1f} {mr:>6.2f}{flag}")
+    return worse
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline benchmarks for the QA generators")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("run")
+    p.add_argument("--scales", default=",".join(map(str, SCALES)))
+    p.add_argument("--steps", default=",".join(STEPS))
+    p.add_argument("--tracemalloc", action="store_true", help="另记 Python 堆峰值（会明显变慢）")
+    p.add_argument("--out")
+    p.add_argument("--fixtures", default=str(FIXTURE_DIR))
+    p.add_argument("-v", "--verbose", action="store_true", help="显示各步骤自己的进度输出")
+    p = sub.add_parser("fixtures")
+    p.add_argument("--scales", default=",".join(map(str, SCALES)))
+    p.add_argument("--fixtures", default=str(FIXTURE_DIR))
+    p = sub.add_parser("compare")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=1.2, help="墙钟或 RSS 超过旧值的这个倍数时标记")
+    p = sub.add_parser("_step")       # 内部：子进程入口
+    p.add_argument("step", choices=list(STEPS))
+    p.add_argument("scale", type=int)
+    p.add_argument("fx")
+    p.add_argument("--tracemalloc", action="store_true")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "_step":
+        print(json.dumps(measure(args.step, args.scale, args.fx, args.tracemalloc)))
+    elif args.cmd == "fixtures":
+        for scale in map(int, args.scales.split(",")):
+            print(f"✓ x{scale}: {build_fixtures(scale, args.fixtures)}")
+    elif args.cmd == "compare":
+        return 1 if compare(args.old, args.new, args.threshold) else 0
+    else:
+        steps = args.steps.split(",")
+        unknown = [s for s in steps if s not in STEPS]
+        if unknown:
+            ap.error(f"unknown steps: {', '.join(unknown)}")
+        run(list(map(int, args.scales.split(","))), steps, args.tracemalloc, args.out, args.verbose, args.fixtures)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
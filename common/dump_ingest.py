@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+dump_ingest.py
+--------------
+离线读取 Wikidata JSON dump（latest-all.json.bz2 / .gz / .json，可截断、可预先过滤），
+代替 WDQS 生成与线上抓取脚本完全相同格式的产物：
+
+▸ award/   structured_award_facts.json + award_sub_mapping.json   （= award/qiongju.py）
+▸ country/ subdivisions_tree.json                                   （= country/fetch.py）
+▸ people   P27/P569/P570/P106/P101/P1412/P140 事实表（出生 / 去世年份有几个存几个），供 people/gen.py 离线回答
+
+两步：
+1. ingest  单遍扫描 dump，每个实体只抽取用得到的字段，落盘到 SQLite 中间库（内存有界）
+   - 多流 bz2 / 纯 JSON：按压缩流边界切成若干字节区间，多进程各自解压 + 解析，
+     区间首尾的半行交回主进程拼接（一行可以跨多个区间）
+   - 单流 bz2 / gz：主进程顺序解压，按行打包交给进程池解析
+   - 只被其它实体 P527 / P36 引用的子奖项、首府第一遍不存标签，扫完后再扫一遍只补这些标签
+2. export  在中间库上做 P279* / P131+ 闭包，写出 JSON
+
+用法：
+  python -m common.dump_ingest latest-all.json.bz2 --db wd_dump.sqlite \\
+      --award-dir award --country-src country/country_popularity.json \\
+      --country-dst country/subdivisions_tree.json [--workers 8] [--top-k 100]
+"""
+
+import argparse, bz2, gzip, json, mmap, os, re, sqlite3, time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+ADM1_CLASS = "Q10864048"   # first-level administrative division
+CITY_CLASS = "Q515"        # city
+HUMAN = "Q5"
+PEOPLE_FACETS = ("P27", "P106", "P101", "P1412", "P140")
+GEO_PROPS = ("P131", "P17", "P36")
+CHUNK_BYTES = 64 * 1024 ** 2       # 每个并行区间的压缩字节数
+LINES_PER_BATCH = 2000             # 顺序解压模式下每个任务的行数
+MAX_PENDING = 2                    # 每个 worker 允许排队的任务数（控制内存）
+
+BZ2_STREAM = re.compile(rb"BZh[1-9]1AY&SY")
+TIME_RE = re.compile(r"^([+-])(\d+)-")
+
+TABLES = {
+    "entities":      "qid TEXT PRIMARY KEY, label TEXT",
+    "instance_of":   "qid TEXT, cls TEXT",
+    "subclass_of":   "qid TEXT, parent TEXT",
+    "located_in":    "qid TEXT, parent TEXT",
+    "country_of":    "qid TEXT, country TEXT",
+    "capital_of":    "qid TEXT, capital TEXT, ord INTEGER",
+    "area":          "qid TEXT PRIMARY KEY, value TEXT",
+    "parts":         "parent TEXT, sub TEXT",
+    "award_rows":    "award TEXT, year TEXT, ent TEXT, label TEXT, typ TEXT",
+    "people":        "qid TEXT PRIMARY KEY, label TEXT",
+    "person_facets": "qid TEXT, pid TEXT, value TEXT",     # P569 / P570 存年份，每个 truthy 日期一行
+}
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_inst_cls ON instance_of(cls)",
+    "CREATE INDEX IF NOT EXISTS ix_sub_parent ON subclass_of(parent)",
+    "CREATE INDEX IF NOT EXISTS ix_loc_qid ON located_in(qid)",
+    "CREATE INDEX IF NOT EXISTS ix_country ON country_of(country)",
+    "CREATE INDEX IF NOT EXISTS ix_capital ON capital_of(qid)",
+    "CREATE INDEX IF NOT EXISTS ix_parts_parent ON parts(parent)",
+    "CREATE INDEX IF NOT EXISTS ix_parts_sub ON parts(sub)",
+    "CREATE INDEX IF NOT EXISTS ix_award ON award_rows(award)",
+    "CREATE INDEX IF NOT EXISTS ix_facet ON person_facets(pid, value)",
+]
+
+# ---------- 单实体抽取 ----------
+def _value(snak):
+    if snak.get("snaktype") != "value":
+        return None
+    return snak.get("datavalue", {}).get("value")
+
+def _entity_id(snak):
+    v = _value(snak)
+    return v.get("id") if isinstance(v, dict) else None
+
+def _year(snak):
+    v = _value(snak)
+    if not isinstance(v, dict) or "time" not in v:
+        return None
+    m = TIME_RE.match(v["time"])
+    if not m:
+        return None
+    return int(m.group(2)) * (-1 if m.group(1) == "-" else 1)
+
+def _truthy(claims, pid):
+    # 与 wdt: 一致：有 preferred 只取 preferred，否则取 normal，deprecated 永远排除
+    stmts = [s for s in claims.get(pid, []) if s.get("rank") != "deprecated"]
+    preferred = [s for s in stmts if s.get("rank") == "preferred"]
+    return preferred or stmts
+
+def _truthy_ids(claims, pid):
+    return [q for q in (_entity_id(s["mainsnak"]) for s in _truthy(claims, pid)) if q]
+
+def extract(ent, rows, year_max):
+    qid = ent.get("id", "")
+    if not qid.startswith("Q"):
+        return
+    claims = ent.get("claims") or {}
+    label = ent.get("labels", {}).get("en", {}).get("value")
+    p31 = _truthy_ids(claims, "P31")
+
+    for parent in _truthy_ids(claims, "P279"):
+        rows["subclass_of"].append((qid, parent))
+
+    # 奖项：p:P166 / ps:P166 包含所有 rank；OPTIONAL pq:P585 × OPTIONAL wdt:P31 按 SPARQL 语义展开
+    for stmt in claims.get("P166", []):
+        award = _entity_id(stmt["mainsnak"])
+        if not award:
+            continue
+        dates = stmt.get("qualifiers", {}).get("P585", [])
+        years = []
+        for d in dates:
+            y = _year(d)
+            if y is None:
+                continue        # somevalue 日期在线上解析失败被丢弃
+            years.append(str(y) if 1800 <= y <= year_max else "unknown")
+        if not dates:
+            years = ["unknown"]
+        for y in years:
+            for typ in (p31 or [""]):
+                rows["award_rows"].append((award, y, qid, label or qid, typ))
+
+    has_parts = False
+    for parent in _truthy_ids(claims, "P361"):
+        rows["parts"].append((parent, qid)); has_parts = True
+    for sub in _truthy_ids(claims, "P527"):
+        rows["parts"].append((qid, sub)); has_parts = True
+
+    is_geo = any(p in claims for p in GEO_PROPS)
+    if is_geo:
+        for cls in p31:
+            rows["instance_of"].append((qid, cls))
+        for parent in _truthy_ids(claims, "P131"):
+            rows["located_in"].append((qid, parent))
+        for country in _truthy_ids(claims, "P17"):
+            rows["country_of"].append((qid, country))
+        for i, cap in enumerate(_truthy_ids(claims, "P36")):
+            rows["capital_of"].append((qid, cap, i))
+        for stmt in _truthy(claims, "P2046"):
+            snak = stmt["mainsnak"]
+            if snak.get("snaktype") == "somevalue":
+                rows["area"].append((qid, "unknown")); break
+            v = _value(snak)
+            if isinstance(v, dict) and "amount" in v:
+                rows["area"].append((qid, v["amount"])); break
+
+    if is_geo or has_parts:
+        rows["entities"].append((qid, label))
+
+    if HUMAN in p31:
+        rows["people"].append((qid, label))
+        # wdt:P569 / P570 匹配任意一个 truthy 日期：每个年份都存，与线上 FILTER(YEAR(?date) = …) 一致
+        for pid in ("P569", "P570"):
+            for y in dict.fromkeys(_year(s["mainsnak"]) for s in _truthy(claims, pid)):
+                if y is not None:
+                    rows["person_facets"].append((qid, pid, str(y)))
+        for pid in PEOPLE_FACETS:
+            for v in _truthy_ids(claims, pid):
+                rows["person_facets"].append((qid, pid, v))
+
+def _new_rows():
+    return {t: [] for t in TABLES}
+
+# 补标签遍：只给导出会引用、第一遍没存标签的 QID 补英文标签（由进程池 initializer 设置）
+_WANTED = None
+ENTITY_ID = re.compile(rb'"id":"(Q\d+)"')
+
+def _set_wanted(wanted):
+    global _WANTED
+    _WANTED = wanted
+
+def parse_line(line, rows, year_max):
+    line = line.strip()
+    if line.endswith(b","):
+        line = line[:-1]
+    if not line or line in (b"[", b"]"):
+        return False
+    if _WANTED is not None:
+        m = ENTITY_ID.search(line, 0, 200)    # dump 每行以 {"type":"item","id":"Q…" 开头，不必整行解析
+        if m and m.group(1).decode() not in _WANTED:
+            return True
+    try:
+        ent = json.loads(line)
+    except ValueError:
+        return False     # 截断的最后一行 / 非实体行
+    if _WANTED is None:
+        extract(ent, rows, year_max)
+    elif ent.get("id") in _WANTED:
+        rows["entities"].append((ent["id"], ent.get("labels", {}).get("en", {}).get("value")))
+    return True
+
+# ---------- 并行任务 ----------
+def _decompress_range(path, start, end, codec):
+    with open(path, "rb") as f:
+        f.seek(start)
+        raw = f.read(end - start)
+    if codec == "raw":
+        return raw
+    out, data = [], raw
+    while data:
+        d = bz2.BZ2Decompressor()
+        try:
+            out.append(d.decompress(data))
+        except (OSError, EOFError):
+            break
+        if not d.eof:
+            break          # 文件被截断
+        data = d.unused_data
+    return b"".join(out)
+
+def _range_task(args):
+    path, start, end, codec, year_max = args
+    text = _decompress_range(path, start, end, codec)
+    first = text.find(b"\n")
+    last = text.rfind(b"\n")
+    rows, n = _new_rows(), 0
+    if first == -1:
+        return None, text, rows, 0     # 整个区间落在一行中间（multi-MB 的大实体），全部交给 carry
+    for line in text[first + 1:last].split(b"\n"):
+        n += parse_line(line, rows, year_max)
+    return text[:first], text[last + 1:], rows, n
+
+def _lines_task(args):
+    lines, year_max = args
+    rows, n = _new_rows(), 0
+    for line in lines:
+        n += parse_line(line, rows, year_max)
+    return rows, n
+
+def split_ranges(path, chunk_bytes=CHUNK_BYTES):
+    """返回 (codec, [(start, end), ...])；无法切分时返回 (codec, None)。"""
+    size = os.path.getsize(path)
+    chunk_bytes = max(int(chunk_bytes), 1)
+    if path.endswith(".gz"):
+        return "gz", None
+    if not path.endswith(".bz2"):
+        cuts = list(range(0, size, chunk_bytes)) + [size]
+        return "raw", list(zip(cuts[:-1], cuts[1:]))
+    if size == 0:
+        return "bz2", None
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        cuts = [0]
+        while True:
+            m = BZ2_STREAM.search(mm, cuts[-1] + chunk_bytes) if cuts[-1] + chunk_bytes < size else None
+            if not m:
+                break
+            cuts.append(m.start())
+    if len(cuts) == 1 and size > chunk_bytes:
+        return "bz2", None        # 单流 bz2，只能顺序解压
+    return "bz2", list(zip(cuts, cuts[1:] + [size]))
+
+def _iter_lines(path, codec):
+    opener = {"gz": gzip.open, "bz2": bz2.open}.get(codec, open)
+    with opener(path, "rb") as f:
+        try:
+            for line in f:
+                yield line
+        except (EOFError, OSError):
+            return          # 截断的压缩文件：读到哪算哪
+
+def _bounded(executor, fn, jobs, limit):
+    # 保持最多 limit 个在途任务并按提交顺序产出结果
+    pending = deque()
+    for job in jobs:
+        pending.append(executor.submit(fn, job))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _batched(lines, n):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# ---------- 中间库 ----------
+def open_db(path, fresh=False):
+    if fresh and Path(path).exists():
+        Path(path).unlink()
+    conn = sqlite3.connect(str(path))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    for name, cols in TABLES.items():
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ({cols})")
+    return conn
+
+def _flush(conn, rows):
+    for name, items in rows.items():
+        if items:
+            marks = ",".join("?" * len(items[0]))
+            verb = "INSERT OR IGNORE" if name in ("entities", "area", "people") else "INSERT"
+            conn.executemany(f"{verb} INTO {name} VALUES ({marks})", items)
+
+def _scan(dump_path, conn, codec, ranges, workers, year_max, wanted=None):
+    """扫一遍 dump 并写库；wanted 不为 None 时只补这些 QID 的标签。返回实体数。"""
+    t0, total = time.time(), 0
+    _set_wanted(wanted)      # 主进程拼接的跨区间行也走同一套抽取
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_set_wanted, initargs=(wanted,)) as ex:
+            if ranges:
+                print(f"📦 {dump_path}: {len(ranges)} ranges × {workers} workers ({codec})")
+                jobs = ((dump_path, s, e, codec, year_max) for s, e in ranges)
+                carry = b""
+                for i, (head, tail, rows, n) in enumerate(_bounded(ex, _range_task, jobs, workers * MAX_PENDING)):
+                    stitched = _new_rows()
+                    if head is None:
+                        carry += tail
+                    else:
+                        total += n + parse_line(carry + head, stitched, year_max)
+                        carry = tail
+                    _flush(conn, rows); _flush(conn, stitched)
+                    conn.commit()
+                    print(f"  [{i + 1}/{len(ranges)}] {total} entities, {time.time() - t0:.0f}s")
+                stitched = _new_rows()
+                total += parse_line(carry, stitched, year_max)
+                _flush(conn, stitched)
+            else:
+                print(f"📦 {dump_path}: sequential {codec} stream × {workers} parse workers")
+                jobs = ((batch, year_max) for batch in _batched(_iter_lines(dump_path, codec), LINES_PER_BATCH))
+                for rows, n in _bounded(ex, _lines_task, jobs, workers * MAX_PENDING):
+                    total += n
+                    _flush(conn, rows)
+                    if total % (LINES_PER_BATCH * 50) < LINES_PER_BATCH:
+                        conn.commit()
+                        print(f"  {total} entities, {time.time() - t0:.0f}s")
+        conn.commit()
+    finally:
+        _set_wanted(None)
+    return total
+
+def _unlabelled(conn):
+    # 导出会用 _label 查的 QID：子奖项（parts 两端）、首府；第一遍只给地理实体和自带 P361/P527 的实体存了标签
+    return {q for (q,) in conn.execute("""
+        SELECT q FROM (SELECT parent AS q FROM parts UNION SELECT sub FROM parts UNION SELECT capital FROM capital_of)
+        WHERE q NOT IN (SELECT qid FROM entities)""")}
+
+def ingest(dump_path, db_path, workers=None, chunk_bytes=CHUNK_BYTES):
+    workers = workers or os.cpu_count() or 1
+    year_max = datetime.now().year
+    conn = open_db(db_path, fresh=True)
+    codec, ranges = split_ranges(dump_path, chunk_bytes)
+    t0 = time.time()
+    total = _scan(dump_path, conn, codec, ranges, workers, year_max)
+    missing = _unlabelled(conn)
+    if missing:
+        # 只被别人的 P527 / P36 引用的实体第一遍不知道要存标签：再扫一遍，只解析这些 QID 所在的行
+        print(f"  resolving labels for {len(missing)} referenced entities ...")
+        _scan(dump_path, conn, codec, ranges, workers, year_max, wanted=missing)
+    print("  building indexes ...")
+    for sql in INDEXES:
+        conn.execute(sql)
+    conn.commit()
+    print(f"✓ ingested {total} entities into {db_path} in {time.time() - t0:.0f}s")
+    return conn
+
+# ---------- 导出：奖项 ----------
+def _label(conn, qid):
+    row = conn.execute("SELECT label FROM entities WHERE qid=?", (qid,)).fetchone()
+    return row[0] if row and row[0] else qid
+
+def _year_map(conn, award):
+    year_map = {}
+    for year, ent, label, typ in conn.execute(
+            "SELECT year, ent, label, typ FROM award_rows WHERE award=? ORDER BY rowid", (award,)):
+        year_map.setdefault(year, []).append([label, ent, typ])
+    return dict(sorted(year_map.items(), key=lambda kv: (kv[0] != "unknown", int(kv[0]) if kv[0].isdigit() else 9999)))
+
+def export_awards(conn, award_file, out_dir, top_k=100):
+    awards = json.loads(Path(award_file).read_text(encoding="utf-8"))["award"]
+    top_awards = sorted(awards, key=lambda x: -x["views_12m"])[:top_k]
+    all_facts, all_mapping = {}, {}
+    for a in top_awards:
+        label, qid = a["label"], a["qid"]
+        subs = [r[0] for r in conn.execute(
+            "SELECT DISTINCT sub FROM parts WHERE parent=? ORDER BY rowid", (qid,))]
+        sub_awards = [{"qid": qid, "label": label}] + [{"qid": s, "label": _label(conn, s)} for s in subs]
+        all_mapping[qid] = list(dict.fromkeys(s["qid"] for s in sub_awards))
+        for s in sub_awards:
+            all_facts[s["label"]] = {"qid": s["qid"], "parent_qid": qid, "years": _year_map(conn, s["qid"])}
+    out_dir = Path(out_dir)
+    (out_dir / "structured_award_facts.json").write_text(json.dumps(all_facts, ensure_ascii=False, indent=2))
+    (out_dir / "award_sub_mapping.json").write_text(json.dumps(all_mapping, ensure_ascii=False, indent=2))
+    print(f"✓ awards: {len(all_facts)} facts / {len(all_mapping)} parents → {out_dir}")
+
+# ---------- 导出：行政区划 ----------
+def _subclass_closure(conn, root):
+    seen, todo = {root}, [root]
+    while todo:
+        cls = todo.pop()
+        for (child,) in conn.execute("SELECT qid FROM subclass_of WHERE parent=?", (cls,)):
+            if child not in seen:
+                seen.add(child); todo.append(child)
+    return seen
+
+def _instances(conn, classes):
+    out = set()
+    for cls in classes:
+        out.update(r[0] for r in conn.execute("SELECT qid FROM instance_of WHERE cls=?", (cls,)))
+    return out
+
+def _area(conn, qid):
+    row = conn.execute("SELECT value FROM area WHERE qid=?", (qid,)).fetchone()
+    if not row:
+        return None
+    if row[0] == "unknown":
+        return "unknown"
+    try:
+        return float(row[0])
+    except ValueError:
+        return None
+
+def _ancestors(conn, qid, stop):
+    # wdt:P131+ 上溯，只收集落在 stop 集合里的祖先
+    seen, todo, hits = {qid}, [qid], []
+    while todo:
+        cur = todo.pop()
+        for (parent,) in conn.execute("SELECT parent FROM located_in WHERE qid=?", (cur,)):
+            if parent in seen:
+                continue
+            seen.add(parent); todo.append(parent)
+            if parent in stop:
+                hits.append(parent)
+    return hits
+
+def export_subdivisions(conn, country_src, dst):
+    countries = json.loads(Path(country_src).read_text(encoding="utf-8")).get("country", [])
+    adm1 = _instances(conn, _subclass_closure(conn, ADM1_CLASS))
+    cities = _instances(conn, _subclass_closure(conn, CITY_CLASS))
+    print(f"  {len(adm1)} ADM1 candidates, {len(cities)} cities")
+
+    # city → 所属 province 列表（一次性上溯，按国家分组前共用）
+    prov_cities = defaultdict(list)
+    for city in sorted(cities):
+        for prov in _ancestors(conn, city, adm1):
+            prov_cities[prov].append(city)
+
+    results = {}
+    for c in countries:
+        provinces = []
+        for (prov,) in conn.execute("SELECT DISTINCT qid FROM country_of WHERE country=? ORDER BY rowid", (c["qid"],)):
+            if prov not in adm1 or not prov_cities.get(prov):
+                continue      # 线上查询的 city 模式不是 OPTIONAL：无城市的省不会出现
+            node = {"qid": prov, "label": _label(conn, prov), "children": []}
+            area = _area(conn, prov)
+            if area is not None:
+                node["area_km2"] = area
+            node["capital"] = None
+            for (cap,) in conn.execute("SELECT capital FROM capital_of WHERE qid=? ORDER BY ord", (prov,)):
+                row = conn.execute("SELECT label FROM entities WHERE qid=?", (cap,)).fetchone()
+                if row and row[0]:       # rdfs:label 必须有英文
+                    node["capital"] = {"qid": cap, "label": row[0]}
+                    break
+            for city in prov_cities[prov]:
+                city_node = {"qid": city, "label": _label(conn, city)}
+                area = _area(conn, city)
+                if area is not None:
+                    city_node["area_km2"] = area
+                node["children"].append(city_node)
+            provinces.append(node)
+        cap = conn.execute("SELECT capital FROM capital_of WHERE qid=? ORDER BY ord LIMIT 1", (c["qid"],)).fetchone()
+        results[c["label"]] = {
+            "qid": c["qid"],
+            "subdivisions": provinces,
+            "capital": {"qid": cap[0], "label": _label(conn, cap[0])} if cap else None,
+        }
+    Path(dst).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✓ subdivisions: {len(results)} countries → {dst}")
+
+# ---------- 离线回答 people/gen.py 的过滤条件 ----------
+def people_answers(conn, filters: Dict[str, str]) -> List[tuple]:
+    """filters 与 people/gen.py build_query 的参数相同，返回 [(label, qid), ...]。"""
+    joins, args = [], []
+    for i, (pid, val) in enumerate(filters.items()):
+        joins.append(f"JOIN person_facets f{i} ON f{i}.qid = p.qid AND f{i}.pid = ? AND f{i}.value = ?")
+        args += [pid, str(int(val)) if pid in ("P569", "P570") else val]
+    sql = " ".join(["SELECT DISTINCT p.qid, p.label FROM people p"] + joins)
+    return [(label or qid, qid) for qid, label in conn.execute(sql, args)]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline Wikidata dump ingestion")
+    ap.add_argument("dump", nargs="?", help="dump 文件；省略则直接用已有 --db 导出")
+    ap.add_argument("--db", default="wd_dump.sqlite")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / 1024 ** 2)
+    ap.add_argument("--award-file", default="award/award_popularity.json")
+    ap.add_argument("--award-dir", default=None)
+    ap.add_argument("--top-k", type=int, default=100)
+    ap.add_argument("--country-src", default="country/country_popularity.json")
+    ap.add_argument("--country-dst", default=None)
+    args = ap.parse_args(argv)
+
+    if args.dump:
+        conn = ingest(args.dump, args.db, args.workers, int(args.chunk_mb * 1024 ** 2))
+    else:
+        conn = open_db(args.db)
+    if args.award_dir:
+        export_awards(conn, args.award_file, args.award_dir, args.top_k)
+    if args.country_dst:
+        export_subdivisions(conn, args.country_src, args.country_dst)
+    conn.close()
+
+if __name__ == "__main__":
+    main()
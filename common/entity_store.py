@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+entity_store.py
+---------------
+把散落在 award/ people/ country/ 下的大 JSON 产物收进一个带索引的 SQLite 库，生成器按需查询。
+表：
+  datasets      每个导入的 JSON 文件一条（name = 文件名去掉扩展名，type，as_of）
+  entities      qid → label / title（所有数据集去重后的实体表）
+  popularity    *_popularity.json：(dataset, rank) → qid, label, title, views_12m
+  awards        structured_award_facts.json / fixed_count_awards.json 的奖项头（保留原始键序）
+  award_years   奖项按年份的获奖者列表（每行一个 (奖项, 年份)）
+  sub_mapping   award_sub_mapping.json：parent_qid → sub_qid
+  subdivisions  subdivisions_tree*.json：国家 / 省 / 市三层节点，parent_id 连成树
+导出与原 JSON 格式逐字节一致（indent=2，ensure_ascii=False）。
+
+生成器（award/gen.py、country/gen.py、people/gen.py）在设置环境变量 ENTITY_DB 时从本库读取：
+  award_facts()    award/gen.py 要给每个奖项建索引，一条 JOIN 查询整体读出
+  SubdivisionTree  country/gen.py 随机抽国家，按国家懒加载；每个国家一条递归查询读出整棵子树
+  AwardFacts       按奖项随机访问时用的懒加载 Mapping
+接口都与 json.load 的结果相同。
+
+命令行：
+  python -m common.entity_store import <db> <file.json> [...]     按内容自动识别类型（库文件建议命名 entities.sqlite）
+  python -m common.entity_store export <db> <dataset> <out.json>
+  python -m common.entity_store stats  <db>
+"""
+
+import json, os, sqlite3, sys
+from collections.abc import Mapping
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+ENTITY_DB = os.environ.get("ENTITY_DB")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    name TEXT PRIMARY KEY, type TEXT NOT NULL, as_of TEXT, inner_key TEXT
+);
+CREATE TABLE IF NOT EXISTS entities (
+    qid TEXT PRIMARY KEY, label TEXT, title TEXT
+);
+CREATE TABLE IF NOT EXISTS popularity (
+    dataset TEXT NOT NULL, rank INTEGER NOT NULL, qid TEXT NOT NULL,
+    label TEXT, title TEXT, views_12m INTEGER, extra TEXT,
+    PRIMARY KEY (dataset, rank)
+);
+CREATE INDEX IF NOT EXISTS popularity_qid ON popularity (qid);
+CREATE TABLE IF NOT EXISTS awards (
+    dataset TEXT NOT NULL, ord INTEGER NOT NULL, label TEXT NOT NULL,
+    qid TEXT, parent_qid TEXT, data TEXT NOT NULL,
+    PRIMARY KEY (dataset, label)
+);
+CREATE INDEX IF NOT EXISTS awards_qid ON awards (dataset, qid);
+CREATE INDEX IF NOT EXISTS awards_parent ON awards (dataset, parent_qid);
+CREATE TABLE IF NOT EXISTS award_years (
+    dataset TEXT NOT NULL, label TEXT NOT NULL, ord INTEGER NOT NULL,
+    year TEXT NOT NULL, entries TEXT NOT NULL,
+    PRIMARY KEY (dataset, label, ord)
+);
+CREATE TABLE IF NOT EXISTS sub_mapping (
+    dataset TEXT NOT NULL, parent_qid TEXT NOT NULL, ord INTEGER NOT NULL, sub_qid TEXT NOT NULL,
+    PRIMARY KEY (dataset, parent_qid, ord)
+);
+CREATE TABLE IF NOT EXISTS subdivisions (
+    id INTEGER PRIMARY KEY, dataset TEXT NOT NULL, parent_id INTEGER, level INTEGER NOT NULL,
+    ord INTEGER NOT NULL, name TEXT, qid TEXT, label TEXT, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS subdivisions_parent ON subdivisions (dataset, parent_id, ord);
+CREATE INDEX IF NOT EXISTS subdivisions_qid ON subdivisions (qid);
+"""
+
+POP_KEYS = ["qid", "label", "title", "views_12m"]
+# 树节点里子节点列表所在的键：国家 → subdivisions，省 → children
+CHILD_KEY = {0: "subdivisions", 1: "children"}
+
+def open_store(path, fresh=False) -> sqlite3.Connection:
+    path = Path(path)
+    if fresh and path.exists():
+        path.unlink()
+    conn = sqlite3.connect(str(path), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def dataset_name(path) -> str:
+    return Path(path).stem
+
+def detect_type(data) -> str:
+    if isinstance(data, dict) and "as_of" in data:
+        return "popularity"
+    first = next(iter(data.values()), None) if isinstance(data, dict) else None
+    if isinstance(first, list):
+        return "sub_mapping"
+    if isinstance(first, dict) and "years" in first:
+        return "awards"
+    if isinstance(first, dict) and "subdivisions" in first:
+        return "subdivisions"
+    raise ValueError("unrecognized JSON layout")
+
+def _register(conn, name, typ, as_of=None, inner_key=None):
+    conn.execute("INSERT OR REPLACE INTO datasets VALUES (?,?,?,?)", (name, typ, as_of, inner_key))
+
+# ---------- 导入 ----------
+def load_popularity(conn, data: Dict, name: str):
+    inner = next(k for k in data if k != "as_of")
+    conn.execute("DELETE FROM popularity WHERE dataset=?", (name,))
+    rows, ents = [], []
+    for rank, it in enumerate(data[inner]):
+        # 键不是标准四项时整条原样存进 extra，导出时直接用
+        rows.append((name, rank, it["qid"], it.get("label"), it.get("title"), it.get("views_12m"),
+                     None if list(it) == POP_KEYS else _dumps(it)))
+        ents.append((it["qid"], it.get("label"), it.get("title")))
+    conn.executemany("INSERT INTO popularity VALUES (?,?,?,?,?,?,?)", rows)
+    conn.executemany("INSERT OR REPLACE INTO entities VALUES (?,?,?)", ents)
+    _register(conn, name, "popularity", data.get("as_of"), inner)
+
+def load_awards(conn, data: Dict, name: str):
+    conn.execute("DELETE FROM awards WHERE dataset=?", (name,))
+    conn.execute("DELETE FROM award_years WHERE dataset=?", (name,))
+    heads, years = [], []
+    for ord_, (label, info) in enumerate(data.items()):
+        head = {k: (None if k == "years" else v) for k, v in info.items()}
+        heads.append((name, ord_, label, info.get("qid"), info.get("parent_qid"), _dumps(head)))
+        for j, (year, entries) in enumerate(info["years"].items()):
+            years.append((name, label, j, year, _dumps(entries)))
+    conn.executemany("INSERT INTO awards VALUES (?,?,?,?,?,?)", heads)
+    conn.executemany("INSERT INTO award_years VALUES (?,?,?,?,?)", years)
+    _register(conn, name, "awards")
+
+def load_sub_mapping(conn, data: Dict, name: str):
+    conn.execute("DELETE FROM sub_mapping WHERE dataset=?", (name,))
+    conn.executemany("INSERT INTO sub_mapping VALUES (?,?,?,?)",
+                     [(name, parent, j, sub) for parent, subs in data.items() for j, sub in enumerate(subs)])
+    _register(conn, name, "sub_mapping")
+
+def load_subdivisions(conn, data: Dict, name: str):
+    conn.execute("DELETE FROM subdivisions WHERE dataset=?", (name,))
+
+    def insert(node, level, ord_, parent_id, key=None):
+        child_key = CHILD_KEY.get(level)
+        head = {k: (None if k == child_key else v) for k, v in node.items()}
+        cur = conn.execute(
+            "INSERT INTO subdivisions (dataset, parent_id, level, ord, name, qid, label, data) VALUES (?,?,?,?,?,?,?,?)",
+            (name, parent_id, level, ord_, key, node.get("qid"), node.get("label", key), _dumps(head)))
+        for j, child in enumerate(node.get(child_key, []) if child_key else []):
+            insert(child, level + 1, j, cur.lastrowid)
+
+    for i, (country, node) in enumerate(data.items()):
+        insert(node, 0, i, None, country)
+    _register(conn, name, "subdivisions")
+
+LOADERS = {
+    "popularity": load_popularity,
+    "awards": load_awards,
+    "sub_mapping": load_sub_mapping,
+    "subdivisions": load_subdivisions,
+}
+
+def import_json(conn, path, name: Optional[str] = None) -> str:
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    typ = detect_type(data)
+    with conn:
+        LOADERS[typ](conn, data, name or dataset_name(path))
+    return typ
+
+# ---------- 按需读取 ----------
+def popularity(conn, name: str, limit: Optional[int] = None) -> List[Dict]:
+    """与 json.load(*_popularity.json)[kind] 相同的列表，按原顺序；limit 只取前 N 条。"""
+    sql = "SELECT qid, label, title, views_12m, extra FROM popularity WHERE dataset=? ORDER BY rank"
+    rows = conn.execute(sql + (" LIMIT ?" if limit else ""), (name, limit) if limit else (name,))
+    return [json.loads(extra) if extra else {"qid": qid, "label": label, "title": title, "views_12m": views}
+            for qid, label, title, views, extra in rows]
+
+def dataset_info(conn, name: str):
+    return conn.execute("SELECT type, as_of, inner_key FROM datasets WHERE name=?", (name,)).fetchone()
+
+def sub_mapping(conn, name: str = "award_sub_mapping") -> Dict[str, List[str]]:
+    out: Dict[str, List[str]] = {}
+    for parent, sub in conn.execute(
+            "SELECT parent_qid, sub_qid FROM sub_mapping WHERE dataset=? ORDER BY rowid", (name,)):
+        out.setdefault(parent, []).append(sub)
+    return out
+
+def award_facts(conn, name: str = "structured_award_facts") -> Dict[str, Dict]:
+    """整个数据集一次读出：awards LEFT JOIN award_years，按奖项、年份原顺序。"""
+    out: Dict[str, Dict] = {}
+    for label, data, year, entries in conn.execute(
+            "SELECT a.label, a.data, y.year, y.entries FROM awards a "
+            "LEFT JOIN award_years y ON y.dataset=a.dataset AND y.label=a.label "
+            "WHERE a.dataset=? ORDER BY a.ord, y.ord", (name,)):
+        info = out.get(label)
+        if info is None:
+            info = out[label] = json.loads(data)
+            info["years"] = {}
+        if year is not None:
+            info["years"][year] = json.loads(entries)
+    return out
+
+class AwardFacts(Mapping):
+    """label → {"qid", "parent_qid", ..., "years"}；年份数据在第一次访问该奖项时才读取。"""
+
+    def __init__(self, conn, name: str = "structured_award_facts", cache_size: int = 4096):
+        self.conn, self.name = conn, name
+        self._labels = [r[0] for r in conn.execute(
+            "SELECT label FROM awards WHERE dataset=? ORDER BY ord", (name,))]
+        self._label_set = set(self._labels)
+        self._get = lru_cache(maxsize=cache_size)(self._load)
+
+    def _load(self, label):
+        row = self.conn.execute("SELECT data FROM awards WHERE dataset=? AND label=?", (self.name, label)).fetchone()
+        if row is None:
+            raise KeyError(label)
+        info = json.loads(row[0])
+        info["years"] = {year: json.loads(entries) for year, entries in self.conn.execute(
+            "SELECT year, entries FROM award_years WHERE dataset=? AND label=? ORDER BY ord", (self.name, label))}
+        return info
+
+    def __getitem__(self, label):
+        return self._get(label)
+
+    def __contains__(self, label):
+        return label in self._label_set
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._labels)
+
+    def __len__(self):
+        return len(self._labels)
+
+    def by_parent(self, parent_qid: str) -> List[str]:
+        return [r[0] for r in self.conn.execute(
+            "SELECT label FROM awards WHERE dataset=? AND parent_qid=? ORDER BY ord", (self.name, parent_qid))]
+
+class SubdivisionTree(Mapping):
+    """国家名 → 国家节点（含 subdivisions / children）；每个国家第一次访问时才组装。"""
+
+    def __init__(self, conn, name: str = "subdivisions_tree", cache_size: int = 64):
+        self.conn, self.name = conn, name
+        self._ids = {country: i for i, country in conn.execute(
+            "SELECT id, name FROM subdivisions WHERE dataset=? AND level=0 ORDER BY ord", (name,))}
+        self._get = lru_cache(maxsize=cache_size)(self._load)
+
+    def _load(self, country):
+        # 递归 CTE 一次取出整棵子树；按 (level, parent_id, ord) 排序，父节点总在子节点之前
+        nodes, root = {}, None
+        for node_id, parent_id, level, data in self.conn.execute(
+                "WITH RECURSIVE sub(id) AS (SELECT ? UNION ALL "
+                "SELECT s.id FROM subdivisions s JOIN sub ON s.dataset=? AND s.parent_id=sub.id) "
+                "SELECT s.id, s.parent_id, s.level, s.data FROM subdivisions s JOIN sub USING (id) "
+                "ORDER BY s.level, s.parent_id, s.ord", (self._ids[country], self.name)):
+            node = json.loads(data)
+            key = CHILD_KEY.get(level)
+            if key:
+                node[key] = []
+            nodes[node_id] = (node, level)
+            if parent_id is None:
+                root = node
+            else:
+                parent, plevel = nodes[parent_id]
+                parent[CHILD_KEY[plevel]].append(node)
+        return root
+
+    def __getitem__(self, country):
+        if country not in self._ids:
+            raise KeyError(country)
+        return self._get(country)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+# ---------- 导出 ----------
+def export_json(conn, name: str, out_path):
+    info = dataset_info(conn, name)
+    if info is None:
+        raise KeyError(f"unknown dataset {name}")
+    typ, as_of, inner = info
+    if typ == "popularity":
+        data = {"as_of": as_of, inner: popularity(conn, name)}
+    elif typ == "awards":
+        data = award_facts(conn, name)
+    elif typ == "sub_mapping":
+        data = sub_mapping(conn, name)
+    else:
+        data = dict(SubdivisionTree(conn, name, cache_size=0))
+    Path(out_path).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+def stats(conn) -> Dict:
+    out = {"datasets": {}}
+    for name, typ in conn.execute("SELECT name, type FROM datasets ORDER BY name"):
+        out["datasets"][name] = typ
+    for table in ("entities", "popularity", "awards", "award_years", "sub_mapping", "subdivisions"):
+        out[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return out
+
+def main(argv):
+    if len(argv) >= 3 and argv[0] == "import":
+        conn = open_store(argv[1])
+        for path in argv[2:]:
+            print(f"✓ {path}: {import_json(conn, path)} → {dataset_name(path)}")
+    elif len(argv) == 4 and argv[0] == "export":
+        export_json(open_store(argv[1]), argv[2], argv[3])
+        print(f"✓ {argv[2]} → {argv[3]}")
+    elif len(argv) == 2 and argv[0] == "stats":
+        print(json.dumps(stats(open_store(argv[1])), ensure_ascii=False, indent=2))
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
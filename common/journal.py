@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+journal.py
+----------
+追加写的 JSONL 日志：长时间抓取时每条结果只写一行，崩溃后可重放恢复。
+▸ 每 fsync_every 条或 fsync_secs 秒 flush + fsync 一次（批量落盘，摊薄 fsync 开销）
+▸ replay() 逐行读回；最后一行若因崩溃只写了一半则忽略
+"""
+
+import json, os, threading, time
+from pathlib import Path
+from typing import Dict, Iterator
+
+class Journal:
+    def __init__(self, path, fsync_every: int = 50, fsync_secs: float = 5.0):
+        self.path = Path(path)
+        self.fsync_every = fsync_every
+        self.fsync_secs = fsync_secs
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+        self._truncate_partial_tail()
+        self._f = open(self.path, "a", encoding="utf-8")
+
+    def _truncate_partial_tail(self):
+        # 上次崩溃时写了半行：截掉，避免新记录接在坏行后面
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            data = f.read()
+            f.truncate(data.rfind(b"\n") + 1)
+
+    def append(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._pending += 1
+            if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_secs:
+                self._sync()
+
+    def _sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            if not self._f.closed:
+                self._sync()
+                self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def replay(path) -> Iterator[Dict]:
+    path = Path(path)
+    if not path.exists():
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return     # 崩溃留下的半行
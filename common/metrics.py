@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+----------
+抓取脚本与生成器共用的运行指标。
+▸ 计数器：查询数、重试、429、错误、收到的字节数、缓存命中 / 未命中、生成的 QA 数……（线程安全）
+▸ 延迟直方图：对数分桶（相邻桶相差约 19%），汇总时给出 p50 / p95 / p99
+▸ phase(name)：分阶段记录墙钟 / CPU 时间和阶段内各计数器的增量与速率（如 qa/s）
+▸ 可选：每个阶段结束时记 tracemalloc 快照（阶段内新增内存最多的位置）
+▸ 可选：采样分析器，后台线程定时采所有线程的调用栈，统计热点函数
+▸ 输出：每个阶段一行 JSON（METRICS_FILE），进程退出时再写一行汇总并打印到 stderr
+
+环境变量：
+  METRICS_FILE         JSON lines 输出路径；不设时只在内存里统计，不输出
+  METRICS_TRACEMALLOC  设为 1 时每个阶段记 tracemalloc 快照
+  METRICS_PROFILE      采样间隔秒数（如 0.01）；设置后开启采样分析器
+
+用法：
+  from common.metrics import get_metrics
+  m = get_metrics()
+  with m.phase("subs"):
+      m.incr("qa", len(batch))
+      m.observe("sparql.latency_s", dt)
+"""
+
+import atexit, json, math, os, sys, threading, time, tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+METRICS_FILE = os.environ.get("METRICS_FILE")
+TRACEMALLOC = os.environ.get("METRICS_TRACEMALLOC") == "1"
+PROFILE = float(os.environ.get("METRICS_PROFILE") or 0)
+BUCKET_BASE = 2 ** 0.25
+TOP_N = 10
+
+class Histogram:
+    """对数分桶直方图；分位数取所在桶的上界（相对误差 < 19%）。"""
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count, self.total = 0, 0.0
+        self.min, self.max = math.inf, -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min, self.max = min(self.min, value), max(self.max, value)
+        self.buckets[math.floor(math.log(value, BUCKET_BASE)) if value > 0 else None] += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        keys = sorted(self.buckets, key=lambda b: -math.inf if b is None else b)
+        for b in keys:
+            seen += self.buckets[b]
+            if seen >= rank:
+                return 0.0 if b is None else min(self.max, BUCKET_BASE ** (b + 1))
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 6),
+            "min": round(self.min, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "max": round(self.max, 6),
+        }
+
+class SamplingProfiler:
+    """后台线程每 interval 秒采一次其它线程的栈：self = 栈顶函数，cum = 栈上出现过的函数（每次采样每个函数只记一次）。"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.self_counts, self.cum_counts = Counter(), Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @staticmethod
+    def _where(frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno} {code.co_name}"
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                self.samples += 1
+                self.self_counts[self._where(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    seen.add(self._where(frame))
+                    frame = frame.f_back
+                self.cum_counts.update(seen)
+
+    def summary(self, n=TOP_N):
+        if not self.samples:
+            return {"samples": 0}
+        pct = lambda c: round(100.0 * c / self.samples, 1)
+        return {
+            "samples": self.samples,
+            "interval_s": self.interval,
+            "self": [{"where": w, "pct": pct(c)} for w, c in self.self_counts.most_common(n)],
+            "cum": [{"where": w, "pct": pct(c)} for w, c in self.cum_counts.most_common(n)],
+        }
+
+class Metrics:
+    def __init__(self, path=METRICS_FILE, trace_memory=TRACEMALLOC, profile=PROFILE):
+        self.path = path
+        self.counters: Dict[str, float] = Counter()
+        self.histograms: Dict[str, Histogram] = {}
+        self.phases = []
+        self.t0, self.c0 = time.perf_counter(), time.process_time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._out = open(path, "a", encoding="utf-8") if path else None
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.profiler = None
+        if profile:
+            self.profiler = SamplingProfiler(profile)
+            self.profiler.start()
+        self._closed = False
+
+    # ---------- 记录 ----------
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, name, value):
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            hist.add(value)
+
+    @contextmanager
+    def timer(self, name):
+        """计时一段代码，结果记进直方图 name。"""
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t)
+
+    def emit(self, record):
+        if self._out is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), **record}, ensure_ascii=False, default=str)
+        with self._lock:
+            self._out.write(line + "\n")
+            self._out.flush()
+
+    # ---------- 阶段 ----------
+    @contextmanager
+    def phase(self, name, **fields):
+        """阶段可以嵌套；记录墙钟 / CPU 时间、计数器增量与每秒速率。"""
+        stack = self._local.__dict__.setdefault("stack", [])
+        full = "/".join(stack + [name])
+        stack.append(name)
+        with self._lock:
+            before = dict(self.counters)
+        snap = None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            snap = tracemalloc.take_snapshot()
+        t, c = time.perf_counter(), time.process_time()
+        try:
+            yield self
+        finally:
+            wall, cpu = time.perf_counter() - t, time.process_time() - c
+            stack.pop()
+            with self._lock:
+                delta = {k: v - before.get(k, 0) for k, v in self.counters.items() if v != before.get(k, 0)}
+            rec = {
+                "event": "phase",
+                "phase": full,
+                "wall_s": round(wall, 4),
+                "cpu_s": round(cpu, 4),
+                "counters": delta,
+                "rates": {f"{k}_per_s": round(v / wall, 3) for k, v in delta.items()} if wall > 0 else {},
+                **fields,
+            }
+            if snap is not None:
+                rec["memory"] = self._memory(snap)
+            self.phases.append(rec)
+            self.emit(rec)
+
+    @staticmethod
+    def _memory(before, n=TOP_N):
+        current, peak = tracemalloc.get_traced_memory()
+        diff = tracemalloc.take_snapshot().compare_to(before, "lineno")
+        return {
+            "current_mib": round(current / 2 ** 20, 2),
+            "peak_mib": round(peak / 2 ** 20, 2),
+            "top": [{"where": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+                     "size_kib": round(s.size_diff / 1024, 1), "count": s.count_diff}
+                    for s in diff[:n] if s.size_diff > 0],
+        }
+
+    # ---------- 汇总 ----------
+    def summary(self):
+        wall = time.perf_counter() - self.t0
+        with self._lock:
+            counters = dict(self.counters)
+            hists = {k: h.summary() for k, h in self.histograms.items()}
+        hits, misses = counters.get("cache.hits", 0), counters.get("cache.misses", 0)
+        out = {
+            "event": "summary",
+            "argv": sys.argv,
+            "wall_s": round(wall, 3),
+            "cpu_s": round(time.process_time() - self.c0, 3),
+            "counters": counters,
+            "rates": {f"{k}_per_s": round(v / wall, 3) for k, v in counters.items()} if wall > 0 else {},
+            "histograms": hists,
+            "phases": [{k: p[k] for k in ("phase", "wall_s", "cpu_s")} for p in self.phases],
+        }
+        if hits + misses:
+            out["cache_hit_rate"] = round(hits / (hits + misses), 4)
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            out["memory"] = {"current_mib": round(current / 2 ** 20, 2), "peak_mib": round(peak / 2 ** 20, 2)}
+        if self.profiler is not None:
+            out["profile"] = self.profiler.summary()
+        return out
+
+    def format_summary(self, s=None):
+        s = s or self.summary()
+        lines = [f"── metrics: {s['wall_s']:.1f}s wall, {s['cpu_s']:.1f}s cpu"]
+        for p in s["phases"]:
+            lines.append(f"   phase {p['phase']:<28} {p['wall_s']:>9.2f}s")
+        for k, v in sorted(s["counters"].items()):
+            lines.append(f"   {k:<34} {v:>12,.0f}  ({s['rates'].get(k + '_per_s', 0):,.2f}/s)")
+        for k, h in sorted(s["histograms"].items()):
+            if h["count"]:
+                lines.append(f"   {k:<34} n={h['count']:,} p50={h['p50']:.3g} p95={h['p95']:.3g} "
+                             f"p99={h['p99']:.3g} max={h['max']:.3g}")
+        if "cache_hit_rate" in s:
+            lines.append(f"   cache hit rate {s['cache_hit_rate']:.1%}")
+        for w in s.get("profile", {}).get("self", [])[:5]:
+            lines.append(f"   hot {w['pct']:>5.1f}%  {w['where']}")
+        return "\n".join(lines)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self._out is not None:
+            s = self.summary()
+            self.emit(s)
+            self._out.close()
+            self._out = None
+            print(self.format_summary(s), file=sys.stderr)
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+def get_metrics() -> Metrics:
+    """进程内单例；METRICS_FILE 设置时退出前自动写汇总。"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+            atexit.register(_metrics.close)
+        return _metrics
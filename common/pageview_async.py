@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pageview_async.py
+-----------------
+asyncio 版 Wikimedia pageview 抓取：
+▸ 一个 aiohttp 会话，keep-alive 连接池复用
+▸ AIMD 并发控制：成功时加性增加并发，429 / 5xx 时并发减半，并遵守 Retry-After 全局暂停
+▸ 每个标题独立重试（指数退避），失败返回 0（与同步版 get_views_12m 一致）
+▸ 请求数、429 / 5xx、重试、字节数与单次请求延迟记到 common.metrics
+"""
+
+import asyncio, random, time
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import aiohttp
+
+from common.metrics import get_metrics
+
+UA = "PopPop/pageviews-async 1.0 (email@example.com)"
+PV_API = "https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article"
+INIT_CONC = 5
+MAX_CONC = 100
+MIN_CONC = 1
+RETRIES = 5
+TIMEOUT = 20
+
+class AIMDLimiter:
+    """加性增 / 乘性减的并发上限；backoff() 还会让所有请求一起等到 Retry-After 之后。"""
+
+    def __init__(self, init=INIT_CONC, lo=MIN_CONC, hi=MAX_CONC):
+        self.limit = float(init)
+        self.lo, self.hi = lo, hi
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            while self.in_flight >= int(self.limit):
+                await self._cond.wait()
+            self.in_flight += 1
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def success(self):
+        # 每完成约 limit 个请求并发 +1
+        self.limit = min(self.hi, self.limit + 1.0 / self.limit)
+
+    def backoff(self, retry_after: Optional[float] = None):
+        self.limit = max(self.lo, self.limit / 2)
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def views_url(title, start, end, project="en.wikipedia", access="all-access", agent="user", granularity="monthly"):
+    return f"{PV_API}/{project}/{access}/{agent}/{quote(title, safe='')}/{granularity}/{start}/{end}"
+
+def last_12m_range(now: Optional[datetime] = None) -> Tuple[str, str]:
+    # 与 country/rich.py get_views_12m 相同的窗口：过去 365 天
+    now = now or datetime.utcnow()
+    return (now - timedelta(days=365)).strftime("%Y%m%d"), now.strftime("%Y%m%d")
+
+async def fetch_items(sess, limiter, url, stats, retries=RETRIES) -> Optional[List[Dict]]:
+    """返回 API 的 items；404 返回 []；重试耗尽返回 None。"""
+    m = get_metrics()
+    for attempt in range(retries):
+        await limiter.acquire()
+        retry_after = None
+        m.incr("pageviews.requests")
+        try:
+            t = time.perf_counter()
+            async with sess.get(url, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as r:
+                body = await r.read()
+                m.observe("pageviews.latency_s", time.perf_counter() - t)
+                m.incr("pageviews.bytes", len(body))
+                if r.status == 200:
+                    limiter.success()
+                    return (await r.json()).get("items", [])
+                if r.status == 404:
+                    limiter.success()
+                    return []
+                if r.status == 429 or r.status >= 500:
+                    stats["throttled"] += 1
+                    m.incr("pageviews.http_429" if r.status == 429 else "pageviews.http_5xx")
+                    retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                    limiter.backoff(retry_after)
+                else:
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            stats["errors"] += 1
+            m.incr("pageviews.errors")
+            limiter.backoff()
+        finally:
+            await limiter.release()
+        stats["retries"] += 1
+        m.incr("pageviews.retries")
+        await asyncio.sleep(retry_after if retry_after else min(30, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5))
+    return None
+
+async def fill_views(tasks, init_conc=INIT_CONC, max_conc=MAX_CONC, agent="user", progress=None):
+    """tasks: [(entity, title, field), ...]；把过去 12 个月的总访问量写入 entity[field]。"""
+    start, end = last_12m_range()
+    limiter = AIMDLimiter(init_conc, hi=max_conc)
+    stats = {"throttled": 0, "errors": 0, "retries": 0, "failed": 0}
+    conn = aiohttp.TCPConnector(limit=max_conc, keepalive_timeout=60, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(headers={"User-Agent": UA}, connector=conn) as sess:
+        async def one(task):
+            entity, title, field = task
+            items = await fetch_items(sess, limiter, views_url(title, start, end, agent=agent), stats)
+            if items is None:
+                stats["failed"] += 1
+                items = []
+            entity[field] = sum(it.get("views", 0) for it in items)
+            if progress is not None:
+                progress.update(1)
+
+        await asyncio.gather(*(one(t) for t in tasks))
+    stats["final_concurrency"] = int(limiter.limit)
+    return stats
+
+def run_fill_views(tasks, **kw):
+    return asyncio.run(fill_views(tasks, **kw))
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pageview_dump.py
+----------------
+用本地的 Wikimedia 月度 pageview dump 批量计算 views_12m，代替逐条调用 REST API。
+
+支持的文件（可放在同一个目录里，bz2 / gz / 纯文本均可）：
+▸ pageview_complete 月度文件  pageviews-202404-user.bz2
+  行格式：en.wikipedia Title page_id access_method monthly_total hourly_counts
+▸ 旧版小时级文件               pageviews-20240401-000000.gz
+  行格式：en Title views bytes（en / en.m 都算 enwiki）
+月份从文件名里的 YYYYMM 取。同一个月两种文件都有时只用月度文件，该月的小时级文件跳过，不会重复计数。
+只统计我们关心的 enwiki 标题（hash set 过滤），每个文件只读一遍。
+
+用法：
+  python -m common.pageview_dump <dump_dir> <popularity.json> [--as-of 2025-04]
+  （原地更新 popularity 文件里每个条目的 views_12m）
+"""
+
+import argparse, bz2, gzip, json, os, re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import unquote
+
+MONTH_RE = re.compile(r"(?<!\d)((?:19|20)\d{2})(0[1-9]|1[0-2])(\d{2})?(?!\d)")
+ENWIKI = (b"en.wikipedia", b"en", b"en.m")
+WINDOW = 12
+
+def normalize_title(title: str) -> str:
+    # REST 用的标题可能是 URL 编码的；dump 里是空格换成下划线的原始标题
+    return unquote(title).replace(" ", "_")
+
+def file_month(path) -> Optional[str]:
+    m = MONTH_RE.search(Path(path).name)
+    return f"{m.group(1)}-{m.group(2)}" if m else None
+
+def is_monthly(path) -> bool:
+    # 月度文件名里只有 YYYYMM，小时级文件是 YYYYMMDD
+    m = MONTH_RE.search(Path(path).name)
+    return bool(m) and m.group(3) is None
+
+def list_dump_files(dump_dir) -> List[Path]:
+    """目录里的 dump 文件；某月已有月度文件时，该月的小时级文件不列出（每个月只用一种来源）。"""
+    files = sorted(p for p in Path(dump_dir).iterdir() if p.is_file() and file_month(p))
+    monthly = {file_month(p) for p in files if is_monthly(p)}
+    return [p for p in files if is_monthly(p) or file_month(p) not in monthly]
+
+def _open(path):
+    path = str(path)
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+_titles = None
+
+def _init(titles):
+    global _titles
+    _titles = titles
+
+def scan_file(path, titles=None):
+    """返回 (month, {title: views})，只累计 titles 里的标题。"""
+    titles = titles if titles is not None else _titles
+    counts = defaultdict(int)
+    with _open(path) as f:
+        try:
+            for line in f:
+                parts = line.split(b" ")
+                if len(parts) < 3 or parts[0] not in ENWIKI or parts[1] not in titles:
+                    continue
+                try:
+                    views = int(parts[4]) if parts[0] == b"en.wikipedia" else int(parts[2])
+                except (IndexError, ValueError):
+                    continue
+                counts[parts[1]] += views
+        except (EOFError, OSError):
+            pass   # 截断的压缩文件：读到哪算哪
+    return file_month(path), {k.decode("utf-8"): v for k, v in counts.items()}
+
+def scan_dumps(dump_dir, titles: Iterable[str], workers=None) -> Dict[str, Dict[str, int]]:
+    """一遍扫完目录里的所有 dump，返回 {title: {"YYYY-MM": views}}（title 已规范化）。"""
+    wanted = {normalize_title(t).encode("utf-8") for t in titles if t}
+    files = list_dump_files(dump_dir)
+    monthly = defaultdict(lambda: defaultdict(int))
+    if not files or not wanted:
+        return {}
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init, initargs=(wanted,)) as ex:
+        for month, counts in ex.map(scan_file, files):
+            for title, views in counts.items():
+                monthly[title][month] += views
+    return {t: dict(m) for t, m in monthly.items()}
+
+def latest_month(dump_dir) -> Optional[str]:
+    months = [file_month(p) for p in list_dump_files(dump_dir)]
+    return max(months) if months else None
+
+def window_months(end_month: str, n: int = WINDOW) -> List[str]:
+    y, m = map(int, end_month.split("-"))
+    out = []
+    for _ in range(n):
+        out.append(f"{y:04d}-{m:02d}")
+        y, m = (y - 1, 12) if m == 1 else (y, m - 1)
+    return out[::-1]
+
+def views_in_window(months: Dict[str, int], end_month: str, n: int = WINDOW) -> int:
+    return sum(months.get(mo, 0) for mo in window_months(end_month, n))
+
+def fill_views_12m(items: List[Dict], dump_dir, title_key="title", field="views_12m",
+                   as_of: Optional[str] = None, workers=None) -> str:
+    """给 items 里每个带 title 的条目写入 field；返回所用窗口的结束月份。"""
+    as_of = as_of or latest_month(dump_dir)
+    if as_of is None:
+        raise FileNotFoundError(f"no pageview dump files found in {dump_dir}")
+    monthly = scan_dumps(dump_dir, (it.get(title_key) for it in items), workers)
+    for it in items:
+        title = it.get(title_key)
+        if title:
+            it[field] = views_in_window(monthly.get(normalize_title(title), {}), as_of)
+    return as_of
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fill views_12m from local pageview dumps")
+    ap.add_argument("dump_dir")
+    ap.add_argument("popularity")
+    ap.add_argument("--as-of", default=None, help="窗口结束月份 YYYY-MM，默认取 dump 中最新月份")
+    ap.add_argument("--workers", type=int, default=None)
+    args = ap.parse_args(argv)
+
+    path = Path(args.popularity)
+    data = json.loads(path.read_text(encoding="utf-8"))
+    key = next(k for k in data if k != "as_of")
+    items = data[key]
+    as_of = fill_views_12m(items, args.dump_dir, as_of=args.as_of, workers=args.workers)
+    items = [x for x in items if x.get("views_12m", 0) > 0]
+    items.sort(key=lambda x: -x["views_12m"])
+    path.write_text(json.dumps({"as_of": as_of, key: items}, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✓ {key}: {len(items)} entries with views, as_of {as_of} → {path}")
+
+if __name__ == "__main__":
+    main()
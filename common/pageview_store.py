@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pageview_store.py
+-----------------
+按 (标题, 月份) 存储的 enwiki 月度访问量，增量更新，任意窗口本地计算。
+▸ 数组存储：views[标题行, 月份列]（int64）+ known 掩码（该月是否已取到）；
+  月份列从 base 月份起连续编号，标题 → 行号用 dict 索引
+▸ refresh() 只请求每个标题缺失的月份（一个标题一次请求，覆盖第一个缺失月到 as_of）
+▸ window() / fill() 在本地算 3m / 12m / 24m / 任意 as_of 的窗口和，不访问网络；
+  fill() 只给窗口内每个月都已取到的标题写字段，窗口不全的（refresh 失败 / 只取到一部分）不写，返回其个数
+▸ 也可以从月度 pageview dump 灌入（ingest_dumps），与 common/pageview_dump.py 共用解析
+▸ 持久化为单个 .npz（原子替换写入）；不同 agent（user / all-agents）的数据分文件存
+
+环境变量：
+  PV_STORE    存储目录（默认 <repo>/.cache）；award/people fetch.py、country/rich.py 设置后改用本存储
+
+用法：
+  python -m common.pageview_store stats   <store.npz>
+  python -m common.pageview_store refresh <store.npz> <popularity.json> [--as-of 2025-04] [--months 24]
+  python -m common.pageview_store window  <store.npz> <title> [--as-of 2025-04] [--months 12]
+"""
+
+import argparse, asyncio, calendar, datetime, json, os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from common import pageview_async, pageview_dump
+from common.pageview_dump import normalize_title
+
+WINDOW = 12
+GROW = 64          # 扩容时多留的行 / 列，避免频繁复制
+
+def month_add(month: str, k: int) -> str:
+    y, m = map(int, month.split("-"))
+    y, m = divmod(y * 12 + (m - 1) + k, 12)
+    return f"{y:04d}-{m + 1:02d}"
+
+def month_diff(a: str, b: str) -> int:
+    """a - b，单位：月。"""
+    ya, ma = map(int, a.split("-"))
+    yb, mb = map(int, b.split("-"))
+    return (ya - yb) * 12 + (ma - mb)
+
+def last_complete_month(today: Optional[datetime.date] = None) -> str:
+    today = today or datetime.date.today()
+    return month_add(f"{today.year:04d}-{today.month:02d}", -1)
+
+def default_path(agent="user") -> Path:
+    root = Path(os.environ.get("PV_STORE", Path(__file__).resolve().parent.parent / ".cache"))
+    return root / f"pageviews-{agent}.npz"
+
+class PageviewStore:
+    def __init__(self, path=None, agent="user", project="en.wikipedia"):
+        self.path = Path(path) if path else default_path(agent)
+        self.agent, self.project = agent, project
+        self.titles: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.base: Optional[str] = None
+        self.views = np.zeros((0, 0), dtype=np.int64)
+        self.known = np.zeros((0, 0), dtype=bool)
+        self.n_months = 0
+        if self.path.exists():
+            self._load()
+
+    # ---------- 持久化 ----------
+    def _load(self):
+        with np.load(self.path) as z:
+            meta = json.loads(bytes(z["meta"]).decode("utf-8"))
+            self.views, self.known = z["views"], z["known"]
+        self.titles = meta["titles"]
+        self.index = {t: i for i, t in enumerate(self.titles)}
+        self.base, self.n_months = meta["base"], meta["n_months"]
+        self.agent, self.project = meta.get("agent", self.agent), meta.get("project", self.project)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        n, m = len(self.titles), self.n_months
+        meta = {"titles": self.titles, "base": self.base, "n_months": m,
+                "agent": self.agent, "project": self.project}
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, views=self.views[:n, :m], known=self.known[:n, :m],
+                                meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8))
+        os.replace(tmp, self.path)
+
+    # ---------- 索引 ----------
+    def _grow(self, rows: int, cols: int, shift: int = 0):
+        """保证至少 rows 行、cols 列；shift > 0 时在左侧插入 shift 个更早的月份。"""
+        r0, c0 = self.views.shape
+        if rows <= r0 and cols <= c0 and not shift:
+            return
+        new_r = r0 if rows <= r0 else rows + GROW
+        new_c = c0 + shift if cols <= c0 + shift else cols + GROW
+        views = np.zeros((new_r, new_c), dtype=np.int64)
+        known = np.zeros((new_r, new_c), dtype=bool)
+        views[:r0, shift:shift + c0] = self.views
+        known[:r0, shift:shift + c0] = self.known
+        self.views, self.known = views, known
+
+    def _col(self, month: str) -> int:
+        if self.base is None:
+            self.base = month
+        k = month_diff(month, self.base)
+        if k < 0:
+            self._grow(len(self.titles), self.n_months - k, shift=-k)
+            self.base, self.n_months, k = month, self.n_months - k, 0
+        if k >= self.n_months:
+            self._grow(len(self.titles), k + 1)
+            self.n_months = k + 1
+        return k
+
+    def _row(self, title: str) -> int:
+        i = self.index.get(title)
+        if i is None:
+            i = self.index[title] = len(self.titles)
+            self.titles.append(title)
+            self._grow(len(self.titles), self.n_months)
+        return i
+
+    # ---------- 写 ----------
+    def put(self, title: str, month: str, views: int):
+        col = self._col(month)
+        row = self._row(normalize_title(title))
+        self.views[row, col] = views
+        self.known[row, col] = True
+
+    def put_many(self, title: str, months: Dict[str, int]):
+        for month, views in months.items():
+            self.put(title, month, views)
+
+    def mark_known(self, title: str, start: str, end: str):
+        """start..end 内没有写入过的月份记为 0（API 不返回没有访问量的月份）。"""
+        row = self._row(normalize_title(title))
+        lo, hi = self._col(start), self._col(end)
+        self.known[row, lo:hi + 1] = True
+
+    # ---------- 读 ----------
+    def _known_window(self, i: Optional[int], lo: int, hi: int) -> np.ndarray:
+        # 相对 base 的列 lo..hi（闭区间）是否已取到；超出已存范围的列视为缺失
+        w = np.zeros(hi - lo + 1, dtype=bool)
+        a, b = max(lo, 0), min(hi, self.n_months - 1)
+        if i is not None and b >= a:
+            w[a - lo:b - lo + 1] = self.known[i, a:b + 1]
+        return w
+
+    def missing(self, titles: Iterable[str], as_of: str, months: int = WINDOW) -> Dict[str, str]:
+        """返回 {title: 窗口内第一个缺失的月份}；窗口已齐全的标题不出现。"""
+        first = month_add(as_of, -(months - 1))
+        out = {}
+        for t in titles:
+            if self.base is None:
+                out[t] = first
+                continue
+            lo = month_diff(first, self.base)
+            w = self._known_window(self.index.get(normalize_title(t)), lo, lo + months - 1)
+            gaps = np.flatnonzero(~w)
+            if gaps.size:
+                out[t] = month_add(first, int(gaps[0]))
+        return out
+
+    def series(self, title: str) -> Dict[str, int]:
+        i = self.index.get(normalize_title(title))
+        if i is None:
+            return {}
+        cols = np.flatnonzero(self.known[i, :self.n_months])
+        return {month_add(self.base, int(c)): int(self.views[i, c]) for c in cols}
+
+    def window(self, title: str, as_of: str, months: int = WINDOW) -> int:
+        i = self.index.get(normalize_title(title))
+        if i is None or self.base is None:
+            return 0
+        lo = max(0, month_diff(as_of, self.base) - months + 1)
+        hi = min(self.n_months, month_diff(as_of, self.base) + 1)
+        return int(self.views[i, lo:hi].sum()) if hi > lo else 0
+
+    def windows(self, titles: Iterable[str], as_of: str, months: int = WINDOW) -> np.ndarray:
+        """向量化版 window：一次取多行、一段列求和。"""
+        rows = np.array([self.index.get(normalize_title(t), -1) for t in titles], dtype=np.int64)
+        out = np.zeros(len(rows), dtype=np.int64)
+        if self.base is None or not len(rows):
+            return out
+        lo = max(0, month_diff(as_of, self.base) - months + 1)
+        hi = min(self.n_months, month_diff(as_of, self.base) + 1)
+        ok = rows >= 0
+        if hi > lo and ok.any():
+            out[ok] = self.views[rows[ok], lo:hi].sum(axis=1)
+        return out
+
+    def complete(self, titles: Iterable[str], as_of: str, months: int = WINDOW) -> np.ndarray:
+        """每个标题的窗口是否每个月都已取到（known）；窗口超出已存月份范围时为 False。"""
+        rows = np.array([self.index.get(normalize_title(t), -1) for t in titles], dtype=np.int64)
+        out = np.zeros(len(rows), dtype=bool)
+        if self.base is None or not len(rows):
+            return out
+        hi = month_diff(as_of, self.base) + 1
+        lo = hi - months
+        ok = rows >= 0
+        if lo >= 0 and hi <= self.n_months and ok.any():
+            out[ok] = self.known[rows[ok], lo:hi].all(axis=1)
+        return out
+
+    def fill(self, items: List[Dict], as_of: str, months: int = WINDOW,
+             title_key="title", field="views_12m") -> int:
+        """写入窗口和；窗口不全的标题不写 field（不写一个偏小的值），返回这类标题的个数。"""
+        with_title = [it for it in items if it.get(title_key)]
+        titles = [it[title_key] for it in with_title]
+        incomplete = 0
+        for it, v, full in zip(with_title, self.windows(titles, as_of, months), self.complete(titles, as_of, months)):
+            if full:
+                it[field] = int(v)
+            else:
+                incomplete += 1
+        return incomplete
+
+    # ---------- 增量更新 ----------
+    async def refresh_async(self, titles: Iterable[str], as_of: Optional[str] = None, months: int = WINDOW,
+                            init_conc=pageview_async.INIT_CONC, max_conc=pageview_async.MAX_CONC, progress=None):
+        """只请求缺失的月份；返回统计信息。"""
+        import aiohttp
+        as_of = as_of or last_complete_month()
+        todo = self.missing(titles, as_of, months)
+        end_day = calendar.monthrange(*map(int, as_of.split("-")))[1]
+        end = as_of.replace("-", "") + f"{end_day:02d}"
+        limiter = pageview_async.AIMDLimiter(init_conc, hi=max_conc)
+        stats = {"titles": len(todo), "throttled": 0, "errors": 0, "retries": 0, "failed": 0}
+        conn = aiohttp.TCPConnector(limit=max_conc, keepalive_timeout=60, ttl_dns_cache=300)
+        async with aiohttp.ClientSession(headers={"User-Agent": pageview_async.UA}, connector=conn) as sess:
+            async def one(title, first):
+                url = pageview_async.views_url(normalize_title(title), first.replace("-", "") + "01", end,
+                                               project=self.project, agent=self.agent)
+                items = await pageview_async.fetch_items(sess, limiter, url, stats)
+                if items is None:
+                    stats["failed"] += 1     # 失败的标题保持缺失，下次再取
+                else:
+                    for it in items:
+                        ts = it.get("timestamp", "")
+                        self.put(title, f"{ts[:4]}-{ts[4:6]}", it.get("views", 0))
+                    self.mark_known(title, first, as_of)
+                if progress is not None:
+                    progress.update(1)
+
+            await asyncio.gather(*(one(t, first) for t, first in todo.items()))
+        return stats
+
+    def refresh(self, titles: Iterable[str], as_of: Optional[str] = None, months: int = WINDOW, **kw):
+        return asyncio.run(self.refresh_async(titles, as_of, months, **kw))
+
+    def ingest_dumps(self, dump_dir, titles: Iterable[str], workers=None):
+        """从月度 pageview dump 灌入；dump 覆盖到的月份全部标记为已知。"""
+        titles = [t for t in titles if t]
+        monthly = pageview_dump.scan_dumps(dump_dir, titles, workers)
+        months = sorted({pageview_dump.file_month(p) for p in pageview_dump.list_dump_files(dump_dir)})
+        for t in titles:
+            key = normalize_title(t)
+            for month in months:
+                self.put(key, month, monthly.get(key, {}).get(month, 0))
+
+    def stats(self) -> Dict:
+        return {
+            "path": str(self.path), "agent": self.agent, "titles": len(self.titles),
+            "months": self.n_months, "first": self.base,
+            "last": month_add(self.base, self.n_months - 1) if self.base else None,
+            "known_cells": int(self.known[:len(self.titles), :self.n_months].sum()),
+        }
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Monthly pageview time-series store")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("stats"); p.add_argument("store")
+    p = sub.add_parser("refresh"); p.add_argument("store"); p.add_argument("popularity")
+    p.add_argument("--as-of"); p.add_argument("--months", type=int, default=WINDOW)
+    p.add_argument("--agent", default="user")
+    p = sub.add_parser("window"); p.add_argument("store"); p.add_argument("title")
+    p.add_argument("--as-of"); p.add_argument("--months", type=int, default=WINDOW)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "stats":
+        print(json.dumps(PageviewStore(args.store).stats(), ensure_ascii=False, indent=2))
+    elif args.cmd == "refresh":
+        store = PageviewStore(args.store, agent=args.agent)
+        data = json.loads(Path(args.popularity).read_text(encoding="utf-8"))
+        key = next(k for k in data if k != "as_of")
+        print(store.refresh([it.get("title") for it in data[key] if it.get("title")], args.as_of, args.months))
+        store.save()
+        print(json.dumps(store.stats(), ensure_ascii=False))
+    else:
+        store = PageviewStore(args.store)
+        as_of = args.as_of or last_complete_month()
+        print(json.dumps({"title": args.title, "as_of": as_of, "months": args.months,
+                          "views": store.window(args.title, as_of, args.months),
+                          "complete": bool(store.complete([args.title], as_of, args.months)[0])}, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
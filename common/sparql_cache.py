@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+sparql_cache.py
+---------------
+所有 WDQS 抓取脚本共用的本地 SPARQL 结果缓存（SQLite 单文件）。
+▸ key = sha256(规范化后的查询文本)，相同查询只打一次 WDQS
+▸ 每条记录带 TTL，总大小超过上限时按 LRU 淘汰
+▸ 命中 / 未命中计数；可按单条查询或整个 namespace 强制刷新
+▸ 支持导出 / 导入缓存包（jsonl.gz），方便在机器之间拷贝
+
+环境变量：
+  SPARQL_CACHE_DIR      缓存目录（默认 <repo>/.cache）
+  SPARQL_CACHE=0        关闭缓存
+  SPARQL_CACHE_REFRESH  逗号分隔的 namespace，本次运行全部强制刷新（"*" 表示全部）
+
+命令行：
+  python -m common.sparql_cache stats
+  python -m common.sparql_cache clear [namespace]
+  python -m common.sparql_cache export bundle.jsonl.gz [namespace]
+  python -m common.sparql_cache import bundle.jsonl.gz
+"""
+
+import gzip, hashlib, json, os, re, sqlite3, sys, threading, time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from common.metrics import get_metrics
+
+CACHE_DIR = Path(os.environ.get("SPARQL_CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+CACHE_FILE = "sparql.sqlite"
+DEFAULT_TTL = 30 * 24 * 3600        # 30 天
+MAX_BYTES = 2 * 1024 ** 3           # 2 GB
+DEFAULT_NS = "default"
+
+_WS = re.compile(r"\s+")
+
+def normalize_query(query: str) -> str:
+    # 去掉首尾空白并把连续空白压成一个空格，缩进 / 换行不同的同一查询共享一个 key
+    return _WS.sub(" ", query).strip()
+
+def query_key(query: str) -> str:
+    return hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+
+def _refresh_env():
+    raw = os.environ.get("SPARQL_CACHE_REFRESH", "")
+    return {x.strip() for x in raw.split(",") if x.strip()}
+
+class SparqlCache:
+    def __init__(self, path=None, ttl: int = DEFAULT_TTL, max_bytes: int = MAX_BYTES, enabled=None):
+        self.path = Path(path) if path else CACHE_DIR / CACHE_FILE
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = (os.environ.get("SPARQL_CACHE", "1") != "0") if enabled is None else enabled
+        self.refresh_namespaces = _refresh_env()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._db = None
+        if self.enabled:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    expires REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_ns ON entries(namespace)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON entries(accessed)")
+
+    # 当前线程最近一次 fetch 是否命中（调用方据此决定是否需要 sleep 限流）
+    @property
+    def last_hit(self) -> bool:
+        return getattr(self._local, "hit", False)
+
+    def _should_refresh(self, namespace):
+        return "*" in self.refresh_namespaces or namespace in self.refresh_namespaces
+
+    def get(self, query: str, namespace: str = DEFAULT_NS) -> Optional[Any]:
+        if not self.enabled or self._should_refresh(namespace):
+            return None
+        key, now = query_key(query), time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM entries WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._db.execute("DELETE FROM entries WHERE key=?", (key,))
+                return None
+            self._db.execute("UPDATE entries SET accessed=? WHERE key=?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, query: str, value: Any, namespace: str = DEFAULT_NS, ttl: Optional[int] = None):
+        if not self.enabled:
+            return
+        blob = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?,?)",
+                (query_key(query), namespace, normalize_query(query), blob, len(blob),
+                 now, now + (self.ttl if ttl is None else ttl), now))
+            self._evict()
+
+    def fetch(self, query: str, loader: Callable[[], Any], namespace: str = DEFAULT_NS,
+              ttl: Optional[int] = None, refresh: bool = False) -> Any:
+        """命中直接返回；否则调用 loader() 取实时结果并写入缓存。loader 返回 None 视为失败，不缓存。"""
+        if not refresh:
+            value = self.get(query, namespace)
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                get_metrics().incr("cache.hits")
+                self._local.hit = True
+                return value
+        with self._lock:
+            self.misses += 1
+        get_metrics().incr("cache.misses")
+        self._local.hit = False
+        value = loader()
+        if value is not None:
+            self.put(query, value, namespace, ttl)
+        return value
+
+    def iter_entries(self, namespace: Optional[str] = None) -> Iterator[Tuple[str, Any]]:
+        """遍历未过期的缓存条目，产出 (规范化后的查询, 结果)；不更新 accessed，也不计入命中。"""
+        if not self.enabled:
+            return
+        sql, args = "SELECT query, value FROM entries WHERE expires >= ?", (time.time(),)
+        if namespace is not None:
+            sql += " AND namespace=?"
+            args += (namespace,)
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        for query, value in rows:
+            yield query, json.loads(value)
+
+    def _evict(self):
+        # 调用方已持有锁：先删过期，再按 accessed 从旧到新删到总大小低于上限
+        now = time.time()
+        self._db.execute("DELETE FROM entries WHERE expires < ?", (now,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed, stale = 0, []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            stale.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        self._db.executemany("DELETE FROM entries WHERE key=?", stale)
+
+    def invalidate(self, query: Optional[str] = None, namespace: Optional[str] = None) -> int:
+        """删除单条查询、整个 namespace，或（都不传时）全部缓存。返回删除条数。"""
+        if not self.enabled:
+            return 0
+        with self._lock:
+            if query is not None:
+                cur = self._db.execute("DELETE FROM entries WHERE key=?", (query_key(query),))
+            elif namespace is not None:
+                cur = self._db.execute("DELETE FROM entries WHERE namespace=?", (namespace,))
+            else:
+                cur = self._db.execute("DELETE FROM entries")
+            return cur.rowcount
+
+    def export_bundle(self, path, namespace: Optional[str] = None) -> int:
+        # 缓存关闭时与 invalidate 一样返回 0，不写文件
+        if not self.enabled:
+            return 0
+        sql = "SELECT namespace, query, value, created, expires FROM entries"
+        args = ()
+        if namespace is not None:
+            sql += " WHERE namespace=?"
+            args = (namespace,)
+        n = 0
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for ns, query, value, created, expires in rows:
+                f.write(json.dumps({"namespace": ns, "query": query, "value": json.loads(value),
+                                    "created": created, "expires": expires}, ensure_ascii=False) + "\n")
+                n += 1
+        return n
+
+    def import_bundle(self, path) -> int:
+        # 已过期的条目跳过；同 key 以导入包为准。缓存关闭时什么也不导入，返回 0
+        if not self.enabled:
+            return 0
+        n, now = 0, time.time()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                rec = json.loads(line)
+                if rec["expires"] < now:
+                    continue
+                self.put(rec["query"], rec["value"], rec["namespace"], ttl=int(rec["expires"] - now))
+                n += 1
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        out = {"hits": self.hits, "misses": self.misses, "entries": 0, "bytes": 0, "namespaces": {}}
+        if not self.enabled:
+            return out
+        with self._lock:
+            for ns, cnt, size in self._db.execute(
+                    "SELECT namespace, COUNT(*), SUM(size) FROM entries GROUP BY namespace"):
+                out["namespaces"][ns] = cnt
+                out["entries"] += cnt
+                out["bytes"] += size
+        return out
+
+# ---------- 进程内共享实例 ----------
+_default = None
+_default_lock = threading.Lock()
+
+def get_cache() -> SparqlCache:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = SparqlCache()
+        return _default
+
+def _main(argv):
+    if not argv:
+        print(__doc__)
+        return 1
+    cache, cmd = get_cache(), argv[0]
+    if cmd == "stats":
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    elif cmd == "clear":
+        ns = argv[1] if len(argv) > 1 else None
+        print(f"✓ removed {cache.invalidate(namespace=ns)} entries")
+    elif cmd == "export" and len(argv) >= 2:
+        print(f"✓ exported {cache.export_bundle(argv[1], argv[2] if len(argv) > 2 else None)} entries to {argv[1]}")
+    elif cmd == "import" and len(argv) == 2:
+        print(f"✓ imported {cache.import_bundle(argv[1])} entries from {argv[1]}")
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+sparql_client.py
+----------------
+所有 WDQS 抓取脚本共用的 SPARQL 客户端。
+▸ requests.Session 连接池（keep-alive、gzip），每个线程一个会话，线程安全
+▸ 进程内唯一的令牌桶限速：同一进程里跑多个抓取器也不会叠加对 WDQS 的压力
+▸ 429 / 5xx 遵守 Retry-After（全局暂停），其余错误指数退避 + 抖动
+▸ retry_timeouts=False：超时（5xx / 408 / 客户端超时，WDQS 的查询超时报为 5xx）立即抛出，不重试；
+  给自带二分或降级方案的调用方用，免得每次先等满 RETRIES 轮
+▸ 每次查询带超时；async 代码用 aquery / abindings（在线程池里执行）
+▸ 请求数、重试、429、字节数与单次请求延迟同时记到 common.metrics
+
+环境变量：
+  SPARQL_MAX_RPS    每秒最多发起的请求数（默认 2）
+  SPARQL_TIMEOUT    单次请求超时秒数（默认 65，略大于 WDQS 的 60s 服务端上限）
+
+用法：
+  from common.sparql_client import get_client, SparqlError
+  rows = get_client().bindings(query, agent="PopPop/xxx 1.0")
+"""
+
+import asyncio, os, random, threading, time
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.metrics import get_metrics
+from common.pageview_async import parse_retry_after
+
+WDQS = "https://query.wikidata.org/sparql"
+UA = "PopPop/sparql-client 1.0 (email@example.com)"
+MAX_RPS = float(os.environ.get("SPARQL_MAX_RPS", 2.0))
+BURST = 3
+RETRIES = 4
+BACKOFF = 2.0                 # 首次重试等待秒数，之后指数翻倍
+MAX_BACKOFF = 60.0
+TIMEOUT = float(os.environ.get("SPARQL_TIMEOUT", 65))
+POOL_SIZE = 16
+POST_OVER = 1500              # 查询长于此（字符）时改用 POST，避免 URL 过长
+
+class SparqlError(Exception):
+    pass
+
+class TokenBucket:
+    """线程安全令牌桶：rate 个/秒补充，最多攒 burst 个；pause() 让所有请求一起等到指定时刻。"""
+
+    def __init__(self, rate, burst=1):
+        self.rate, self.burst = rate, burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                    self.stamp = now
+                    if self.tokens >= 1 or not self.rate:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.stamp = self.paused_until
+
+class SparqlClient:
+    def __init__(self, endpoint=WDQS, agent=UA, rps=MAX_RPS, burst=BURST, retries=RETRIES,
+                 timeout=TIMEOUT, backoff=BACKOFF):
+        self.endpoint, self.agent = endpoint, agent
+        self.bucket = TokenBucket(rps, burst)
+        self.retries, self.timeout, self.backoff = retries, timeout, backoff
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "errors": 0, "bytes": 0}
+
+    def configure(self, rps=None, burst=None, retries=None, timeout=None):
+        if rps is not None or burst is not None:
+            with self.bucket.lock:
+                self.bucket.rate = self.bucket.rate if rps is None else rps
+                self.bucket.burst = self.bucket.burst if burst is None else burst
+        if retries is not None:
+            self.retries = retries
+        if timeout is not None:
+            self.timeout = timeout
+
+    def _session(self) -> requests.Session:
+        sess = getattr(self._local, "session", None)
+        if sess is None:
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            sess.mount("https://", adapter)
+            sess.mount("http://", adapter)
+            sess.headers.update({
+                "Accept": "application/sparql-results+json",
+                "Accept-Encoding": "gzip, deflate",
+            })
+            self._local.session = sess
+        return sess
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _send(self, query, agent, timeout):
+        headers = {"User-Agent": agent or self.agent}
+        if len(query) > POST_OVER:
+            return self._session().post(self.endpoint, data={"query": query, "format": "json"},
+                                        headers=headers, timeout=timeout)
+        return self._session().get(self.endpoint, params={"query": query, "format": "json"},
+                                   headers=headers, timeout=timeout)
+
+    def query(self, query: str, agent: Optional[str] = None, timeout: Optional[float] = None,
+              retry_timeouts: bool = True) -> Dict:
+        """返回完整的 JSON 结果；重试耗尽抛 SparqlError。retry_timeouts=False 时超时类失败第一次就抛出。"""
+        last = None
+        m = get_metrics()
+        for attempt in range(self.retries):
+            self.bucket.acquire()
+            self._count("requests")
+            m.incr("sparql.requests")
+            wait, timed_out = None, False
+            try:
+                t = time.perf_counter()
+                r = self._send(query, agent, timeout or self.timeout)
+                m.observe("sparql.latency_s", time.perf_counter() - t)
+                if r.status_code == 200:
+                    self._count("bytes", len(r.content))
+                    m.incr("sparql.bytes", len(r.content))
+                    return r.json()
+                last = f"HTTP {r.status_code}"
+                timed_out = r.status_code == 408 or r.status_code >= 500
+                if r.status_code == 429 or r.status_code >= 500:
+                    self._count("throttled")
+                    m.incr("sparql.http_429" if r.status_code == 429 else "sparql.http_5xx")
+                    wait = parse_retry_after(r.headers.get("Retry-After"))
+                    if wait:
+                        self.bucket.pause(wait)   # 所有线程一起暂停
+                elif r.status_code != 408:
+                    # 4xx（多为查询语法错误）重试也没用
+                    raise SparqlError(f"{last}: {r.text[:200]}")
+            except (requests.RequestException, ValueError) as exc:
+                self._count("errors")
+                m.incr("sparql.errors")
+                last = repr(exc)
+                timed_out = isinstance(exc, requests.Timeout)
+            if timed_out and not retry_timeouts:
+                raise SparqlError(f"query timed out, not retried: {last}")
+            if attempt + 1 < self.retries:
+                self._count("retries")
+                m.incr("sparql.retries")
+                time.sleep(wait if wait else min(MAX_BACKOFF, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5))
+        raise SparqlError(f"query failed after {self.retries} attempts: {last}")
+
+    def bindings(self, query: str, agent: Optional[str] = None, timeout: Optional[float] = None,
+                 retry_timeouts: bool = True) -> List[Dict]:
+        return self.query(query, agent, timeout, retry_timeouts)["results"]["bindings"]
+
+    async def aquery(self, query: str, agent: Optional[str] = None, timeout: Optional[float] = None,
+                     retry_timeouts: bool = True) -> Dict:
+        return await asyncio.to_thread(self.query, query, agent, timeout, retry_timeouts)
+
+    async def abindings(self, query: str, agent: Optional[str] = None, timeout: Optional[float] = None,
+                        retry_timeouts: bool = True) -> List[Dict]:
+        return (await self.aquery(query, agent, timeout, retry_timeouts))["results"]["bindings"]
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> SparqlClient:
+    """进程内单例；所有抓取器共用同一个限速器。"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = SparqlClient()
+        return _client
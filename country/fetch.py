@@ -1,19 +1,33 @@
 # fetch_subdivisions_area_capital_concurrent.py
 
-import json, sys, time, re
+import json, sys, re
 from pathlib import Path
 from collections import defaultdict
 from typing import Dict, List, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from SPARQLWrapper import SPARQLWrapper, JSON
 from tqdm import tqdm
 
-WD_ENDPOINT = "https://query.wikidata.org/sparql"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.metrics import get_metrics
+from common.sparql_cache import get_cache
+from common.sparql_client import SparqlError, get_client
+
+UA = "SubdivFetcher/1.0 (+https://chat.openai.com/)"
 ADM1_CLASS = "wd:Q10864048"   # first-level administrative division
 CITY_CLASS = "wd:Q515"        # city
 AREA_PROP = "P2046"           # area
 CAPITAL_PROP = "P36"          # capital
+POP_PROP = "P1082"            # population
+CAPITAL_BATCH = 200           # 每次 VALUES 查询的国家数
+CAPITAL_STATS = False         # True 时同时取首都面积、人口（area_km2 / population）
+TREE_MODE = "auto"            # single：一条传递查询 / chunked：先省后市 / auto：single 失败再 chunked
+PROVINCE_WORKERS = 4          # chunked 模式下每个国家同时查询的省数
+CITY_PAGE = 2000              # 每省城市分页大小（按 STR(?city) keyset 翻页）
+# 抓取时就带上国家 / 省 / 首都 / 城市的 enwiki 条目名（title），rich.py 不再单独查标题。
+# 没有 enwiki 条目的节点记 "title": null，rich.py 看到有这个键就不再重查。
+# 每个条目至多一个 enwiki sitelink，OPTIONAL 子句不会让行数膨胀
+WITH_TITLES = True
 
 def parse_quantity(val):
     if val.startswith("http://www.wikidata.org/.well-known/genid/"):
@@ -23,19 +37,28 @@ def parse_quantity(val):
     except Exception:
         return None
 
-def run_query(query: str) -> List[Dict]:
-    sparql = SPARQLWrapper(WD_ENDPOINT)
-    sparql.setReturnFormat(JSON)
-    sparql.addCustomHttpHeader("User-Agent", "SubdivFetcher/1.0 (+https://chat.openai.com/)")
-    for _ in range(3):
+def run_query(query: str, refresh: bool = False, strict: bool = False, retry_timeouts: bool = True) -> List[Dict]:
+    def live():
         try:
-            sparql.setQuery(query)
-            time.sleep(1.05)
-            return sparql.query().convert()["results"]["bindings"]
-        except Exception as exc:
-            print("SPARQL error, retrying:", exc, file=sys.stderr)
-            time.sleep(5)
-    return []
+            return get_client().bindings(query, agent=UA, retry_timeouts=retry_timeouts)
+        except SparqlError as exc:
+            print("SPARQL error:", exc, file=sys.stderr)
+            return None
+    # 失败（None）不写缓存，对外仍返回 []；strict=True 时抛出，便于调用方换一种查法
+    rows = get_cache().fetch(query, live, namespace="country", refresh=refresh)
+    if rows is None and strict:
+        raise RuntimeError("SPARQL query failed")
+    return rows or []
+
+def _title_clause(var: str) -> str:
+    # ?var 的英文维基条目名 → ?{var}Title
+    return f"""OPTIONAL {{ ?{var}Article schema:about ?{var} ;
+                           schema:isPartOf <https://en.wikipedia.org/> ;
+                           schema:name ?{var}Title . }}"""
+
+def _title(r: Dict, var: str) -> Optional[str]:
+    # 与 rich.py 的 batch_get_enwiki_titles 相同：空格换成下划线
+    return r[f"{var}Title"]["value"].replace(" ", "_") if f"{var}Title" in r else None
 
 def get_country_capital(country_qid):
     query = f"""
@@ -52,12 +75,133 @@ def get_country_capital(country_qid):
         }
     return None
 
-def fetch_country_tree(country_qid: str, country_label: str):
+def get_country_capitals(country_qids: List[str], with_stats: bool = CAPITAL_STATS,
+                         batch: int = CAPITAL_BATCH, with_titles: bool = None,
+                         country_titles: Optional[Dict[str, Optional[str]]] = None) -> Dict[str, Optional[Dict]]:
+    """
+    一次 VALUES 查询多个国家的首都，返回 {country_qid: 与 get_country_capital 相同的结构}。
+    传入 country_titles 时，同一条查询顺带把国家本身的 enwiki 条目名写进去（没有条目为 None）。
+    """
+    with_titles = WITH_TITLES if with_titles is None else with_titles
+    want_country = with_titles and country_titles is not None
+    capitals: Dict[str, Optional[Dict]] = {q: None for q in country_qids}
+    stats_select = "?capArea ?capPop" if with_stats else ""
+    stats_where = f"""
+      OPTIONAL {{ ?capital wdt:{AREA_PROP} ?capArea . }}
+      OPTIONAL {{ ?capital wdt:{POP_PROP} ?capPop . }}""" if with_stats else ""
+    if with_titles:
+        stats_select += " ?capitalTitle"
+        stats_where += "\n          " + _title_clause("capital")
+    # 要国家标题时首都改为 OPTIONAL，没有首都的国家也有一行
+    capital_where = f"?country wdt:{CAPITAL_PROP} ?capital.{stats_where}"
+    if want_country:
+        stats_select += " ?countryTitle"
+        capital_where = f"OPTIONAL {{ {capital_where} }}\n          {_title_clause('country')}"
+    for i in range(0, len(country_qids), batch):
+        values = " ".join(f"wd:{q}" for q in country_qids[i:i + batch])
+        query = f"""
+        SELECT ?country ?capital ?capitalLabel {stats_select} WHERE {{
+          VALUES ?country {{ {values} }}
+          {capital_where}
+          SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
+        }}
+        """
+        for r in run_query(query):
+            country = r["country"]["value"].split("/")[-1]
+            if want_country and country_titles.get(country) is None:
+                country_titles[country] = _title(r, "country")
+            if "capital" not in r:
+                continue
+            cap_qid = r["capital"]["value"].split("/")[-1]
+            cap = capitals.get(country)
+            if cap is None:
+                # 与单国查询一致：取第一行的首都
+                cap = capitals[country] = {"qid": cap_qid, "label": r["capitalLabel"]["value"]}
+                if with_titles:
+                    cap["title"] = _title(r, "capital")
+                if with_stats:
+                    cap["area_km2"] = cap["population"] = None
+            if with_stats and cap["qid"] == cap_qid:
+                if cap["area_km2"] is None and "capArea" in r:
+                    cap["area_km2"] = parse_quantity(r["capArea"]["value"])
+                if cap["population"] is None and "capPop" in r:
+                    cap["population"] = parse_quantity(r["capPop"]["value"])
+    return capitals
+
+def _merge_province(provinces: Dict[str, Dict], r: Dict, with_titles: bool = False) -> Dict:
+    prov_qid = r["province"]["value"].split("/")[-1]
+    prov_label = r["provinceLabel"]["value"]
+    prov_area = parse_quantity(r["provArea"]["value"]) if "provArea" in r and r["provArea"]["value"] else None
+
+    prov_cap_qid = r["provCapital"]["value"].split("/")[-1] if "provCapital" in r else None
+    prov_cap_label = r["provCapitalLabel"]["value"] if "provCapitalLabel" in r else None
+    prov_capital = {"qid": prov_cap_qid, "label": prov_cap_label} if prov_cap_qid and prov_cap_label else None
+    if prov_capital and with_titles:
+        prov_capital["title"] = _title(r, "provCapital")
+    prov_title = _title(r, "province")
+
+    # province node: only set if not exists
+    prov_node = provinces.get(prov_qid)
+    if prov_node is None:
+        prov_node = {
+            "qid": prov_qid,
+            "label": prov_label,
+            "children": []
+        }
+        if prov_area is not None:
+            prov_node["area_km2"] = prov_area
+        prov_node["capital"] = prov_capital if prov_capital else None
+        if with_titles:
+            prov_node["title"] = prov_title
+        provinces[prov_qid] = prov_node
+    else:
+        # update area/capital if not yet set
+        if prov_area is not None and "area_km2" not in prov_node:
+            prov_node["area_km2"] = prov_area
+        if prov_capital and not prov_node.get("capital"):
+            prov_node["capital"] = prov_capital
+        if prov_title and not prov_node.get("title"):
+            prov_node["title"] = prov_title
+    return prov_node
+
+def _merge_city(prov_node: Dict, r: Dict, seen: set, with_titles: bool = False):
+    if "city" not in r or not r["city"]["value"]:
+        return
+    city_qid = r["city"]["value"].split("/")[-1]
+    if city_qid in seen:
+        return
+    seen.add(city_qid)
+
+    city_label = r["cityLabel"]["value"] if "cityLabel" in r else None
+    city_area = parse_quantity(r["cityArea"]["value"]) if "cityArea" in r and r["cityArea"]["value"] else None
+    city_node = {
+        "qid": city_qid,
+        "label": city_label
+    }
+    if city_area is not None:
+        city_node["area_km2"] = city_area
+    if with_titles:
+        city_node["title"] = _title(r, "city")
+    prov_node["children"].append(city_node)
+
+def _province_titles(with_titles: bool):
+    # (SELECT 变量, 省条目名子句, 省会条目名子句)
+    if not with_titles:
+        return "", "", ""
+    return "?provinceTitle ?provCapitalTitle", _title_clause("province"), _title_clause("provCapital")
+
+def fetch_country_tree(country_qid: str, country_label: str, mode: str = None, with_titles: bool = None):
+    mode = mode or TREE_MODE
+    with_titles = WITH_TITLES if with_titles is None else with_titles
+    if mode == "chunked":
+        return fetch_country_tree_chunked(country_qid, country_label, with_titles=with_titles)
+    prov_vars, prov_title, cap_title = _province_titles(with_titles)
+    city_vars, city_title = ("?cityTitle", _title_clause("city")) if with_titles else ("", "")
     # Main query: fetch province, province area/capital, city, city area
     query = f"""
     SELECT DISTINCT
            ?province ?provinceLabel ?provArea ?provCapital ?provCapitalLabel
-           ?city ?cityLabel ?cityArea
+           ?city ?cityLabel ?cityArea {prov_vars} {city_vars}
     WHERE {{
       ?province wdt:P31/wdt:P279* {ADM1_CLASS} ;
                 wdt:P17 wd:{country_qid} .
@@ -65,88 +209,118 @@ def fetch_country_tree(country_qid: str, country_label: str):
       OPTIONAL {{ ?province wdt:{CAPITAL_PROP} ?provCapital .
                   ?provCapital rdfs:label ?provCapitalLabel .
                   FILTER(LANG(?provCapitalLabel) = "en")
+                  {cap_title}
                 }}
+      {prov_title}
 
       ?city wdt:P31/wdt:P279* {CITY_CLASS} ;
             wdt:P131+ ?province .
       OPTIONAL {{ ?city wdt:{AREA_PROP} ?cityArea . }}
+      {city_title}
 
       SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
     }}
     """
 
-    rows = run_query(query)
+    try:
+        # auto 模式超时不重试，直接改走 chunked
+        rows = run_query(query, strict=mode == "auto", retry_timeouts=mode != "auto")
+    except RuntimeError:
+        # 大国的传递查询容易超时：改为先列省、再逐省查城市
+        print(f"{country_label}: single query failed, falling back to per-province fetching", file=sys.stderr)
+        return fetch_country_tree_chunked(country_qid, country_label, with_titles=with_titles)
     # Build province dict: QID -> node
     provinces: Dict[str, Dict] = {}
     province_city_seen = defaultdict(set)
 
     for r in rows:
-        prov_qid = r["province"]["value"].split("/")[-1]
-        prov_label = r["provinceLabel"]["value"]
-        prov_area = parse_quantity(r["provArea"]["value"]) if "provArea" in r and r["provArea"]["value"] else None
-
-        prov_cap_qid = r["provCapital"]["value"].split("/")[-1] if "provCapital" in r else None
-        prov_cap_label = r["provCapitalLabel"]["value"] if "provCapitalLabel" in r else None
-        prov_capital = {"qid": prov_cap_qid, "label": prov_cap_label} if prov_cap_qid and prov_cap_label else None
-
-        # province node: only set if not exists
-        prov_node = provinces.get(prov_qid)
-        if prov_node is None:
-            prov_node = {
-                "qid": prov_qid,
-                "label": prov_label,
-                "children": []
-            }
-            if prov_area is not None:
-                prov_node["area_km2"] = prov_area
-            prov_node["capital"] = prov_capital if prov_capital else None
-            provinces[prov_qid] = prov_node
-        else:
-            # update area/capital if not yet set
-            if prov_area is not None and "area_km2" not in prov_node:
-                prov_node["area_km2"] = prov_area
-            if prov_capital and not prov_node.get("capital"):
-                prov_node["capital"] = prov_capital
-
-        # City
-        if "city" not in r or not r["city"]["value"]:
-            continue
-        city_qid = r["city"]["value"].split("/")[-1]
-        if city_qid in province_city_seen[prov_qid]:
-            continue
-        province_city_seen[prov_qid].add(city_qid)
-
-        city_label = r["cityLabel"]["value"] if "cityLabel" in r else None
-        city_area = parse_quantity(r["cityArea"]["value"]) if "cityArea" in r and r["cityArea"]["value"] else None
-        city_node = {
-            "qid": city_qid,
-            "label": city_label
-        }
-        if city_area is not None:
-            city_node["area_km2"] = city_area
-        prov_node["children"].append(city_node)
-
-    # 保证每个省都有children字段
-    for prov in provinces.values():
-        if "children" not in prov:
-            prov["children"] = []
-        # capital一定有，没有就写None
-        if "capital" not in prov:
-            prov["capital"] = None
+        prov_node = _merge_province(provinces, r, with_titles)
+        _merge_city(prov_node, r, province_city_seen[prov_node["qid"]], with_titles)
 
     return country_label, {"qid": country_qid, "subdivisions": list(provinces.values())}
 
+def list_provinces(country_qid: str, with_titles: bool = None) -> Dict[str, Dict]:
+    with_titles = WITH_TITLES if with_titles is None else with_titles
+    prov_vars, prov_title, cap_title = _province_titles(with_titles)
+    query = f"""
+    SELECT DISTINCT ?province ?provinceLabel ?provArea ?provCapital ?provCapitalLabel {prov_vars}
+    WHERE {{
+      ?province wdt:P31/wdt:P279* {ADM1_CLASS} ;
+                wdt:P17 wd:{country_qid} .
+      OPTIONAL {{ ?province wdt:{AREA_PROP} ?provArea . }}
+      OPTIONAL {{ ?province wdt:{CAPITAL_PROP} ?provCapital .
+                  ?provCapital rdfs:label ?provCapitalLabel .
+                  FILTER(LANG(?provCapitalLabel) = "en")
+                  {cap_title}
+                }}
+      {prov_title}
+      SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
+    }}
+    """
+    provinces: Dict[str, Dict] = {}
+    # strict：sparql_client 重试用完仍失败就抛出，不能把超时当成"没有省"
+    for r in run_query(query, strict=True):
+        _merge_province(provinces, r, with_titles)
+    return provinces
+
+def fetch_province_cities(prov_qid: str, page: int = None, with_titles: bool = None):
+    """按 STR(?city) 做 keyset 分页，逐页产出城市行；某页查询失败时抛出，不会把城市列表截断后当成完整结果。"""
+    page = page or CITY_PAGE
+    with_titles = WITH_TITLES if with_titles is None else with_titles
+    city_vars, city_title = ("?cityTitle", _title_clause("city")) if with_titles else ("", "")
+    after = ""
+    while True:
+        keyset = f'FILTER(STR(?city) > "{after}")' if after else ""
+        query = f"""
+        SELECT DISTINCT ?city ?cityLabel ?cityArea {city_vars} WHERE {{
+          ?city wdt:P31/wdt:P279* {CITY_CLASS} ;
+                wdt:P131+ wd:{prov_qid} .
+          {keyset}
+          OPTIONAL {{ ?city wdt:{AREA_PROP} ?cityArea . }}
+          {city_title}
+          SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
+        }}
+        ORDER BY STR(?city)
+        LIMIT {page}
+        """
+        rows = run_query(query, strict=True)
+        yield rows
+        if len(rows) < page:
+            return
+        after = rows[-1]["city"]["value"]
+
+def fetch_country_tree_chunked(country_qid: str, country_label: str, workers: int = None,
+                               with_titles: bool = None):
+    workers = workers or PROVINCE_WORKERS
+    with_titles = WITH_TITLES if with_titles is None else with_titles
+    provinces = list_provinces(country_qid, with_titles)
+
+    def fill(prov_node):
+        seen = set()
+        for rows in fetch_province_cities(prov_node["qid"], with_titles=with_titles):
+            for r in rows:
+                _merge_city(prov_node, r, seen, with_titles)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in as_completed([executor.submit(fill, p) for p in provinces.values()]):
+            future.result()
+    # 任何一省失败都会在这里抛出，main() 把整个国家记为失败，而不是写出缺省 / 缺城市的树
+    # 与单条查询一致：没有城市的省不出现在结果里
+    subdivisions = [p for p in provinces.values() if p["children"]]
+    return country_label, {"qid": country_qid, "subdivisions": subdivisions}
+
 def main(src: str, dst: str, max_workers: int = 5):
     data = json.loads(Path(src).read_text(encoding="utf-8"))
     countries = data.get("country", [])
     results = {}
+    m = get_metrics()
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 先查所有国家的capital
-        capitals = {}
-        for c in tqdm(countries, desc="Fetch country capitals"):
-            capitals[c["label"]] = get_country_capital(c["qid"])
-        # 再并发查细分
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, m.phase("trees", workers=max_workers):
+        # 首都批量查询与细分查询并行进行
+        # 国家本身的 enwiki 条目名也在这条首都查询里顺带取回
+        country_titles: Dict[str, Optional[str]] = {}
+        capitals_future = executor.submit(get_country_capitals, [c["qid"] for c in countries],
+                                          country_titles=country_titles)
         future_to_country = {
             executor.submit(fetch_country_tree, c["qid"], c["label"]): c["label"]
             for c in countries
@@ -154,16 +328,25 @@ def main(src: str, dst: str, max_workers: int = 5):
         for i, future in enumerate(tqdm(as_completed(future_to_country), total=len(future_to_country), desc="Countries")):
             try:
                 label, country_data = future.result()
-                country_data["capital"] = capitals[label]
                 results[label] = country_data
+                m.incr("country.done")
                 print(f"[{i+1}/{len(future_to_country)}] {label} done.")
             except Exception as e:
                 label = future_to_country[future]
                 print(f"[{i+1}/{len(future_to_country)}] {label} failed: {e}", file=sys.stderr)
+                m.incr("country.failed")
                 results[label] = {"qid": None, "subdivisions": [], "capital": None}
 
+        capitals = capitals_future.result()
+        for country_data in results.values():
+            if country_data["qid"] is not None:
+                country_data["capital"] = capitals.get(country_data["qid"])
+                if WITH_TITLES and country_data["qid"] in country_titles:
+                    country_data["title"] = country_titles[country_data["qid"]]
+
     Path(dst).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
     print("✓ Saved", dst)
+    print(f"  cache: {get_cache().hits} hits / {get_cache().misses} misses")
 
 if __name__ == "__main__":
     if len(sys.argv) not in (3, 4):
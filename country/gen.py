@@ -1,11 +1,21 @@
 import json
+import os
 import random
+import sys
 import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.metrics import get_metrics
 
 QA_CNT = 100  # 每类题目数量
 N = 5         # 每题问几个（如 5 个省/5 个城市）
+ENTITY_DB = os.environ.get("ENTITY_DB")  # 设置时从 common/entity_store.py 的 SQLite 库按国家按需读取
 
 def load_data(json_path):
+    if ENTITY_DB:
+        from common.entity_store import SubdivisionTree, open_store
+        return SubdivisionTree(open_store(ENTITY_DB), Path(json_path).stem)
     with open(json_path, encoding="utf-8") as f:
         return json.load(f)
 
@@ -136,28 +146,37 @@ def gen_capital_of_n_countries(data, n=3):
     return None
 
 def batch_generate(data, outpath, n=N):
+    m = get_metrics()
     results = []
     print("Generating Q1...")
-    for _ in range(QA_CNT):
-        res = gen_province_question(data, n)
-        if res:
-            results.append(res)
+    with m.phase("q1_province"):
+        for _ in range(QA_CNT):
+            res = gen_province_question(data, n)
+            if res:
+                results.append(res)
+                m.incr("qa")
     print("Generating Q2...")
-    for _ in range(QA_CNT):
-        res = gen_country_city_question(data, n)
-        if res:
-            results.append(res)
+    with m.phase("q2_country_city"):
+        for _ in range(QA_CNT):
+            res = gen_country_city_question(data, n)
+            if res:
+                results.append(res)
+                m.incr("qa")
     print("Generating Q3...")
-    for _ in range(QA_CNT):
-        res = gen_province_city_question(data, n)
-        if res:
-            results.append(res)
+    with m.phase("q3_province_city"):
+        for _ in range(QA_CNT):
+            res = gen_province_city_question(data, n)
+            if res:
+                results.append(res)
+                m.incr("qa")
     print("Generating Q4...")
-    for _ in range(QA_CNT):
-        res = gen_capital_of_n_countries(data, n=3)
-        if res:
-            results.append(res)
-    with open(outpath, "w", encoding="utf-8") as f:
+    with m.phase("q4_capitals"):
+        for _ in range(QA_CNT):
+            res = gen_capital_of_n_countries(data, n=3)
+            if res:
+                results.append(res)
+                m.incr("qa")
+    with open(outpath, "w", encoding="utf-8") as f, m.phase("write"):
         json.dump(results, f, ensure_ascii=False, indent=2)
     print(f"Saved {len(results)} questions to {outpath}")
 
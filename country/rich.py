@@ -1,17 +1,20 @@
 # postprocess_area_enwiki_views_with_tqdm.py
 
 import json
+import os
 import sys
-import time
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from urllib.parse import quote
-from datetime import datetime, timedelta
+from pathlib import Path
 from tqdm import tqdm
-headers = {
-        "User-Agent": "YourAppName/1.0 (your_email@example.com)"
-    }
-WIKIDATA_SPARQL = "https://query.wikidata.org/sparql"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common import pageview_async, pageview_dump, pageview_store
+from common.sparql_client import get_client
+from common.metrics import get_metrics
+
+# 设置后从本地月度 pageview dump 一遍算出 views_12m（含城市），不再逐条请求 REST API
+PV_DUMP_DIR = os.environ.get("PV_DUMP_DIR")
+# 设置后用增量月度访问量存储：只请求缺失的月份，窗口为最近 12 个完整月
+PV_STORE = os.environ.get("PV_STORE")
 
 def filter_area(area):
     if isinstance(area, (int, float)):
@@ -39,15 +42,12 @@ def batch_get_enwiki_titles(qids):
           }}
         }}
         """
-        headers = {'User-Agent': 'enwiki-title-finder/1.0 (OpenAI user script)'}
-        resp = requests.get(WIKIDATA_SPARQL, params={"query": query, "format": "json"}, headers=headers)
-        items = resp.json()["results"]["bindings"]
+        items = get_client().bindings(query, agent="enwiki-title-finder/1.0 (OpenAI user script)")
         for row in items:
             qid = row["qid"]["value"].split("/")[-1]
             title = row.get("title", {}).get("value")
             if title:
                 result[qid] = title.replace(' ', '_')
-        time.sleep(0.5)
     return result
 
 def collect_all_qids(data):
@@ -60,37 +60,40 @@ def collect_all_qids(data):
                 if city.get("qid"): qids.add(city["qid"])
     return list(qids)
 
+def missing_title_qids(data):
+    # 逐个节点看：有 "title" 键（包括查过但没有 enwiki 条目的 null）就不再查，只补缺的
+    qids = set()
+    for country, cdata in data.items():
+        if cdata.get("qid") and "title" not in cdata: qids.add(cdata["qid"])
+        for prov in cdata.get("subdivisions", []):
+            if prov.get("qid") and "title" not in prov: qids.add(prov["qid"])
+            for city in prov.get("children", []):
+                if city.get("qid") and "title" not in city: qids.add(city["qid"])
+    return list(qids)
+
 def assign_titles(data, qid2title):
+    # qid2title 里值为 None 表示查过、没有 enwiki 条目：同样写进去，下次不再重查
     for country, cdata in data.items():
         qid = cdata.get("qid")
-        if qid and qid2title.get(qid):
+        if qid in qid2title and not cdata.get("title"):
             cdata["title"] = qid2title[qid]
         for prov in cdata.get("subdivisions", []):
             qid = prov.get("qid")
-            if qid and qid2title.get(qid):
+            if qid in qid2title and not prov.get("title"):
                 prov["title"] = qid2title[qid]
             for city in prov.get("children", []):
                 qid = city.get("qid")
-                if qid and qid2title.get(qid):
+                if qid in qid2title and not city.get("title"):
                     city["title"] = qid2title[qid]
 
-def get_views_12m(title):
-    now = datetime.utcnow()
-    end = now.strftime('%Y%m%d')
-    start = (now - timedelta(days=365)).strftime('%Y%m%d')
-    url = f"https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/en.wikipedia/all-access/user/{quote(title)}/monthly/{start}/{end}"
-    try:
-        resp = requests.get(url, timeout=10, headers=headers)
-        if resp.status_code == 200:
-            data = resp.json()
-            return sum(item.get("views", 0) for item in data.get("items", []))
-        else:
-            return 0
-    except Exception as e:
-        return 0
+def save(data, output_path):
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"✓ Saved: {output_path}")
 
-def postprocess(input_path, output_path, max_workers=5):
-    with open(input_path, "r", encoding="utf-8") as f:
+def postprocess(input_path, output_path, max_workers=5, pv_dump_dir=PV_DUMP_DIR):
+    m = get_metrics()
+    with open(input_path, "r", encoding="utf-8") as f, m.phase("load"):
         data = json.load(f)
 
     def clean_entity_area(entity):
@@ -101,12 +104,16 @@ def postprocess(input_path, output_path, max_workers=5):
         else:
             entity["area_km2"] = new_area
 
-    # enwiki title
-    qids = collect_all_qids(data)
-    print(f"Total unique QIDs: {len(qids)}")
-    qid2title = batch_get_enwiki_titles(qids)
-    print(f"Entities with enwiki titles: {len(qid2title)}")
-    assign_titles(data, qid2title)
+    # enwiki title（fetch.py WITH_TITLES 抓取时已带上的节点跳过）
+    qids = missing_title_qids(data)
+    if not qids:
+        print("enwiki titles already present, skipping title lookup")
+    else:
+        print(f"QIDs without enwiki title: {len(qids)} / {len(collect_all_qids(data))}")
+        with m.phase("titles", qids=len(qids)):
+            qid2title = batch_get_enwiki_titles(qids)
+        print(f"Entities with enwiki titles: {len(qid2title)}")
+        assign_titles(data, {q: qid2title.get(q) for q in qids})
 
     # pageviews
     query_tasks = []
@@ -122,24 +129,35 @@ def postprocess(input_path, output_path, max_workers=5):
                 query_tasks.append( (prov, title, "views_12m") )
             for city in prov.get("children", []):
                 clean_entity_area(city)
-                # 可加城市pageviews
+                title = city.get("title", None)
+                if title:
+                    query_tasks.append( (city, title, "views_12m") )
 
-    def views_task(args):
-        entity, title, field = args
-        views = get_views_12m(title)
-        entity[field] = views
-        time.sleep(0.22)
-        return title, views
+    m.incr("entities", len(query_tasks))
+    if pv_dump_dir:
+        print("Reading pageview dumps...")
+        with m.phase("pageviews", source="dump"):
+            pageview_dump.fill_views_12m([t[0] for t in query_tasks], pv_dump_dir, workers=max_workers)
+        return save(data, output_path)
 
-    print("Querying pageviews for all entities...")
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        fut2label = {executor.submit(views_task, task): task[1] for task in query_tasks}
-        for _ in tqdm(as_completed(fut2label), total=len(fut2label), desc="pageviews"):
-            pass  # 只显示进度，不输出内容
+    if PV_STORE:
+        store = pageview_store.PageviewStore(agent="user")
+        as_of = pageview_store.last_complete_month()
+        with tqdm(desc="pageviews") as bar, m.phase("pageviews", source="store"):
+            stats = store.refresh([t[1] for t in query_tasks], as_of, init_conc=max_workers, progress=bar)
+        store.save()
+        stats["incomplete"] = store.fill([t[0] for t in query_tasks], as_of)
+        print(f"pageviews: {stats}, as_of {as_of}")
+        if stats["incomplete"]:
+            print(f"⚠️  {stats['incomplete']} titles have an incomplete {pageview_store.WINDOW}-month window; views_12m left unset")
+        return save(data, output_path)
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    print(f"✓ Saved: {output_path}")
+    # asyncio + AIMD 并发：max_workers 作为初始并发，遇到 429/5xx 自动减半
+    print("Querying pageviews for all entities...")
+    with tqdm(total=len(query_tasks), desc="pageviews") as bar, m.phase("pageviews", source="api"):
+        stats = pageview_async.run_fill_views(query_tasks, init_conc=max_workers, progress=bar)
+    print(f"pageviews: {stats}")
+    save(data, output_path)
 
 if __name__ == "__main__":
     if len(sys.argv) not in (3, 4):
@@ -1,38 +1,46 @@
+import importlib.util
 import json
 import math
 import random
+import sys
+from functools import lru_cache
+from pathlib import Path
 
-# === 各类数列生成器 ===
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from common.metrics import get_metrics
+
+# 本目录与标准库 math 同名，不能写成 math.sequences，按仓库根目录下的路径加载，与工作目录无关
+_spec = importlib.util.spec_from_file_location("math_sequences", ROOT / "math" / "sequences.py")
+_sequences = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_sequences)
+SEQUENCES = _sequences.SEQUENCES
+
+# 区间约束：a ∈ [1, max_bound - A_MARGIN]，b - a ∈ [MIN_WIDTH, MAX_WIDTH]，区间左闭右开 [a, b)
+A_MARGIN = 100
+MIN_WIDTH = 10
+MAX_WIDTH = 500
+MAX_BOUND = 10000            # 题目数值上界；素数可到 1e9–1e10（先跑 python sequences.py build <上界> 落盘位图更快）
+MATERIALIZE_MAX = 5_000_000  # 成员数不超过它的数列整条放进内存，否则按随机窗口现取
+WINDOW_TRIES = 200
+
+# === 各类数列生成器（NumPy 引擎见 sequences.py） ===
 def generate_primes(upto):
-    sieve = [True] * (upto + 1)
-    sieve[0:2] = [False, False]
-    for num in range(2, int(upto**0.5) + 1):
-        if sieve[num]:
-            sieve[num*num:upto+1:num] = [False]*len(range(num*num, upto+1, num))
-    return [i for i, val in enumerate(sieve) if val]
+    return SEQUENCES["prime"].upto(upto).tolist()
 
 def generate_squares(upto):
-    return [i*i for i in range(1, int(upto**0.5) + 1)]
+    return SEQUENCES["square"].upto(upto).tolist()
 
 def generate_cubes(upto):
-    return [i**3 for i in range(1, int(upto**(1/3)) + 2) if i**3 <= upto]
+    return SEQUENCES["cube"].upto(upto).tolist()
 
 def generate_fibonacci(upto):
-    fibs = [1, 1]
-    while fibs[-1] + fibs[-2] <= upto:
-        fibs.append(fibs[-1] + fibs[-2])
-    return fibs
+    return SEQUENCES["fibonacci"].upto(upto).tolist()
 
 def generate_triangular(upto):
-    tris = []
-    i = 1
-    while True:
-        t = i * (i + 1) // 2
-        if t > upto:
-            break
-        tris.append(t)
-        i += 1
-    return tris
+    return SEQUENCES["triangular"].upto(upto).tolist()
 
 # === 类型映射 ===
 number_generators = {
@@ -42,42 +50,127 @@ number_generators = {
     "Fibonacci number": generate_fibonacci,
     "triangular number": generate_triangular,
 }
+number_sequences = {
+    "prime number": SEQUENCES["prime"],
+    "square number": SEQUENCES["square"],
+    "cube number": SEQUENCES["cube"],
+    "Fibonacci number": SEQUENCES["fibonacci"],
+    "triangular number": SEQUENCES["triangular"],
+}
 
-# === 双边题目生成函数 ===
-def generate_between_question(number_type, solution_count, max_bound=10000):
-    if number_type not in number_generators:
+# === 数列缓存：每个 (类型, 上界) 只生成一次 ===
+@lru_cache(maxsize=None)
+def get_sequence(number_type, max_bound):
+    if number_type not in number_sequences:
+        raise ValueError(f"Unsupported number type: {number_type}")
+    return number_sequences[number_type].upto(max_bound)
+
+@lru_cache(maxsize=None)
+def is_materialized(number_type, max_bound):
+    if number_type not in number_sequences:
         raise ValueError(f"Unsupported number type: {number_type}")
-    
-    all_numbers = number_generators[number_type](max_bound)
-    
-    for _ in range(1000):
-        a = random.randint(1, max_bound - 100)
-        b = random.randint(a + 10, a + 500)
-        filtered = [x for x in all_numbers if a <= x < b]
-        if len(filtered) == solution_count:
-            question = f"Name a {number_type} between {a} and {b}."
-            return {
-                "question": question,
-                "answers": filtered,
-                "type": number_type,
-                "range": [a, b]
-            }
-    
-    raise ValueError(f"Unable to generate question with {solution_count} solutions for {number_type}")
+    return number_sequences[number_type].count_upto(max_bound) <= MATERIALIZE_MAX
+
+def members_between(seq, a, b):
+    return seq[np.searchsorted(seq, a):np.searchsorted(seq, b)].tolist()
+
+def _window(seq, i, k, max_bound):
+    """恰好包含 seq[i:i+k] 的区间：返回 (a_lo, a_hi, b_lo, b_hi)，已并入宽度约束；不可行返回 None。"""
+    a_lo = int(seq[i - 1]) + 1 if i > 0 else 1
+    a_hi = min(int(seq[i]), max_bound - A_MARGIN)
+    b_lo = int(seq[i + k - 1]) + 1
+    b_hi = min(int(seq[i + k]) if i + k < len(seq) else max_bound + 1, max_bound + 1)  # 上界之外的成员未知
+    a_lo, a_hi = max(a_lo, b_lo - MAX_WIDTH), min(a_hi, b_hi - MIN_WIDTH)
+    if a_lo > a_hi or b_lo > b_hi:
+        return None
+    return a_lo, a_hi, b_lo, b_hi
+
+def _feasible_mask(seq, k, max_bound):
+    """对每个起点 i 向量化地做 _window 的判断。"""
+    n = len(seq)
+    if n < k:
+        return np.zeros(0, dtype=bool)
+    i = np.arange(n - k + 1)
+    a_lo = np.where(i > 0, seq[np.maximum(i - 1, 0)] + 1, 1)
+    a_hi = np.minimum(seq[i], max_bound - A_MARGIN)
+    b_lo = seq[i + k - 1] + 1
+    b_hi = np.minimum(np.where(i + k < n, seq[np.minimum(i + k, n - 1)], max_bound + 1), max_bound + 1)
+    return (np.maximum(a_lo, b_lo - MAX_WIDTH) <= np.minimum(a_hi, b_hi - MIN_WIDTH)) & (b_lo <= b_hi)
+
+@lru_cache(maxsize=None)
+def _feasible_starts(number_type, k, max_bound):
+    return np.flatnonzero(_feasible_mask(get_sequence(number_type, max_bound), k, max_bound))
+
+def _pick_materialized(number_type, k, max_bound):
+    seq = get_sequence(number_type, max_bound)
+    starts = _feasible_starts(number_type, k, max_bound)
+    if not len(starts):
+        return None
+    return seq, int(starts[random.randrange(len(starts))])
+
+def _pick_windowed(number_type, k, max_bound):
+    """
+    大上界：随机取一个锚点，只枚举它附近 3 × MAX_WIDTH 宽的窗口，在窗口里挑起点。
+    窗口两端之外可能还有成员，所以只用两侧邻居都落在窗口内（或窗口已到数列边界）的起点。
+    """
+    engine = number_sequences[number_type]
+    for _ in range(WINDOW_TRIES):
+        x = random.randint(1, max_bound - A_MARGIN)
+        lo, hi = max(1, x - MAX_WIDTH), min(max_bound + 1, x + 2 * MAX_WIDTH)
+        local = engine.between(lo, hi)
+        mask = _feasible_mask(local, k, max_bound)
+        if lo > 1:
+            mask[:1] = False
+        if hi <= max_bound:
+            mask[max(0, len(local) - k):] = False
+        starts = np.flatnonzero(mask)
+        if len(starts):
+            return local, int(starts[random.randrange(len(starts))])
+    return None
+
+# === 双边题目生成函数 ===
+def generate_between_question(number_type, solution_count, max_bound=MAX_BOUND):
+    """
+    直接构造恰好含 solution_count 个成员的区间：随机选连续的 k 个成员，
+    再在它们两侧的空隙里取 a、b。数列能整条放进内存时，只要存在合法区间就不会失败；
+    否则在随机窗口里找，连续 WINDOW_TRIES 个窗口都没有才放弃。
+    """
+    if is_materialized(number_type, max_bound):
+        picked = _pick_materialized(number_type, solution_count, max_bound)
+    else:
+        picked = _pick_windowed(number_type, solution_count, max_bound)
+    if picked is None:
+        raise ValueError(f"Unable to generate question with {solution_count} solutions for {number_type}")
+
+    seq, i = picked
+    a_lo, a_hi, b_lo, b_hi = _window(seq, i, solution_count, max_bound)
+    a = random.randint(a_lo, a_hi)
+    b = random.randint(max(b_lo, a + MIN_WIDTH), min(b_hi, a + MAX_WIDTH))
+    question = f"Name a {number_type} between {a} and {b}."
+    return {
+        "question": question,
+        "answers": members_between(seq, a, b),
+        "type": number_type,
+        "range": [a, b]
+    }
 
 # === 主函数：批量生成 QA 对 ===
 QA_CNT = 20  # 修改这个值以控制生成题目数量
 
 def generate_dataset():
+    m = get_metrics()
     results = []
-    for _ in range(QA_CNT):
-        num_type = random.choice(list(number_generators.keys()))
-        sol_count = random.choice([1, 2, 3, 4, 5])
-        try:
-            qa = generate_between_question(num_type, sol_count)
-            results.append(qa)
-        except ValueError:
-            continue
+    with m.phase("generate", max_bound=MAX_BOUND):
+        for _ in range(QA_CNT):
+            num_type = random.choice(list(number_generators.keys()))
+            sol_count = random.choice([1, 2, 3, 4, 5])
+            try:
+                qa = generate_between_question(num_type, sol_count, MAX_BOUND)
+                results.append(qa)
+                m.incr("qa")
+            except ValueError:
+                m.incr("qa.failed")
+                continue
     return results
 
 # === 主执行 ===
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+sequences.py
+------------
+math/gen.py 用的 NumPy 数列引擎：任意窗口 [lo, hi) 内的成员按需枚举，不必先生成整条数列。
+▸ 素数：只存奇数的分段埃氏筛，每段 SEGMENT 个奇数，内存固定，可筛到 1e9–1e10
+▸ 筛好的位图（每个奇数 1 bit）写成内存映射文件，跨运行复用；窗口查询只解包用到的那几个字节
+▸ 没有位图时按窗口现筛（基素数只需到 √hi）
+▸ 平方数 / 立方数 / 三角数：整数开方求出窗口内的下标区间，一次 arange 算出
+▸ Fibonacci：到 2^62 也只有 ~90 项，预先算好后 searchsorted
+
+环境变量：
+  SEQ_CACHE_DIR   素数位图目录（默认 <repo>/.cache/math）
+
+命令行：
+  python sequences.py build <upto>             预先筛出 ≤ upto 的素数位图
+  python sequences.py count <type> <lo> <hi>   type: prime / square / cube / fibonacci / triangular
+"""
+
+import math, os, re, sys, time
+from pathlib import Path
+
+import numpy as np
+
+CACHE_DIR = Path(os.environ.get("SEQ_CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache" / "math"))
+SEGMENT = 1 << 24     # 每段筛的奇数个数（8 的倍数，保证每段正好落在整字节上）；段内 bool 数组 16MB
+INT = np.int64
+
+def _empty():
+    return np.zeros(0, dtype=INT)
+
+def _icbrt(n):
+    if n <= 0:
+        return 0
+    r = int(round(n ** (1 / 3)))
+    while r ** 3 > n:
+        r -= 1
+    while (r + 1) ** 3 <= n:
+        r += 1
+    return r
+
+def _tri_index(n):
+    """满足 i(i+1)/2 ≤ n 的最大 i。"""
+    return (math.isqrt(8 * n + 1) - 1) // 2 if n > 0 else 0
+
+def small_primes(upto):
+    """≤ upto 的全部素数，一次筛完；只用来取 √hi 以内的基素数。"""
+    if upto < 2:
+        return _empty()
+    sieve = np.ones(upto + 1, dtype=bool)
+    sieve[:2] = False
+    for p in range(2, math.isqrt(upto) + 1):
+        if sieve[p]:
+            sieve[p * p::p] = False
+    return np.flatnonzero(sieve).astype(INT)
+
+def _sieve_odd(j0, j1, base):
+    """奇数 2j+1（j ∈ [j0, j1)）是否为素数。base 是升序的奇基素数，需覆盖 √(2·j1 − 1)。"""
+    flags = np.ones(j1 - j0, dtype=bool)
+    if j0 == 0:
+        flags[0] = False       # 1 不是素数
+    lo, hi = 2 * j0 + 1, 2 * j1 - 1
+    for p in base.tolist():
+        if p * p > hi:
+            break
+        start = max(p * p, -(-lo // p) * p)
+        if start % 2 == 0:
+            start += p
+        # 值上步长 2p（只落在奇数上）= 下标步长 p
+        flags[(start - 1) // 2 - j0::p] = False
+    return flags
+
+class PrimeBitmap:
+    """第 j 位表示 2j+1 是否为素数；文件名里记着覆盖到的上界。"""
+
+    NAME = re.compile(r"primes-odd-(\d+)\.bits$")
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.limit = int(self.NAME.search(self.path.name).group(1))
+        self.bits = np.memmap(self.path, dtype=np.uint8, mode="r")
+
+    @classmethod
+    def build(cls, upto, cache_dir=None, progress=False):
+        n_odd = -(-((upto + 1) // 2) // 8) * 8      # 补齐到整字节，多出来的几位也照样筛
+        limit = 2 * n_odd - 1
+        cache_dir = Path(cache_dir or CACHE_DIR)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        path = cache_dir / f"primes-odd-{limit}.bits"
+        tmp = path.with_name(path.name + ".tmp")
+        base = small_primes(math.isqrt(limit))[1:]
+        mm = np.memmap(tmp, dtype=np.uint8, mode="w+", shape=(n_odd // 8,))
+        t0 = time.monotonic()
+        for j0 in range(0, n_odd, SEGMENT):
+            j1 = min(n_odd, j0 + SEGMENT)
+            mm[j0 // 8:j1 // 8] = np.packbits(_sieve_odd(j0, j1, base))
+            if progress:
+                print(f"\r  sieved {2 * j1 - 1:,} / {limit:,}  ({time.monotonic() - t0:.0f}s)", end="", file=sys.stderr)
+        if progress:
+            print(file=sys.stderr)
+        mm.flush()
+        del mm
+        os.replace(tmp, path)
+        return cls(path)
+
+    @classmethod
+    def find(cls, upto, cache_dir=None):
+        """目录里覆盖 upto 的最小位图；没有返回 None。"""
+        cache_dir = Path(cache_dir or CACHE_DIR)
+        if not cache_dir.is_dir():
+            return None
+        found = [(int(m.group(1)), p) for p in cache_dir.iterdir() if (m := cls.NAME.search(p.name))]
+        found = [x for x in found if x[0] >= upto]
+        return cls(min(found)[1]) if found else None
+
+    def _odd_flags(self, j0, j1):
+        b0, b1 = j0 // 8, -(-j1 // 8)
+        return np.unpackbits(self.bits[b0:b1])[j0 - 8 * b0:j1 - 8 * b0]
+
+    def between(self, lo, hi):
+        j0, j1 = lo // 2, hi // 2
+        odd = 2 * (np.flatnonzero(self._odd_flags(j0, j1)).astype(INT) + j0) + 1
+        return np.concatenate([[2], odd]).astype(INT) if lo <= 2 < hi else odd
+
+    def count(self, lo, hi):
+        j0, j1 = lo // 2, hi // 2
+        return int(self._odd_flags(j0, j1).sum()) + (lo <= 2 < hi)
+
+class Sequence:
+    """按窗口枚举的升序数列（成员 ≥ 1）。"""
+
+    def between(self, lo, hi) -> np.ndarray:
+        raise NotImplementedError
+
+    def upto(self, n) -> np.ndarray:
+        return self.between(1, n + 1)
+
+    def count_upto(self, n) -> int:
+        return len(self.upto(n))
+
+class Primes(Sequence):
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._bitmap = None
+        self._base = _empty()
+        self._base_upto = 0
+
+    def bitmap(self, upto):
+        if self._bitmap is None or self._bitmap.limit < upto:
+            self._bitmap = PrimeBitmap.find(upto, self.cache_dir) or self._bitmap
+        return self._bitmap if self._bitmap is not None and self._bitmap.limit >= upto else None
+
+    def _base_primes(self, upto):
+        if upto > self._base_upto:
+            self._base_upto = max(upto, 2 * self._base_upto)
+            self._base = small_primes(self._base_upto)[1:]
+        return self._base
+
+    def between(self, lo, hi):
+        lo = max(lo, 1)
+        if hi <= lo:
+            return _empty()
+        bm = self.bitmap(hi - 1)
+        if bm is not None:
+            return bm.between(lo, hi)
+        j0, j1 = lo // 2, hi // 2
+        base = self._base_primes(math.isqrt(2 * j1 - 1))
+        parts = [np.flatnonzero(_sieve_odd(s, min(j1, s + SEGMENT), base)).astype(INT) + s
+                 for s in range(j0, j1, SEGMENT)]
+        odd = 2 * np.concatenate(parts or [_empty()]) + 1
+        return np.concatenate([[2], odd]).astype(INT) if lo <= 2 < hi else odd
+
+    def count_upto(self, n):
+        bm = self.bitmap(n)
+        if bm is not None:
+            return bm.count(1, n + 1)
+        # 不现筛：n / (ln n − 1) 足够决定要不要整条物化
+        return int(n / (math.log(n) - 1)) if n > 10 else len(self.upto(n))
+
+class Squares(Sequence):
+    def between(self, lo, hi):
+        r0, r1 = math.isqrt(max(lo, 1) - 1) + 1, math.isqrt(max(hi, 1) - 1)
+        return np.arange(r0, r1 + 1, dtype=INT) ** 2
+
+    def count_upto(self, n):
+        return math.isqrt(max(n, 0))
+
+class Cubes(Sequence):
+    def between(self, lo, hi):
+        r0, r1 = _icbrt(max(lo, 1) - 1) + 1, _icbrt(hi - 1)
+        return np.arange(r0, r1 + 1, dtype=INT) ** 3
+
+    def count_upto(self, n):
+        return _icbrt(n)
+
+class Triangular(Sequence):
+    def between(self, lo, hi):
+        i = np.arange(_tri_index(max(lo, 1) - 1) + 1, _tri_index(hi - 1) + 1, dtype=INT)
+        return i * (i + 1) // 2
+
+    def count_upto(self, n):
+        return _tri_index(n)
+
+class Fibonacci(Sequence):
+    """1, 1, 2, 3, 5, …（保留开头两个 1，与原 generate_fibonacci 一致）。"""
+
+    def __init__(self):
+        fibs = [1, 1]
+        while fibs[-1] + fibs[-2] < 2 ** 62:
+            fibs.append(fibs[-1] + fibs[-2])
+        self.values = np.array(fibs, dtype=INT)
+
+    def between(self, lo, hi):
+        return self.values[np.searchsorted(self.values, lo):np.searchsorted(self.values, max(lo, hi))]
+
+SEQUENCES = {
+    "prime": Primes(),
+    "square": Squares(),
+    "cube": Cubes(),
+    "fibonacci": Fibonacci(),
+    "triangular": Triangular(),
+}
+
+def main(argv):
+    if len(argv) == 2 and argv[0] == "build":
+        upto = int(float(argv[1]))
+        bm = PrimeBitmap.build(upto, progress=True)
+        print(f"✓ {bm.path}  ({bm.bits.nbytes / 2 ** 20:.1f} MiB, π({bm.limit}) = {bm.count(1, bm.limit + 1):,})")
+    elif len(argv) == 4 and argv[0] == "count" and argv[1] in SEQUENCES:
+        lo, hi = int(float(argv[2])), int(float(argv[3]))
+        vals = SEQUENCES[argv[1]].between(lo, hi)
+        print(f"{len(vals):,} {argv[1]} numbers in [{lo}, {hi})" + (f": {vals[:10].tolist()}…" if len(vals) else ""))
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+facet_index.py
+--------------
+人物多维过滤的本地位图索引，代替 WDQS 回答 gen.py 的问题。
+▸ 人物 ID = QID 的数字部分（Q42 → 42），每个取值一个 Roaring 压缩位图：
+    P569=1950 / P570=1998 / P27=Q30 / P1412=Q1860 / P140=Q432 / P106=Q33999 / P101=Q395
+▸ 一道题的答案 = 各条件位图求交，微秒级
+▸ 持久化为单文件：头部 JSON 记录每个位图的偏移，正文 mmap 后按需反序列化；
+  标签表（id 数组 + 偏移数组 + UTF-8 blob）同样直接从 mmap 读
+
+构建来源：
+  python facet_index.py build-dump wd_dump.sqlite people_facets.idx
+      common/dump_ingest.py 产出的中间库，完整索引
+  python facet_index.py build-cache people_facets.idx
+      SPARQL 缓存里 people 命名空间的查询结果；只覆盖已查过的组合，属于部分索引，
+      头部记 "partial": true，gen.py 默认拒绝使用（PEOPLE_FACET_INDEX_PARTIAL=1 时放行）
+查询：
+  python facet_index.py query people_facets.idx P569=1950 P27=Q30 P106=Q33999
+"""
+
+import json, mmap, re, sqlite3, struct, sys
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from pyroaring import BitMap, FrozenBitMap
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.sparql_cache import get_cache
+
+MAGIC = b"PFIX1\n"
+YEAR_PIDS = ("P569", "P570")
+
+def qnum(qid: str) -> int:
+    return int(qid[1:])
+
+def facet_key(pid: str, value) -> str:
+    return f"{pid}={int(value) if pid in YEAR_PIDS else value}"
+
+# ---------- 写 ----------
+def write_index(path, bitmaps: Dict[str, BitMap], labels: Dict[int, str], partial: bool = False):
+    ids = np.array(sorted(labels), dtype=np.uint32)
+    blob = bytearray()
+    offsets = np.zeros(len(ids) + 1, dtype=np.uint64)
+    for i, pid in enumerate(ids):
+        blob += labels[int(pid)].encode("utf-8")
+        offsets[i + 1] = len(blob)
+
+    chunks, keys, pos = [], {}, 0
+    def add(buf):
+        nonlocal pos
+        start = pos
+        chunks.append(buf)
+        pos += len(buf)
+        pad = (-pos) % 8           # 数组按 8 字节对齐，便于 np.frombuffer
+        if pad:
+            chunks.append(b"\0" * pad)
+            pos += pad
+        return [start, len(buf)]
+
+    for key in sorted(bitmaps):
+        bm = bitmaps[key]
+        bm.run_optimize()
+        keys[key] = add(bm.serialize())
+    header = {
+        "keys": keys,
+        "ids": add(ids.tobytes()),
+        "offsets": add(offsets.tobytes()),
+        "blob": add(bytes(blob)),
+        "people": len(ids),
+        "partial": partial,
+    }
+    head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    head += b" " * ((-(len(MAGIC) + 8 + len(head))) % 8)
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(head)))
+        f.write(head)
+        for c in chunks:
+            f.write(c)
+    print(f"✓ {len(keys)} facet bitmaps, {len(ids)} people → {path}" + (" (partial)" if partial else ""))
+
+# ---------- 读 ----------
+class FacetIndex:
+    def __init__(self, path):
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a facet index")
+        (hlen,) = struct.unpack_from("<Q", self._mm, len(MAGIC))
+        self.base = len(MAGIC) + 8 + hlen
+        self.header = json.loads(bytes(self._mm[len(MAGIC) + 8:self.base]))
+        self.keys = self.header["keys"]
+        # 由 SPARQL 缓存构建的索引只含查过的组合，没查过的条件会得到空答案
+        self.partial = self.header.get("partial", False)
+        view = memoryview(self._mm)
+        self._ids = np.frombuffer(self._slice(view, "ids"), dtype=np.uint32)
+        self._offsets = np.frombuffer(self._slice(view, "offsets"), dtype=np.uint64)
+        self._blob = self._slice(view, "blob")
+        self.bitmap = lru_cache(maxsize=4096)(self._bitmap)
+
+    def _slice(self, view, name):
+        off, n = self.header[name]
+        return view[self.base + off:self.base + off + n]
+
+    def _bitmap(self, key) -> FrozenBitMap:
+        if key not in self.keys:
+            return FrozenBitMap()
+        off, n = self.keys[key]
+        return FrozenBitMap.deserialize(self._mm[self.base + off:self.base + off + n])
+
+    def match(self, filters: Dict[str, str]) -> BitMap:
+        maps = sorted((self.bitmap(facet_key(pid, v)) for pid, v in filters.items()), key=len)
+        if not maps:
+            return BitMap()
+        return BitMap.intersection(*maps) if len(maps) > 1 else BitMap(maps[0])
+
+    def count(self, filters: Dict[str, str]) -> int:
+        return len(self.match(filters))
+
+    def label(self, num: int) -> str:
+        i = int(np.searchsorted(self._ids, num))
+        if i < len(self._ids) and self._ids[i] == num:
+            return bytes(self._blob[int(self._offsets[i]):int(self._offsets[i + 1])]).decode("utf-8")
+        return f"Q{num}"
+
+    def answers(self, filters: Dict[str, str]) -> List[Tuple[str, str]]:
+        """与 gen.query_answers 相同的返回格式：[(label, qid), ...]。"""
+        return [(self.label(n), f"Q{n}") for n in self.match(filters)]
+
+# ---------- 构建 ----------
+def build_from_dump(db_path) -> Tuple[Dict[str, BitMap], Dict[int, str]]:
+    conn = sqlite3.connect(str(db_path))
+    bitmaps, labels = {}, {}
+    for qid, label in conn.execute("SELECT qid, label FROM people"):
+        if label:
+            labels[qnum(qid)] = label
+    # 出生 / 去世年份也在 person_facets 里（每个 truthy 日期一行）
+    for qid, pid, value in conn.execute("SELECT qid, pid, value FROM person_facets"):
+        bitmaps.setdefault(facet_key(pid, value), BitMap()).add(qnum(qid))
+    conn.close()
+    return bitmaps, labels
+
+_YEAR_RE = re.compile(r"wdt:(P569|P570) \?date(\d*) \. FILTER\(YEAR\(\?date\2\) = (\?v\d+|\d+)\)")
+_ENT_RE = re.compile(r"wdt:(P\d+) (wd:Q\d+|\?v\d+) \.")
+
+def _query_filters(query: str) -> List[Tuple[str, str]]:
+    # 解析 gen.build_query / build_batch_query 生成的查询，返回 [(pid, 值或 ?vN), ...]
+    out = [(pid, val) for pid, _, val in _YEAR_RE.findall(query)]
+    out += [(pid, val[3:] if val.startswith("wd:") else val) for pid, val in _ENT_RE.findall(query)
+            if not (pid == "P31" and val == "wd:Q5")]
+    return out
+
+def build_from_cache(cache=None, namespace="people") -> Tuple[Dict[str, BitMap], Dict[int, str]]:
+    cache = cache or get_cache()
+    bitmaps, labels = {}, {}
+    for query, bindings in cache.iter_entries(namespace):
+        filters = _query_filters(query)
+        if not filters:
+            continue
+        for b in bindings:
+            if "person" not in b:
+                continue
+            n = qnum(b["person"]["value"].split("/")[-1])
+            if "personLabel" in b:
+                labels[n] = b["personLabel"]["value"]
+            for pid, val in filters:
+                if val.startswith("?"):
+                    bound = b.get(val[1:], {}).get("value")
+                    if bound is None:
+                        continue
+                    val = bound.split("/")[-1]
+                bitmaps.setdefault(facet_key(pid, val), BitMap()).add(n)
+    return bitmaps, labels
+
+def _parse_filters(args: Iterable[str]) -> Dict[str, str]:
+    return dict(a.split("=", 1) for a in args)
+
+def main(argv):
+    if len(argv) >= 3 and argv[0] == "build-dump":
+        write_index(argv[2], *build_from_dump(argv[1]))
+    elif len(argv) == 2 and argv[0] == "build-cache":
+        write_index(argv[1], *build_from_cache(), partial=True)
+    elif len(argv) >= 3 and argv[0] == "query":
+        idx = FacetIndex(argv[1])
+        if idx.partial:
+            print("⚠️  partial index built from the SPARQL cache; uncached filters answer empty", file=sys.stderr)
+        ans = idx.answers(_parse_filters(argv[2:]))
+        print(json.dumps({"answer_count": len(ans), "answers": ans[:50]}, ensure_ascii=False, indent=2))
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
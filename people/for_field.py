@@ -8,19 +8,20 @@ fetch_field_qid.py
 ▸ 保存为 dict 格式：{label: qid}
 """
 
-from SPARQLWrapper import SPARQLWrapper, JSON, POST
-import json
+import json, sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.sparql_cache import get_cache
+from common.sparql_client import get_client
 
 UA = "PopPop/c4freq 1.2 (email@example.com)"
 OUT_FILE = "field_qid.json"
-WDQS = "https://query.wikidata.org/sparql"
 
 def run(query: str):
-    s = SPARQLWrapper(WDQS, agent=UA)
-    s.setMethod(POST)
-    s.setQuery(query)
-    s.setReturnFormat(JSON)
-    return s.query().convert()["results"]["bindings"]
+    def live():
+        return get_client().bindings(query, agent=UA)
+    return get_cache().fetch(query, live, namespace="people")
 
 def fetch_field_entities():
     query = """
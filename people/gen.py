@@ -8,20 +8,53 @@ generate_qa.py
 """
 
 QA_CNT = 10
+MODE = "batch"    # "serial": 逐条查询；"batch": VALUES 合并查询；"async": 并发流水线
+BATCH_SIZE = 50   # batch 模式下每条 VALUES 查询合并的问题数
+CONCURRENCY = 8   # async 模式下同时在途的查询数
+MAX_RPS = 5.0     # async 模式下全局每秒最多发起的 WDQS 查询数（设置到 common.sparql_client 的限速器）
+ORDERED = True    # async 模式下是否按生成顺序写出
 
-import json, random
+import asyncio, hashlib, json, math, os, random, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
 from tqdm import tqdm
-from SPARQLWrapper import SPARQLWrapper, JSON
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.sparql_cache import get_cache
+from common.sparql_client import get_client
+from common.metrics import get_metrics
+from common.dump_ingest import open_db, people_answers
 
 # 加载配置文件
 def load_json(path):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-# SPARQL 设置
-WDQS = "https://query.wikidata.org/sparql"
-sparql = SPARQLWrapper(WDQS, agent="PopPop/qa-gen 1.0")
-sparql.setReturnFormat(JSON)
+# ENTITY_DB 指向 common/entity_store.py 的 SQLite 库时，热度表从库里按排名读取
+ENTITY_DB = os.environ.get("ENTITY_DB")
+
+def load_popularity(fname, inner_key, limit=None):
+    if ENTITY_DB:
+        from common.entity_store import open_store, popularity
+        return popularity(open_store(ENTITY_DB), Path(fname).stem, limit)
+    items = load_json(fname)[inner_key]
+    return items[:limit] if limit else items
+
+# SPARQL 设置（共用 common.sparql_client 的连接池与全局限速）
+UA = "PopPop/qa-gen 1.0"
+
+def run_sparql(query, retry_timeouts=True):
+    return get_client().bindings(query, agent=UA, retry_timeouts=retry_timeouts)
+
+# 离线模式：WD_DUMP_DB 指向 common/dump_ingest.py 生成的中间库时不访问 WDQS
+DUMP_DB = os.environ.get("WD_DUMP_DB")
+_dump_conn = None
+# 位图索引模式：PEOPLE_FACET_INDEX 指向 facet_index.py 生成的索引文件时优先使用
+FACET_INDEX = os.environ.get("PEOPLE_FACET_INDEX")
+# build-cache 生成的部分索引会把没查过的组合答成空，默认拒绝；设为 1 时放行并警告
+FACET_INDEX_PARTIAL = os.environ.get("PEOPLE_FACET_INDEX_PARTIAL") == "1"
+_facet_index = None
 
 # pam1: 年份范围
 YEAR_RANGE = list(range(1940, 2001))
@@ -34,6 +67,11 @@ PAM2_SOURCES = {
     "P140": ("religion_popularity.json", "who follow {label}", "religion")
 }
 
+# pam2 采样：每个属性一张 Vose 别名表（缓存在热度文件旁的 *.alias.npz），O(1) 抽样
+PAM2_TOP = None          # 只用前 N 热门；None 表示完整分布
+PAM2_SCALE = "linear"    # "linear": 权重 = views_12m；"log": 权重 = log1p(views_12m)
+PAM2_TEMPERATURE = 1.0   # 权重再取 w ** (1 / T)：T > 1 拉平分布，T < 1 更偏向头部
+
 # pam3 文件
 OCCUPATION_FILE = "occupation_qid.json"
 FIELD_FILE = "field_qid.json"
@@ -52,87 +90,305 @@ def build_query(filters):
     SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
     }}"""
 
-# 查询答案
+def get_facet_index():
+    global _facet_index
+    if _facet_index is None:
+        from people.facet_index import FacetIndex
+        index = FacetIndex(FACET_INDEX)
+        if index.partial:
+            if not FACET_INDEX_PARTIAL:
+                raise ValueError(f"{FACET_INDEX} is a partial index built from the SPARQL cache; "
+                                 "rebuild it with build-dump or set PEOPLE_FACET_INDEX_PARTIAL=1")
+            print(f"⚠️  {FACET_INDEX} is a partial index: filters never queried before answer empty")
+        _facet_index = index
+    return _facet_index
+
+# 查询答案；三种后端失败时都返回 []（计入 qa.errors），调用方不必各自兜底
+# 部分索引被拒绝时直接抛出，不算作单题失败
 def query_answers(filters):
-    query = build_query(filters)
-    sparql.setQuery(query)
+    global _dump_conn
+    index = get_facet_index() if FACET_INDEX else None
     try:
-        results = sparql.query().convert()
-        bindings = results["results"]["bindings"]
-        return [
-            (
-                b["personLabel"]["value"] if "personLabel" in b else b["person"]["value"].split("/")[-1],
-                b["person"]["value"].split("/")[-1]
-            )
-            for b in bindings
-        ]
+        if index is not None:
+            return index.answers(filters)
+        if DUMP_DB:
+            if _dump_conn is None:
+                _dump_conn = open_db(DUMP_DB)
+            return people_answers(_dump_conn, filters)
+        query = build_query(filters)
+        bindings = get_cache().fetch(query, lambda: run_sparql(query), namespace="people")
+        return _to_answers(bindings)
     except Exception as e:
+        get_metrics().incr("qa.errors")
         return []
 
-# 加权采样（从访问量列表中抽一个）
-def weighted_choice(entries):
-    total = sum(e["views_12m"] for e in entries)
-    r = random.uniform(0, total)
-    upto = 0
-    for e in entries:
-        upto += e["views_12m"]
-        if upto >= r:
-            return e
-    return entries[-1]
+def _to_answers(bindings):
+    return [
+        (
+            b["personLabel"]["value"] if "personLabel" in b else b["person"]["value"].split("/")[-1],
+            b["person"]["value"].split("/")[-1]
+        )
+        for b in bindings
+    ]
+
+# 同一组属性（如 P569+P27+P106）的多个问题合成一条 VALUES 查询
+def build_batch_query(pids, combos):
+    vars_, parts = [], ["?person wdt:P31 wd:Q5 ."]
+    for i, pid in enumerate(pids):
+        vars_.append(f"?v{i}")
+        if pid in ["P569", "P570"]:
+            parts.append(f"?person wdt:{pid} ?date{i} . FILTER(YEAR(?date{i}) = ?v{i})")
+        else:
+            parts.append(f"?person wdt:{pid} ?v{i} .")
+    rows = " ".join(
+        "(" + " ".join(str(int(v)) if pid in ["P569", "P570"] else f"wd:{v}" for pid, v in zip(pids, combo)) + ")"
+        for combo in combos
+    )
+    return f"""
+    SELECT ?person ?personLabel {' '.join(vars_)} WHERE {{
+    VALUES ({' '.join(vars_)}) {{ {rows} }}
+    {' '.join(parts)}
+    SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
+    }}"""
+
+def _run_batch(pids, combos):
+    """返回 {combo: answers}；查询失败（多为超时）时二分后重试，直到单条退回 query_answers。"""
+    if len(combos) == 1:
+        return {combos[0]: query_answers(dict(zip(pids, combos[0])))}
+    query = build_batch_query(pids, combos)
+    try:
+        # 超时不重试：二分本身就是应对，单条时 query_answers 再走完整重试
+        bindings = get_cache().fetch(query, lambda: run_sparql(query, retry_timeouts=False), namespace="people")
+    except Exception:
+        mid = len(combos) // 2
+        return {**_run_batch(pids, combos[:mid]), **_run_batch(pids, combos[mid:])}
+    out = {c: [] for c in combos}
+    for b in bindings:
+        key = tuple(
+            b[f"v{i}"]["value"] if pid in ["P569", "P570"] else b[f"v{i}"]["value"].split("/")[-1]
+            for i, pid in enumerate(pids)
+        )
+        if key in out:
+            out[key].extend(_to_answers([b]))
+    return out
+
+def query_answers_batch(filters_list, batch_size=None):
+    """与逐条 query_answers 结果相同，但把共享属性组合的问题按 batch_size 合并查询。"""
+    batch_size = batch_size or BATCH_SIZE
+    if FACET_INDEX or DUMP_DB:
+        return [query_answers(f) for f in filters_list]
+    groups = {}
+    for f in filters_list:
+        groups.setdefault(tuple(f.keys()), []).append(tuple(f.values()))
+    resolved = {}
+    for pids, combos in groups.items():
+        combos = list(dict.fromkeys(combos))
+        for i in tqdm(range(0, len(combos), batch_size), desc="/".join(pids)):
+            for combo, answers in _run_batch(pids, combos[i:i + batch_size]).items():
+                resolved[pids, combo] = answers
+    return [resolved[tuple(f.keys()), tuple(f.values())] for f in filters_list]
+
+# 加权采样：Vose 别名法，O(n) 建表后每次抽样 O(1)
+class AliasTable:
+    def __init__(self, prob, alias):
+        self.prob, self.alias = list(prob), list(alias)
+        self.n = len(self.prob)
+
+    @classmethod
+    def build(cls, weights):
+        n, total = len(weights), sum(weights)
+        if not n or total <= 0:
+            raise ValueError("alias table needs positive weights")
+        scaled = [w * n / total for w in weights]
+        prob, alias = [1.0] * n, list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] += scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 剩下的只差浮点误差，概率按 1 处理
+        return cls(prob, alias)
+
+    def draw(self, rng=random):
+        i = int(rng.random() * self.n)
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+def pam2_weights(entries, scale=None, temperature=None):
+    scale = scale or PAM2_SCALE
+    temperature = temperature or PAM2_TEMPERATURE
+    views = [float(e.get("views_12m") or 0) for e in entries]
+    weights = [math.log1p(v) for v in views] if scale == "log" else views
+    return weights if temperature == 1.0 else [w ** (1.0 / temperature) for w in weights]
+
+def load_alias_table(fname, entries, scale=None, temperature=None):
+    """按热度文件建别名表；内容与缩放参数都没变时直接读 <fname>.alias.npz。"""
+    scale = scale or PAM2_SCALE
+    temperature = temperature or PAM2_TEMPERATURE
+    key = hashlib.sha1(json.dumps(
+        [scale, temperature, [(e["qid"], e.get("views_12m")) for e in entries]]).encode()).hexdigest()
+    path = Path(fname).with_suffix(".alias.npz")
+    if path.exists():
+        try:
+            with np.load(path) as z:
+                if str(z["key"]) == key:
+                    return AliasTable(z["prob"].tolist(), z["alias"].tolist())
+        except (OSError, KeyError, ValueError):
+            pass
+    table = AliasTable.build(pam2_weights(entries, scale, temperature))
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp, "wb") as f:
+            np.savez(f, key=np.array(key), prob=np.array(table.prob), alias=np.array(table.alias, dtype=np.int32))
+        os.replace(tmp, path)
+    except OSError:
+        pass    # 目录不可写时只是不缓存
+    return table
+
+# 采样一道题：返回 (问题文本, filters)
+def sample_question(pam2_data, occ, pam3_pool):
+    filters = {}
+    desc_parts = []
+
+    # pam1
+    year = random.choice(YEAR_RANGE)
+    pid1 = random.choice(["P569", "P570"])
+    filters[pid1] = str(year)
+    desc_parts.append(("born in" if pid1 == "P569" else "died in") + f" {year}")
+
+    # pam2
+    pid2 = random.choice(list(PAM2_SOURCES.keys()))
+    _, template, _ = PAM2_SOURCES[pid2]
+    entries, table = pam2_data[pid2]
+    entry = entries[table.draw()]
+    filters[pid2] = entry["qid"]
+    desc_parts.append(template.format(label=entry["label"]))
+
+    # pam3
+    label3, qid3 = random.choice(pam3_pool)
+    is_occ = label3 in occ
+    pid3 = "P106" if is_occ else "P101"
+    filters[pid3] = qid3
+    desc_parts.append(f"who are {label3}" if is_occ else f"who work in {label3}")
+
+    return "Which people " + ", ".join(desc_parts) + "?", filters
+
+# ---------- async 流水线 ----------
+def _pct(sorted_vals, q):
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))] if sorted_vals else 0.0
+
+async def run_pipeline(questions, fout, concurrency=CONCURRENCY, rps=MAX_RPS, ordered=ORDERED):
+    """
+    questions: [(问题, filters), ...]。最多 concurrency 个查询在途，WDQS 请求全局不超过 rps 次/秒；
+    写出的记录与串行模式完全一致，ordered=True 时顺序也一致。
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    window = asyncio.Semaphore(concurrency)
+    if rps:
+        get_client().configure(rps=rps)
+    results = asyncio.Queue()
+    latencies = []
+    t_start = time.monotonic()
+
+    async def worker(i, filters):
+        answers = []
+        try:
+            t0 = time.monotonic()
+            answers = await asyncio.to_thread(query_answers, filters)
+            latencies.append(time.monotonic() - t0)
+            get_metrics().observe("qa.latency_s", latencies[-1])
+        except Exception:
+            get_metrics().incr("qa.errors")
+        finally:
+            # 无论成败都要交出第 i 条，否则写出端会一直等它
+            await results.put((i, answers))
+            window.release()
+
+    # 事件循环只弱引用 task：自己持有在途的 worker，完成后移除，避免中途被回收、写出端永远等不到
+    tasks = set()
+
+    async def producer():
+        for i, (_, filters) in enumerate(questions):
+            await window.acquire()
+            task = asyncio.create_task(worker(i, filters))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    def write(i, answers):
+        question, filters = questions[i]
+        get_metrics().incr("qa")
+        fout.write(json.dumps({
+            "question": question,
+            "filters": filters,
+            "answers": answers,
+            "answer_count": len(answers)
+        }, ensure_ascii=False) + "\n")
+
+    prod = asyncio.create_task(producer())
+    pending, next_i = {}, 0
+    with tqdm(total=len(questions), desc="Generating QA") as pbar:
+        for done in range(len(questions)):
+            i, answers = await results.get()
+            if ordered:
+                pending[i] = answers
+                while next_i in pending:
+                    write(next_i, pending.pop(next_i))
+                    next_i += 1
+            else:
+                write(i, answers)
+            pbar.update(1)
+            if done % 10 == 0 or done == len(questions) - 1:
+                lat = sorted(latencies)
+                pbar.set_postfix(qps=f"{(done + 1) / (time.monotonic() - t_start):.2f}",
+                                 p50=f"{_pct(lat, 0.5):.2f}s", p95=f"{_pct(lat, 0.95):.2f}s")
+    await prod
 
 # 主程序
 def main():
     # random.seed(42)
+    m = get_metrics()
 
-    # 加载 pam2 权重表（只取前10）
-    pam2_data = {}
-    for pid, (fname, _, inner_key) in PAM2_SOURCES.items():
-        pam2_data[pid] = load_json(fname)[inner_key][:10]  # 限定前10热门
+    # 加载 pam2 权重表并建别名表（默认完整分布，PAM2_TOP 可只取前 N 热门）
+    with m.phase("load"):
+        pam2_data = {}
+        for pid, (fname, _, inner_key) in PAM2_SOURCES.items():
+            entries = load_popularity(fname, inner_key, PAM2_TOP)
+            pam2_data[pid] = (entries, load_alias_table(fname, entries))
 
-    # 加载 pam3 候选
-    occ = load_json(OCCUPATION_FILE)
-    # fld = load_json(FIELD_FILE)
-    pam3_pool = list(occ.items()) 
-    # + list(fld.items())
+        # 加载 pam3 候选
+        occ = load_json(OCCUPATION_FILE)
+        # fld = load_json(FIELD_FILE)
+        pam3_pool = list(occ.items()) 
+        # + list(fld.items())
+
+        # 位图索引在这里先打开：部分索引被拒绝时在写输出之前就报错，而不是在 async 工作线程里被吞掉
+        if FACET_INDEX:
+            get_facet_index()
 
     # 生成 QA
-    with open("generated_qa.jsonl", "w", encoding="utf-8") as fout:
-        for _ in tqdm(range(QA_CNT), desc="Generating QA"):
-            filters = {}
-            desc_parts = []
-
-            # pam1
-            year = random.choice(YEAR_RANGE)
-            pid1 = random.choice(["P569", "P570"])
-            filters[pid1] = str(year)
-            desc_parts.append(("born in" if pid1 == "P569" else "died in") + f" {year}")
-
-            # pam2
-            pid2 = random.choice(list(PAM2_SOURCES.keys()))
-            _, template, _ = PAM2_SOURCES[pid2]
-            entry = weighted_choice(pam2_data[pid2])
-            filters[pid2] = entry["qid"]
-            desc_parts.append(template.format(label=entry["label"]))
-
-            # pam3
-            label3, qid3 = random.choice(pam3_pool)
-            is_occ = label3 in occ
-            pid3 = "P106" if is_occ else "P101"
-            filters[pid3] = qid3
-            desc_parts.append(f"who are {label3}" if is_occ else f"who work in {label3}")
-
-            # 问题 & 查询
-            question = "Which people " + ", ".join(desc_parts) + "?"
-            answers = query_answers(filters)
-
-            fout.write(json.dumps({
-                "question": question,
-                "filters": filters,
-                "answers": answers,
-                "answer_count": len(answers)
-            }, ensure_ascii=False) + "\n")
+    with m.phase("sample"):
+        questions = [sample_question(pam2_data, occ, pam3_pool) for _ in range(QA_CNT)]
+    with open("generated_qa.jsonl", "w", encoding="utf-8") as fout, m.phase("answers", mode=MODE):
+        if MODE == "async":
+            asyncio.run(run_pipeline(questions, fout, CONCURRENCY, MAX_RPS, ORDERED))
+        else:
+            if MODE == "batch":
+                all_answers = query_answers_batch([f for _, f in questions])
+            else:
+                all_answers = (query_answers(f) for _, f in tqdm(questions, desc="Generating QA"))
+            for (question, filters), answers in zip(questions, all_answers):
+                m.incr("qa")
+                fout.write(json.dumps({
+                    "question": question,
+                    "filters": filters,
+                    "answers": answers,
+                    "answer_count": len(answers)
+                }, ensure_ascii=False) + "\n")
 
     print("✓ QA 生成完成，写入 generated_qa.jsonl")
+    print(f"  cache: {get_cache().hits} hits / {get_cache().misses} misses")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,86 @@
+# test_award_sampling.py
+# award/gen.py 的采样部分：AwardWindows 前缀和、全窗口枚举 + exhaustive 抽样、FenwickSampler + stratified 抽样。
+
+import random, sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from award import gen
+from award.gen import AwardWindows, FenwickSampler, enumerate_windows, sample_exhaustive, sample_stratified
+
+def _years(rng, n_years=30):
+    years = {}
+    for y in sorted(rng.sample(range(1900, 2000), n_years)):
+        years[str(y)] = [[f"P{y}_{k}", f"Q{y}{k}", "Q5" if rng.random() < 0.7 else "Q43229"]
+                         for k in range(rng.randint(1, 3))]
+    return years
+
+def _pool(rng, n=12):
+    index, pool = {}, []
+    for i in range(n):
+        label = f"Award {i}"
+        index[label] = AwardWindows(_years(rng, rng.randint(5, 30)))
+        pool.append((label, f"Q{1000 + i}", i % 3 == 0))
+    return pool, index
+
+def test_award_windows_match_brute_force():
+    rng = random.Random(1)
+    years = _years(rng)
+    aw = AwardWindows(years)
+    for _ in range(500):
+        start = rng.randint(1890, 2010)
+        end = start + rng.randint(0, 20)
+        inside = [e for y, es in years.items() if start <= int(y) <= end for e in es]
+        assert aw.stats(start, end) == (len(inside), sum(1 for e in inside if gen.is_nonhuman(e)),
+                                        sum(1 for y in years if start <= int(y) <= end))
+        assert aw.answers(start, end) == inside
+
+def test_enumerate_windows_matches_rejection_rules():
+    pool, index = _pool(random.Random(2))
+    win = enumerate_windows(pool, index)
+    got = set(zip(win["award"].tolist(), win["start"].tolist(), win["end"].tolist()))
+    want = set()
+    for i, (label, _, _) in enumerate(pool):
+        aw = index[label]
+        for span in range(gen.SPAN_RANGE[0], gen.SPAN_RANGE[1] + 1):
+            if len(aw.year_keys) <= span:
+                continue
+            for start in aw.year_keys[:-(span - 1)]:
+                if aw.stats(int(start), int(start) + span)[0] >= gen.MIN_ANSWERS:
+                    want.add((i, int(start), int(start) + span))
+    assert got == want
+
+def test_sample_exhaustive_draws_distinct_windows(monkeypatch):
+    pool, index = _pool(random.Random(3))
+    monkeypatch.setattr(gen, "QA_CNT", 50)
+    items = sample_exhaustive(pool, index, np.random.default_rng(0))
+    keys = [(it["meta"]["award"], tuple(it["meta"]["year_range"])) for it in items]
+    assert len(keys) == 50 and len(set(keys)) == 50
+
+@pytest.mark.parametrize("u", [None, 0.0, 1 - 1e-16])
+def test_fenwick_draws_every_item_once(u):
+    rng = random.Random(4)
+    for _ in range(300):
+        weights = [rng.choice([0.0, rng.random(), 1.0 / rng.randint(1, 50)]) for _ in range(rng.randint(1, 40))]
+        sampler = FenwickSampler(weights)
+        drawn = [sampler.draw(rng.random() if u is None else u) for _ in range(sampler.left)]
+        assert sorted(drawn) == [i for i, w in enumerate(weights) if w > 0]
+        with pytest.raises(IndexError):
+            sampler.draw(0.5)
+
+def test_sample_stratified_meets_targets(monkeypatch):
+    pool, index = _pool(random.Random(5), n=30)
+    monkeypatch.setattr(gen, "DIFFICULTY_TARGET", {"easy": 10, "medium": 10, "hard": 10})
+    items = sample_stratified(pool, index, np.random.default_rng(0))
+    keys = [(it["meta"]["award"], tuple(it["meta"]["year_range"])) for it in items]
+    assert len(set(keys)) == len(keys)
+    supply = {name: 0 for name, _, _ in gen.DIFFICULTY_BUCKETS}
+    win = enumerate_windows(pool, index)
+    for d in win["difficulty"]:
+        supply[gen.bucket_of(d)] += 1
+    for name, _, _ in gen.DIFFICULTY_BUCKETS:
+        got = sum(1 for it in items if gen.bucket_of(it["difficulty"]) == name)
+        assert got == min(10, supply[name])
@@ -0,0 +1,72 @@
+# test_dump_ingest.py
+# 用 tests/fixtures 下的迷你 dump 跑一遍 common/dump_ingest.py：奖项事实、行政区划树、人物事实表。
+#
+# wd_mini.json.{bz2,gz} 是同一份 11 个实体的 dump：
+#   - Q100 Big Award --P527--> Q101（Q101 没有自己的 P361/P527，只能靠补标签遍拿到标签）
+#   - Q102 --P361--> Q100；Bob (Q2) 获 Q102，且 Bob 那一行约 300 KB，跨好几个 64 KiB 的 bz2 流
+#   - Alice (Q1) 有两个出生日期 1950 / 1951
+#   - Q30 → 首府 Q61（只被 P36 引用），省 Q99 Ohio → 城市 Q16567 Columbus
+# bz2 是多流文件，chunk_bytes=1 时每个流一个区间；gz 走顺序解压路径。
+
+import json, sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.dump_ingest import export_awards, export_subdivisions, ingest, people_answers, split_ranges
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+@pytest.fixture(params=["wd_mini.json.bz2", "wd_mini.json.gz"])
+def conn(request, tmp_path):
+    conn = ingest(str(FIXTURES / request.param), tmp_path / "wd.sqlite", workers=2, chunk_bytes=1)
+    yield conn
+    conn.close()
+
+def test_split_ranges_cuts_every_bz2_stream():
+    codec, ranges = split_ranges(str(FIXTURES / "wd_mini.json.bz2"), chunk_bytes=1)
+    assert codec == "bz2" and len(ranges) == 5
+    assert split_ranges(str(FIXTURES / "wd_mini.json.gz"))[1] is None
+
+def test_award_facts(conn, tmp_path):
+    award_file = tmp_path / "award_popularity.json"
+    award_file.write_text(json.dumps({"award": [{"qid": "Q100", "label": "Big Award", "views_12m": 1}]}))
+    export_awards(conn, award_file, tmp_path)
+    facts = json.loads((tmp_path / "structured_award_facts.json").read_text())
+    mapping = json.loads((tmp_path / "award_sub_mapping.json").read_text())
+
+    # 只经 P527 引用的子奖项按标签（而不是 QID）记
+    assert list(facts) == ["Big Award", "Big Award for Fiction", "Big Award for Poetry"]
+    assert mapping == {"Q100": ["Q100", "Q101", "Q102"]}
+    assert facts["Big Award"] == {"qid": "Q100", "parent_qid": "Q100", "years": {}}
+    assert facts["Big Award for Fiction"]["years"] == {"1990": [["Alice", "Q1", "Q5"]]}
+    # 跨区间的长行没有丢
+    assert facts["Big Award for Poetry"]["years"] == {"1991": [["Bob", "Q2", "Q5"]]}
+
+def test_subdivision_tree(conn, tmp_path):
+    src, dst = tmp_path / "country_popularity.json", tmp_path / "subdivisions_tree.json"
+    src.write_text(json.dumps({"country": [{"qid": "Q30", "label": "United States"}]}))
+    export_subdivisions(conn, src, dst)
+    assert json.loads(dst.read_text()) == {
+        "United States": {
+            "qid": "Q30",
+            "subdivisions": [{
+                "qid": "Q99",
+                "label": "Ohio",
+                "children": [{"qid": "Q16567", "label": "Columbus"}],
+                "area_km2": 116096.0,
+                "capital": {"qid": "Q16567", "label": "Columbus"},
+            }],
+            "capital": {"qid": "Q61", "label": "Washington, D.C."},
+        }
+    }
+
+def test_people_tables(conn):
+    ask = lambda **f: sorted(people_answers(conn, f))
+    # 每个 truthy 出生日期都能匹配，与 wdt:P569 一致
+    assert ask(P569="1950") == [("Alice", "Q1"), ("Bob", "Q2")]
+    assert ask(P569="1951") == [("Alice", "Q1")]
+    assert ask(P570="2000", P27="Q30") == [("Alice", "Q1")]
+    assert ask(P569="1950", P106="Q36180") == [("Bob", "Q2")]
+    assert ask(P569="1952") == []
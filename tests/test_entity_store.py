@@ -0,0 +1,48 @@
+# test_entity_store.py
+# common/entity_store.py：导入再导出与原 JSON 逐字节一致；整体读取与懒加载 Mapping 结果相同。
+
+import json, sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.entity_store import AwardFacts, SubdivisionTree, award_facts, export_json, import_json, open_store
+
+FACTS = {
+    "Big Award": {"qid": "Q100", "parent_qid": "Q100", "years": {}},
+    "Big Award for Poetry": {"qid": "Q102", "parent_qid": "Q100",
+                             "years": {"1991": [["Bob", "Q2", "Q5"]], "1990": [["Alice", "Q1", "Q5"]]}},
+}
+TREE = {
+    "United States": {
+        "qid": "Q30",
+        "subdivisions": [
+            {"qid": "Q99", "label": "Ohio", "children": [{"qid": "Q16567", "label": "Columbus"},
+                                                         {"qid": "Q16568", "label": "Akron"}]},
+            {"qid": "Q98", "label": "Maine", "children": []},
+        ],
+        "capital": {"qid": "Q61", "label": "Washington, D.C."},
+    },
+    "Monaco": {"qid": "Q235", "subdivisions": []},
+}
+
+def _roundtrip(tmp_path, name, data):
+    src, dst = tmp_path / f"{name}.json", tmp_path / f"{name}.out.json"
+    src.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    conn = open_store(tmp_path / "entities.sqlite")
+    import_json(conn, src)
+    export_json(conn, name, dst)
+    assert dst.read_bytes() == src.read_bytes()
+    return conn
+
+def test_award_facts(tmp_path):
+    conn = _roundtrip(tmp_path, "structured_award_facts", FACTS)
+    assert award_facts(conn) == FACTS
+    lazy = AwardFacts(conn)
+    assert "Big Award" in lazy and "Nope" not in lazy
+    assert dict(lazy) == FACTS
+
+def test_subdivision_tree(tmp_path):
+    conn = _roundtrip(tmp_path, "subdivisions_tree", TREE)
+    tree = SubdivisionTree(conn)
+    assert list(tree) == ["United States", "Monaco"]
+    assert tree["United States"] == TREE["United States"]
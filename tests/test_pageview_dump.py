@@ -0,0 +1,15 @@
+# test_pageview_dump.py
+# common/pageview_dump.py：同一个月既有月度文件又有小时级文件时只用月度文件。
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.pageview_dump import list_dump_files, scan_dumps
+
+def test_monthly_file_wins_over_hourly(tmp_path):
+    (tmp_path / "pageviews-202404-user").write_text("en.wikipedia Foo 1 desktop 100 A100\n")
+    (tmp_path / "pageviews-20240401-000000").write_text("en Foo 7 0\n")
+    (tmp_path / "pageviews-20240501-000000").write_text("en Foo 5 0\nen.m Foo 2 0\n")
+    assert [p.name for p in list_dump_files(tmp_path)] == ["pageviews-202404-user", "pageviews-20240501-000000"]
+    assert scan_dumps(tmp_path, ["Foo"], workers=1) == {"Foo": {"2024-04": 100, "2024-05": 7}}
@@ -0,0 +1,22 @@
+# test_pageview_store.py
+# common/pageview_store.py：窗口不全的标题不写 views_12m，fill() 返回其个数。
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.pageview_store import PageviewStore, month_add
+
+def test_fill_skips_incomplete_windows(tmp_path):
+    store = PageviewStore(tmp_path / "pv.npz")
+    for k in range(12):
+        store.put("Full", month_add("2024-05", k), 10)
+    for k in range(6):                       # 只取到后半个窗口（如 refresh 中途失败）
+        store.put("Half", month_add("2024-11", k), 5)
+    store.mark_known("Quiet", "2024-05", "2025-04")   # 取过、整年没有访问量
+
+    items = [{"title": "Full"}, {"title": "Half"}, {"title": "Quiet"}, {"title": "Never"}, {"label": "no title"}]
+    assert store.fill(items, "2025-04") == 2
+    assert [it.get("views_12m") for it in items] == [120, None, 0, None, None]
+    # 窗口超出已存月份也算不全
+    assert store.fill([{"title": "Full"}], "2025-05") == 1